@@ -1,3 +1,34 @@
-from .preprocessing import remove_comments, format_code, extract_chunks
-from .embedding import get_embedding
-from .detection import detect_duplicate_groups, print_groups, detect_duplicate_groups_enhanced
+import importlib
+
+# Public names and the submodule defining each. Submodules are imported on
+# first access, so `import Duplicate_Tool` does not pull in numpy, torch or
+# the model until something actually needs them.
+_EXPORTS = {
+    "remove_comments": "preprocessing",
+    "format_java_code": "preprocessing",
+    "normalize_code": "preprocessing",
+    "extract_chunks": "preprocessing",
+    "get_embedding": "embedding",
+    "get_embeddings": "embedding",
+    "detect_duplicate_groups": "detection",
+    "print_groups": "detection",
+    "detect_duplicate_groups_enhanced": "detection",
+    "scan_directory": "scanner",
+    "scan_directory_async": "aio",
+    "detect_duplicate_groups_async": "aio",
+    "DuplicateIndex": "index",
+    "write_report": "report",
+    "profile": "profiling",
+}
+
+__all__ = list(_EXPORTS)
+
+def __getattr__(name):
+    if name in _EXPORTS:
+        value = getattr(importlib.import_module(f".{_EXPORTS[name]}", __name__), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -0,0 +1,472 @@
+import asyncio
+import itertools
+import os
+import struct
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from .chunker import DECLARATION_KINDS, METHOD_KINDS
+from .detection import extract_code_chunks, group_embeddings
+from .embedding import get_embeddings, load_model
+from .formatter import CLI_OPTIONS, JAR_PATH, JAVAC_EXPORTS, WORKER_SOURCE
+from .preprocessing import handle_overlapping_chunks
+from .profiling import count
+from .scanner import chunk_file_source, iter_java_files
+
+class AsyncJavaFormatter:
+    """google-java-format driven from asyncio subprocesses.
+
+    Like formatter.JavaFormatter, sources are streamed as length-prefixed
+    frames to long-lived FormatterWorker JVMs, but the pipes are asyncio
+    streams, so awaiting a format never blocks the event loop. Up to
+    `workers` JVMs run at once, each taking one source at a time; a worker
+    that dies or times out frees its slot for a replacement. If workers
+    cannot be started (or die before formatting anything), sources are
+    formatted by one `java -jar ... -` run each instead. Sources that fail
+    to format are returned unchanged.
+    """
+
+    def __init__(self, jar_path=JAR_PATH, java='java', timeout=30, workers=2):
+        self.jar_path = jar_path
+        self.java = java
+        self.timeout = timeout
+        self.workers = workers
+        # Guarded by _condition: idle workers, and the worker slots taken by
+        # running or starting JVMs
+        self._condition = None
+        self._idle = []
+        self._slots = 0
+        self._processes = []
+        self._proven = set()
+        self._worker_failed = False
+        self.available = os.path.exists(jar_path)
+        if not self.available:
+            print(f"Warning: Google Java Format jar not found at {jar_path}")
+
+    async def format(self, java_code):
+        """Format one source"""
+        if not self.available:
+            return java_code
+        count("format.sources")
+        process = await self._acquire()
+        if process is not None:
+            result = await self._format_with_worker(process, java_code)
+            if result is not None:
+                return result
+        return await self._format_with_cli(java_code)
+
+    async def format_many(self, sources):
+        """Format sources concurrently, returning them in the same order"""
+        return list(await asyncio.gather(*(self.format(source) for source in sources)))
+
+    async def close(self):
+        """Stop the worker JVMs"""
+        processes, self._processes, self._idle = self._processes, [], []
+        self._slots = 0
+        self._proven = set()
+        if self._condition is not None:
+            async with self._condition:
+                self._condition.notify_all()
+        for process in processes:
+            try:
+                process.stdin.close()
+                await asyncio.wait_for(process.wait(), 5)
+            except (OSError, asyncio.TimeoutError):
+                process.kill()
+
+    async def _acquire(self):
+        """Wait for an idle worker, starting one while fewer than `workers`
+        run; None once workers are known not to start"""
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        async with self._condition:
+            while True:
+                if self._idle:
+                    return self._idle.pop()
+                if not self._worker_failed and self._slots < self.workers:
+                    # Take the slot before starting the JVM, so concurrent
+                    # callers cannot all pass the check
+                    self._slots += 1
+                    break
+                if not self._slots:
+                    return None
+                await self._condition.wait()
+        try:
+            process = await asyncio.create_subprocess_exec(
+                self.java, *JAVAC_EXPORTS, '-cp', self.jar_path, WORKER_SOURCE,
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.DEVNULL,
+            )
+        except BaseException as e:
+            if isinstance(e, OSError):
+                print(f"Error starting Google Java Format worker: {e}")
+                self._worker_failed = True
+            await self._release_slot()
+            if isinstance(e, OSError):
+                return None
+            raise
+        self._processes.append(process)
+        return process
+
+    async def _release_slot(self):
+        """Give up a worker slot and wake the waiters to start a replacement
+        or fall back to `java -jar`"""
+        async with self._condition:
+            self._slots -= 1
+            self._condition.notify_all()
+
+    async def _format_with_worker(self, process, java_code):
+        """Send one frame to a worker; returns None if the worker failed"""
+        payload = java_code.encode('utf-8')
+        try:
+            process.stdin.write(struct.pack('>i', len(payload)) + payload)
+            await process.stdin.drain()
+            header = await asyncio.wait_for(process.stdout.readexactly(5), self.timeout)
+            status, length = header[0], struct.unpack('>i', header[1:])[0]
+            result = (await asyncio.wait_for(process.stdout.readexactly(length), self.timeout)).decode('utf-8')
+        except BaseException as e:
+            # A failed, timed out or cancelled frame leaves the pipe out of
+            # step, so the worker is replaced
+            if process.returncode is None:
+                try:
+                    process.kill()
+                except ProcessLookupError:
+                    pass
+            if process in self._processes:
+                self._processes.remove(process)
+                if process not in self._proven:
+                    # It never formatted anything: workers do not run here
+                    self._worker_failed = True
+                self._proven.discard(process)
+                await self._release_slot()
+            if not isinstance(e, (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError)):
+                raise
+            print(f"Google Java Format worker stopped: {e}")
+            return None
+
+        self._proven.add(process)
+        async with self._condition:
+            if process in self._processes:
+                self._idle.append(process)
+            self._condition.notify()
+        if status != 0:
+            print(f"Google Java Format error: {result}")
+            return java_code
+        return result
+
+    async def _format_with_cli(self, java_code):
+        try:
+            process = await asyncio.create_subprocess_exec(
+                self.java, '-jar', self.jar_path, *CLI_OPTIONS, '-',
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+            )
+        except OSError as e:
+            # No usable java executable; stop trying for this formatter
+            print(f"Error formatting code: {e}")
+            self.available = False
+            return java_code
+        try:
+            stdout, stderr = await asyncio.wait_for(process.communicate(java_code.encode('utf-8')), self.timeout)
+        except asyncio.TimeoutError as e:
+            process.kill()
+            print(f"Error formatting code: {e}")
+            return java_code
+        if process.returncode != 0:
+            print(f"Google Java Format error: {stderr.decode('utf-8', errors='replace')}")
+            return java_code
+        return stdout.decode('utf-8')
+
+class EmbeddingBatcher:
+    """Coalesces concurrent embedding requests into shared batches.
+
+    The first request to arrive opens a window of `window` seconds; every
+    request made during it joins the same get_embeddings call (up to
+    max_batch chunks, identical chunks embedded once). The model runs on a
+    single background thread, so the event loop never blocks on it.
+    """
+
+    def __init__(self, window=0.005, max_batch=256, batch_size=32, cache=None, backend="torch"):
+        self.window = window
+        self.max_batch = max_batch
+        self.batch_size = batch_size
+        self.cache = cache
+        self.backend = backend
+        self._pending = []
+        self._wakeup = None
+        self._task = None
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+    async def embed(self, chunks):
+        """Embed chunks, sharing the forward pass with concurrent callers"""
+        chunks = list(chunks)
+        if not chunks:
+            return np.zeros((0, 0), dtype=np.float32)
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.ensure_future(self._run())
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((chunks, future))
+        self._wakeup.set()
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._wakeup.wait()
+            await asyncio.sleep(self.window)
+            self._wakeup.clear()
+
+            # Take whole requests until the batch is full (always at least one)
+            taken = []
+            size = 0
+            while self._pending and (not taken or size + len(self._pending[0][0]) <= self.max_batch):
+                request = self._pending.pop(0)
+                taken.append(request)
+                size += len(request[0])
+            if self._pending:
+                self._wakeup.set()
+
+            unique = list(dict.fromkeys(chunk for chunks, _ in taken for chunk in chunks))
+            count("batcher.batches")
+            count("batcher.requests", len(taken))
+            try:
+                embeddings = await loop.run_in_executor(
+                    self._executor,
+                    lambda: get_embeddings(unique, batch_size=self.batch_size, cache=self.cache, backend=self.backend),
+                )
+            except Exception as e:
+                for _, future in taken:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            rows = {chunk: row for row, chunk in enumerate(unique)}
+            for chunks, future in taken:
+                if not future.done():
+                    future.set_result(embeddings[[rows[chunk] for chunk in chunks]])
+
+    def warm(self):
+        """Load the model and run one forward pass so the first request is fast"""
+        load_model()
+        get_embeddings(["void warm() { }"], backend=self.backend)
+
+    async def close(self):
+        """Stop the batching task and the model thread"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self._executor.shutdown(wait=False)
+
+async def detect_duplicate_groups_async(java_code, threshold=0.90, use_formatting=True, detect_intra_method=True,
+                                        formatter=None, batcher=None):
+    """Async counterpart of detection.detect_duplicate_groups_enhanced for
+    one source, returning (chunk code list, avg_similarity) pairs.
+
+    Methods and blocks are grouped separately, blocks with a higher
+    threshold, as in a directory scan. Pass a shared AsyncJavaFormatter and
+    EmbeddingBatcher to reuse their JVMs and model thread across calls.
+    """
+    loop = asyncio.get_running_loop()
+    async with _Resources(formatter, batcher) as (formatter, batcher):
+        if use_formatting:
+            java_code = await formatter.format(java_code)
+        records = await loop.run_in_executor(None, lambda: extract_code_chunks(java_code, use_formatting=False))
+        if not detect_intra_method:
+            # Whole declarations only, as in detect_duplicate_groups_enhanced
+            records = [record for record in records if record.kind in DECLARATION_KINDS]
+        kinds = {}
+        for record in records:
+            kinds.setdefault(record.code, record.kind)
+        chunks = handle_overlapping_chunks([record.code for record in records])
+        if len(chunks) < 2:
+            return []
+        embeddings = await batcher.embed(chunks)
+
+        duplicate_groups = []
+        for is_method, kind_threshold in ((True, threshold), (False, threshold + 0.05)):
+            indices = [index for index, chunk in enumerate(chunks) if (kinds[chunk] in METHOD_KINDS) == is_method]
+            if len(indices) < 2:
+                continue
+            groups = await loop.run_in_executor(None, group_embeddings, embeddings[indices], kind_threshold)
+            for group, similarity in groups:
+                duplicate_groups.append(([chunks[indices[index]] for index in group], similarity))
+        return duplicate_groups
+
+async def scan_directory_async(root, threshold=0.90, use_formatting=True, detect_intra_method=True, batch_size=32,
+                               concurrency=8, queue_size=8, grouping="clique", formatter=None, batcher=None):
+    """Async counterpart of scanner.scan_directory, as an async iterator of
+    (chunks, avg_similarity) groups.
+
+    Up to `concurrency` files are read, formatted and chunked at once
+    (reads and chunking in the default executor, formatting through
+    asyncio subprocesses). Their chunks pass through a queue of at most
+    queue_size batches to the EmbeddingBatcher, so parsing waits whenever
+    the model falls behind. Method batches are embedded ahead of block
+    batches, so method groups are final, and yielded, as soon as the last
+    file is parsed and its methods embedded, while the blocks are still
+    being embedded; block groups follow. Scans of other trees sharing the
+    loop keep running meanwhile (see scan_repositories).
+    """
+    loop = asyncio.get_running_loop()
+    async with _Resources(formatter, batcher) as (formatter, batcher):
+        # (priority, sequence, family, batch): methods before blocks, and the
+        # end marker after both
+        batches = asyncio.PriorityQueue(maxsize=queue_size)
+        files = asyncio.Queue()
+        for path in iter_java_files(root):
+            files.put_nowait(path)
+        chunks = {'method': [], 'block': []}
+        embedded = {'method': [], 'block': []}
+        sequence = itertools.count()
+        method_batches = {'queued': 0, 'embedded': 0, 'parsed': False}
+        methods_done = asyncio.Event()
+
+        def check_methods():
+            if method_batches['parsed'] and method_batches['embedded'] == method_batches['queued']:
+                methods_done.set()
+
+        async def put(family, batch):
+            if family == 'method':
+                method_batches['queued'] += 1
+            await batches.put((0 if family == 'method' else 1, next(sequence), family, batch))
+
+        async def parse():
+            pending = {'method': [], 'block': []}
+            while not files.empty():
+                path = files.get_nowait()
+                source = await loop.run_in_executor(None, _read_source, path)
+                formatted = await formatter.format(source) if use_formatting else None
+                file_chunks = await loop.run_in_executor(
+                    None, lambda: chunk_file_source(path, source, formatted, detect_intra_method=detect_intra_method))
+                count("files")
+                count("chunks.extracted", len(file_chunks))
+                for chunk in file_chunks:
+                    pending['method' if chunk.kind in METHOD_KINDS else 'block'].append(chunk)
+                for family, family_pending in pending.items():
+                    while len(family_pending) >= batch_size:
+                        await put(family, family_pending[:batch_size])
+                        del family_pending[:batch_size]
+            for family, family_pending in pending.items():
+                if family_pending:
+                    await put(family, family_pending)
+
+        async def embed():
+            while True:
+                _, _, family, batch = await batches.get()
+                if batch is None:
+                    return
+                embedded[family].append(await batcher.embed([chunk.code for chunk in batch]))
+                chunks[family].extend(batch)
+                if family == 'method':
+                    method_batches['embedded'] += 1
+                    check_methods()
+
+        parsers = [asyncio.ensure_future(parse()) for _ in range(concurrency)]
+
+        async def produce():
+            await asyncio.gather(*parsers)
+            method_batches['parsed'] = True
+            check_methods()
+            await batches.put((2, next(sequence), None, None))
+
+        async def group_family(family, kind_threshold):
+            if len(chunks[family]) < 2:
+                return []
+            embeddings = np.vstack(embedded[family])
+            groups = await loop.run_in_executor(
+                None, lambda: group_embeddings(embeddings, kind_threshold, grouping=grouping))
+            return [([chunks[family][index] for index in group], avg_similarity) for group, avg_similarity in groups]
+
+        # Either side failing stops the other
+        producer = asyncio.ensure_future(produce())
+        embedder = asyncio.ensure_future(embed())
+        tasks = parsers + [producer, embedder]
+        try:
+            await _wait_for(methods_done, [producer, embedder])
+            for group in await group_family('method', threshold):
+                yield group
+            await asyncio.gather(producer, embedder)
+            for group in await group_family('block', threshold + 0.05):
+                yield group
+        finally:
+            for task in tasks:
+                task.cancel()
+
+async def _wait_for(event, tasks):
+    """Wait until event is set, raising the error of the first of tasks to fail"""
+    waiter = asyncio.ensure_future(event.wait())
+    try:
+        while not event.is_set():
+            await asyncio.wait([waiter, *(task for task in tasks if not task.done())],
+                               return_when=asyncio.FIRST_COMPLETED)
+            for task in tasks:
+                if task.done() and not task.cancelled() and task.exception() is not None:
+                    raise task.exception()
+    finally:
+        waiter.cancel()
+
+async def scan_repositories(roots, formatter=None, batcher=None, **options):
+    """Scan several trees concurrently, yielding (root, group) pairs as each
+    scan produces them.
+
+    The scans share one AsyncJavaFormatter and one EmbeddingBatcher, so
+    chunks of different trees are embedded in the same batches. options are
+    passed on to scan_directory_async.
+    """
+    async with _Resources(formatter, batcher) as (formatter, batcher):
+        results = asyncio.Queue()
+
+        async def scan(root):
+            try:
+                async for group in scan_directory_async(root, formatter=formatter, batcher=batcher, **options):
+                    await results.put((root, group))
+            finally:
+                await results.put(None)
+
+        tasks = [asyncio.ensure_future(scan(root)) for root in roots]
+        try:
+            remaining = len(tasks)
+            while remaining:
+                item = await results.get()
+                if item is None:
+                    remaining -= 1
+                else:
+                    yield item
+            # Re-raise the first failed scan, if any
+            for task in tasks:
+                task.result()
+        finally:
+            for task in tasks:
+                task.cancel()
+
+class _Resources:
+    """Use the given formatter and batcher, or create (and afterwards close)
+    ones of their own"""
+
+    def __init__(self, formatter, batcher):
+        self.formatter = formatter
+        self.batcher = batcher
+        self.owned = []
+
+    async def __aenter__(self):
+        if self.formatter is None:
+            self.formatter = AsyncJavaFormatter()
+            self.owned.append(self.formatter)
+        if self.batcher is None:
+            self.batcher = EmbeddingBatcher()
+            self.owned.append(self.batcher)
+        return self.formatter, self.batcher
+
+    async def __aexit__(self, *exc):
+        for resource in self.owned:
+            await resource.close()
+
+def _read_source(path):
+    with open(path, 'r', encoding='utf-8', errors='replace') as f:
+        return f.read()
@@ -0,0 +1,190 @@
+import numpy as np
+from .profiling import count
+from .similarity import normalize_embeddings
+
+class LSHIndex:
+    """Random-hyperplane LSH index over cosine similarity.
+
+    Each of num_tables tables hashes a vector to the sign pattern of its
+    projection on num_bits random hyperplanes. Vectors that share a bucket in
+    any table become candidates, and candidates are re-scored with exact
+    cosine similarity, so the index only trades recall for speed.
+    """
+
+    def __init__(self, num_tables=16, num_bits=8, seed=0, max_bucket_size=256):
+        if num_bits > 63:
+            raise ValueError("num_bits must be at most 63")
+        self.num_tables = num_tables
+        self.num_bits = num_bits
+        self.seed = seed
+        self.max_bucket_size = max_bucket_size
+        self.vectors = None
+        self.center = None
+        self.planes = None
+        self.tables = []
+        self._sorted_keys = []
+
+    def fit(self, embeddings):
+        """Hash every embedding into the index tables"""
+        self.vectors = normalize_embeddings(embeddings)
+        dim = self.vectors.shape[1]
+
+        # Code embeddings all live in a narrow cone, so hyperplanes through the
+        # origin would put nearly everything in one bucket. Hashing the
+        # centred vectors spreads the buckets out; scoring still uses the
+        # original cosine similarity.
+        self.center = self.vectors.mean(axis=0) if len(self.vectors) else np.zeros(dim, dtype=np.float32)
+
+        rng = np.random.default_rng(self.seed)
+        self.planes = rng.standard_normal((self.num_tables, dim, self.num_bits)).astype(np.float32)
+
+        # Each table keeps the ids sorted by bucket key, plus a map from bucket
+        # key to its (start, stop) range in that order
+        self.tables = []
+        self._sorted_keys = []
+        for keys in self._hash(self.vectors):
+            order = np.argsort(keys, kind="stable")
+            self._add_table(order, keys[order])
+        return self
+
+    def _add_table(self, order, sorted_keys):
+        if not len(order):
+            # Nothing indexed: no buckets, so every query has no candidates
+            self.tables.append((order, {}))
+            self._sorted_keys.append(sorted_keys)
+            return
+        boundaries = np.flatnonzero(np.diff(sorted_keys)) + 1
+        starts = np.concatenate([[0], boundaries]).astype(np.int64)
+        stops = np.concatenate([boundaries, [len(order)]]).astype(np.int64)
+        buckets = dict(zip(sorted_keys[starts].tolist(), zip(starts.tolist(), stops.tolist())))
+        self.tables.append((order, buckets))
+        self._sorted_keys.append(sorted_keys)
+
+    def save(self, path, **extra):
+        """Write the hyperplanes and tables to an .npz file.
+
+        The vectors themselves are not saved; pass the same embeddings to
+        load. Extra arrays are stored alongside and returned by load.
+        """
+        np.savez(
+            path,
+            params=np.array([self.num_tables, self.num_bits, self.seed, self.max_bucket_size]),
+            center=self.center,
+            planes=self.planes,
+            orders=np.array([order for order, _ in self.tables]).reshape(self.num_tables, len(self.vectors)),
+            keys=np.array(self._sorted_keys).reshape(self.num_tables, len(self.vectors)),
+            **extra,
+        )
+
+    @classmethod
+    def load(cls, path, embeddings):
+        """Read an index written by save, over the embeddings it was fitted on.
+
+        Returns (index, extra arrays).
+        """
+        with np.load(path) as data:
+            arrays = {name: data[name] for name in data.files}
+        num_tables, num_bits, seed, max_bucket_size = arrays.pop('params').tolist()
+        index = cls(num_tables=num_tables, num_bits=num_bits, seed=seed, max_bucket_size=max_bucket_size)
+        index.vectors = normalize_embeddings(embeddings)
+        if len(index.vectors) != arrays['orders'].shape[1]:
+            raise ValueError(f"{path} indexes {arrays['orders'].shape[1]} vectors, not {len(index.vectors)}")
+        index.center = arrays.pop('center')
+        index.planes = arrays.pop('planes')
+        index._sorted_keys = []
+        for order, sorted_keys in zip(arrays.pop('orders'), arrays.pop('keys')):
+            index._add_table(order, sorted_keys)
+        return index, arrays
+
+    def _hash(self, vectors):
+        """Return one array of integer bucket keys per table"""
+        centred = vectors - self.center
+        powers = (1 << np.arange(self.num_bits, dtype=np.int64))
+        return [((centred @ planes) > 0).astype(np.int64) @ powers for planes in self.planes]
+
+    def candidates(self, vectors):
+        """Return, for each query vector, the ids sharing a bucket in any table"""
+        per_query = [[] for _ in range(len(vectors))]
+        for (order, buckets), keys in zip(self.tables, self._hash(vectors)):
+            for query, key in enumerate(keys.tolist()):
+                bucket = buckets.get(key)
+                if bucket is not None:
+                    start, stop = bucket
+                    per_query[query].append(order[start:min(stop, start + self.max_bucket_size)])
+
+        return [
+            np.unique(np.concatenate(buckets)) if buckets else np.empty(0, dtype=np.int64)
+            for buckets in per_query
+        ]
+
+    def query(self, embeddings, k=10, threshold=None):
+        """Return (ids, similarities) of the top-k indexed neighbours per query"""
+        queries = normalize_embeddings(embeddings)
+        results = []
+        for vector, ids in zip(queries, self.candidates(queries)):
+            scores = self.vectors[ids] @ vector
+            if threshold is not None:
+                keep = scores > threshold
+                ids, scores = ids[keep], scores[keep]
+            if len(ids) > k:
+                top = np.argpartition(-scores, k - 1)[:k]
+                ids, scores = ids[top], scores[top]
+            order = np.argsort(-scores, kind="stable")
+            results.append((ids[order], scores[order]))
+        return results
+
+    def _bucket_members(self):
+        """Yield the member ids of every bucket, across all tables, holding at
+        least two vectors.
+
+        Buckets larger than max_bucket_size are split into consecutive pieces
+        of that size, which bounds the cost of a degenerate hash.
+        """
+        for order, buckets in self.tables:
+            for start, stop in buckets.values():
+                for piece in range(start, stop, self.max_bucket_size):
+                    piece_stop = min(piece + self.max_bucket_size, stop)
+                    if piece_stop - piece > 1:
+                        yield order[piece:piece_stop]
+
+    def neighbour_edges(self, threshold, k=10):
+        """Yield (i, j, similarity) with i < j for each indexed vector's top-k
+        neighbours above threshold, each pair once"""
+        n = len(self.vectors)
+        found = []
+        for ids in self._bucket_members():
+            # Score the whole bucket against itself with one matrix product
+            members = self.vectors[ids]
+            block = members @ members.T
+            count("pairs.compared", len(ids) * (len(ids) - 1) // 2)
+            rows, cols = np.nonzero(np.triu(block > threshold, k=1))
+            if len(rows):
+                a, b = ids[rows], ids[cols]
+                found.append((np.minimum(a, b) * n + np.maximum(a, b), block[rows, cols]))
+
+        if not found:
+            return
+        pair_ids = np.concatenate([ids for ids, _ in found])
+        scores = np.concatenate([values for _, values in found])
+        pair_ids, first = np.unique(pair_ids, return_index=True)
+        scores = scores[first]
+        low, high = pair_ids // n, pair_ids % n
+
+        # Keep a pair if it is among the top-k neighbours of either endpoint
+        nodes = np.concatenate([low, high])
+        both_scores = np.concatenate([scores, scores])
+        order = np.lexsort((-both_scores, nodes))
+        sorted_nodes = nodes[order]
+        rank = np.arange(len(order)) - np.searchsorted(sorted_nodes, sorted_nodes, side="left")
+        in_top_k = np.zeros(len(order), dtype=bool)
+        in_top_k[order] = rank < k
+        keep = in_top_k[:len(scores)] | in_top_k[len(scores):]
+
+        count("edges", int(keep.sum()))
+        for i, j, similarity in zip(low[keep].tolist(), high[keep].tolist(), scores[keep].tolist()):
+            yield i, j, similarity
+
+def ann_edges(embeddings, threshold, k=10, num_tables=16, num_bits=8, seed=0):
+    """Approximate counterpart of similarity.similarity_edges built on LSHIndex"""
+    index = LSHIndex(num_tables=num_tables, num_bits=num_bits, seed=seed).fit(embeddings)
+    return index.neighbour_edges(threshold, k=k)
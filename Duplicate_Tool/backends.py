@@ -0,0 +1,165 @@
+import copy
+import os
+import threading
+import warnings
+
+import numpy as np
+
+BACKENDS = ("torch", "quantized", "onnx")
+
+ONNX_DIR = os.path.join(os.path.expanduser("~"), ".cache", "duplicate_tool", "onnx")
+
+def mean_pool(hidden_states, attention_mask):
+    """Average token states, ignoring padding positions"""
+    mask = attention_mask.unsqueeze(-1).to(hidden_states.dtype)
+    summed = (hidden_states * mask).sum(dim=1)
+    counts = mask.sum(dim=1).clamp(min=1)
+    return summed / counts
+
+# Thread settings from configure_threads, also applied to ONNX sessions
+_intra_op_threads = None
+_inter_op_threads = None
+
+def configure_threads(intra_op=None, inter_op=None):
+    """Set how many CPU threads torch uses within and across operators.
+
+    None leaves a setting at torch's default. torch only accepts the
+    inter-op setting before its first parallel operation, so a late call
+    keeps the old value and prints a warning. The ONNX backend reads the same
+    settings when it creates its session.
+    """
+    import torch
+    global _intra_op_threads, _inter_op_threads
+    if intra_op is not None:
+        torch.set_num_threads(intra_op)
+        _intra_op_threads = intra_op
+    if inter_op is not None:
+        try:
+            torch.set_num_interop_threads(inter_op)
+            _inter_op_threads = inter_op
+        except RuntimeError as e:
+            print(f"Warning: could not set inter-op threads: {e}")
+
+class TorchBackend:
+    """Runs the fp32 encoder in torch, under inference_mode"""
+
+    def __init__(self, model):
+        self.model = model
+
+    def embed(self, input_ids, attention_mask):
+        """Mean-pooled embeddings for a padded batch of token ids, as float32"""
+        import torch
+        input_ids = torch.as_tensor(input_ids)
+        attention_mask = torch.as_tensor(attention_mask)
+        with torch.inference_mode():
+            hidden_states = self.model(input_ids=input_ids, attention_mask=attention_mask).last_hidden_state
+            pooled = mean_pool(hidden_states, attention_mask)
+        return pooled.float().numpy()
+
+    def hidden_states(self, input_ids, attention_mask):
+        """Encoder states of every token of a padded batch, as float32
+        (batch x length x d_model)"""
+        import torch
+        with torch.inference_mode():
+            hidden_states = self.model(input_ids=torch.as_tensor(input_ids),
+                                       attention_mask=torch.as_tensor(attention_mask)).last_hidden_state
+        return hidden_states.float().numpy()
+
+class QuantizedBackend(TorchBackend):
+    """The encoder with int8 dynamic quantization of its linear layers.
+
+    Weights are stored as int8 and activations are quantized on the fly, which
+    roughly halves CPU inference time at a small cost in accuracy.
+    """
+
+    def __init__(self, model):
+        import torch
+        from torch.ao.quantization import quantize_dynamic
+        # Quantize a copy so the fp32 backend keeps working
+        super().__init__(quantize_dynamic(copy.deepcopy(model), {torch.nn.Linear}, dtype=torch.qint8))
+
+class OnnxBackend:
+    """The encoder exported to ONNX and run with onnxruntime.
+
+    The export includes the mean pooling, so only one vector per chunk comes
+    back from the runtime. Exported models are kept under ONNX_DIR and reused
+    across runs.
+    """
+
+    def __init__(self, model, model_name, revision, export_dir=ONNX_DIR):
+        try:
+            import onnxruntime
+        except ImportError:
+            raise ImportError("The onnx backend needs onnxruntime: pip install onnxruntime")
+
+        path = os.path.join(export_dir, f"{model_name.replace('/', '--')}@{revision}.onnx")
+        if not os.path.exists(path):
+            export_onnx(model, path)
+
+        options = onnxruntime.SessionOptions()
+        if _intra_op_threads is not None:
+            options.intra_op_num_threads = _intra_op_threads
+        if _inter_op_threads is not None:
+            options.inter_op_num_threads = _inter_op_threads
+        self.session = onnxruntime.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+
+    def embed(self, input_ids, attention_mask):
+        """Mean-pooled embeddings for a padded batch of token ids, as float32"""
+        feeds = {
+            "input_ids": np.asarray(input_ids, dtype=np.int64),
+            "attention_mask": np.asarray(attention_mask, dtype=np.int64),
+        }
+        return self.session.run(["embedding"], feeds)[0].astype(np.float32, copy=False)
+
+def export_onnx(model, path):
+    """Export encoder + mean pooling to an ONNX file with dynamic batch and length"""
+    import torch
+
+    class PooledEncoder(torch.nn.Module):
+        def __init__(self, encoder):
+            super().__init__()
+            self.encoder = encoder
+
+        def forward(self, input_ids, attention_mask):
+            hidden_states = self.encoder(input_ids=input_ids, attention_mask=attention_mask).last_hidden_state
+            return mean_pool(hidden_states, attention_mask)
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    example = torch.ones((2, 8), dtype=torch.long)
+    # Write to a temp name first so an interrupted export is never reused
+    partial = f"{path}.{os.getpid()}.tmp"
+    with torch.inference_mode(), warnings.catch_warnings():
+        # Tracing warns about Python-side shape checks in the encoder, which
+        # hold for every input shape
+        warnings.simplefilter("ignore")
+        torch.onnx.export(
+            PooledEncoder(model).eval(),
+            (example, example),
+            partial,
+            input_names=["input_ids", "attention_mask"],
+            output_names=["embedding"],
+            dynamic_axes={
+                "input_ids": {0: "batch", 1: "length"},
+                "attention_mask": {0: "batch", 1: "length"},
+                "embedding": {0: "batch"},
+            },
+            dynamo=False,
+        )
+    os.replace(partial, path)
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+def get_backend(name, model, model_name, revision):
+    """Return the shared backend called name, creating it on first use"""
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown inference backend: {name} (choose from {', '.join(BACKENDS)})")
+    with _backends_lock:
+        if name not in _backends:
+            if name == "torch":
+                _backends[name] = TorchBackend(model)
+            elif name == "quantized":
+                _backends[name] = QuantizedBackend(model)
+            else:
+                _backends[name] = OnnxBackend(model, model_name, revision)
+        return _backends[name]
@@ -0,0 +1,194 @@
+import hashlib
+import os
+import sqlite3
+import threading
+
+import numpy as np
+from .preprocessing import normalize_whitespace
+
+class EmbeddingCache:
+    """Persistent, content-addressed store of chunk embeddings.
+
+    Entries are keyed by a hash of the whitespace-normalized chunk text plus
+    the model name and revision, so identical code is only embedded once
+    across runs. Vectors live in a fixed-size memory-mapped float32 file with
+    one slot per entry; a small SQLite index maps keys to slots and tracks
+    recency. When the cache is full the least recently used slots are reused.
+
+    Every batch operation runs inside an exclusive SQLite transaction, which
+    serializes access to the slots across processes sharing the directory.
+    """
+
+    def __init__(self, path, model_name, revision="main", max_entries=200000, timeout=60.0):
+        self.path = path
+        self.model_name = model_name
+        self.revision = revision
+        self.max_entries = max_entries
+        os.makedirs(path, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._vectors = None
+        self._db = sqlite3.connect(
+            os.path.join(path, "index.sqlite3"),
+            timeout=timeout,
+            isolation_level=None,
+            check_same_thread=False,
+        )
+        with self._transaction():
+            self._db.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER)")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS entries "
+                "(key TEXT PRIMARY KEY, slot INTEGER UNIQUE, last_used INTEGER)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used)")
+            self._db.execute("INSERT OR IGNORE INTO meta VALUES ('capacity', ?)", (max_entries,))
+            self._db.execute("INSERT OR IGNORE INTO meta VALUES ('clock', 0)")
+            # An existing cache keeps the capacity it was created with
+            self.max_entries = self._meta("capacity")
+
+    def key(self, chunk):
+        """Content hash identifying a chunk's embedding under this model"""
+        text = f"{self.model_name}@{self.revision}\0{normalize_whitespace(chunk)}"
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def get_many(self, chunks):
+        """Return {position: vector} for every chunk already in the cache"""
+        keys = [self.key(chunk) for chunk in chunks]
+        found = {}
+        with self._transaction():
+            dim = self._meta("dim")
+            if dim is None:
+                return found
+
+            vectors = self._open_vectors(dim)
+            slots = self._slots(set(keys))
+            if slots:
+                clock = self._tick()
+                self._db.executemany(
+                    "UPDATE entries SET last_used = ? WHERE key = ?",
+                    [(clock, key) for key in slots],
+                )
+            for position, key in enumerate(keys):
+                if key in slots:
+                    found[position] = np.array(vectors[slots[key]])
+        return found
+
+    def put_many(self, chunks, embeddings):
+        """Store one embedding row per chunk, evicting least recently used entries"""
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        entries = {}
+        for chunk, vector in zip(chunks, embeddings):
+            entries[self.key(chunk)] = vector
+        if not entries:
+            return
+
+        with self._transaction():
+            dim = self._meta("dim")
+            if dim is None:
+                dim = embeddings.shape[1]
+                self._db.execute("INSERT INTO meta VALUES ('dim', ?)", (dim,))
+            elif dim != embeddings.shape[1]:
+                raise ValueError(f"Cache at {self.path} holds {dim}-dim embeddings, got {embeddings.shape[1]}")
+
+            vectors = self._open_vectors(dim)
+            clock = self._tick()
+
+            # Refresh entries that are already stored before choosing what to
+            # evict, so this batch never evicts its own chunks
+            existing = self._slots(entries)
+            self._db.executemany(
+                "UPDATE entries SET last_used = ? WHERE key = ?",
+                [(clock, key) for key in existing],
+            )
+
+            # Only the capacity left after this batch's own entries is
+            # available, so the refreshed entries are never evicted below
+            new_keys = [key for key in entries if key not in existing][:self.max_entries - len(existing)]
+            free_slots = self._free_slots(len(new_keys), clock)
+            for key, slot in zip(new_keys, free_slots):
+                vectors[slot] = entries[key]
+            vectors.flush()
+
+            self._db.executemany(
+                "INSERT INTO entries VALUES (?, ?, ?)",
+                [(key, slot, clock) for key, slot in zip(new_keys, free_slots)],
+            )
+
+    def __len__(self):
+        return self._db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def close(self):
+        self._db.close()
+        self._vectors = None
+
+    def _transaction(self):
+        return _ExclusiveTransaction(self._db, self._lock)
+
+    def _meta(self, name):
+        row = self._db.execute("SELECT value FROM meta WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else None
+
+    def _tick(self):
+        self._db.execute("UPDATE meta SET value = value + 1 WHERE name = 'clock'")
+        return self._meta("clock")
+
+    def _slots(self, keys):
+        """Return {key: slot} for the given keys that are stored"""
+        slots = {}
+        keys = list(keys)
+        for start in range(0, len(keys), 500):
+            batch = keys[start:start + 500]
+            rows = self._db.execute(
+                f"SELECT key, slot FROM entries WHERE key IN ({','.join('?' * len(batch))})", batch
+            )
+            slots.update(rows.fetchall())
+        return slots
+
+    def _free_slots(self, count, clock):
+        """Return count slots, taking never-used ones first and then evicting
+        the least recently used entries not used at clock"""
+        # Slots are handed out in order and only reused after that, so the
+        # used ones are always 0 .. used - 1
+        used = len(self)
+        slots = list(range(used, min(used + count, self.max_entries)))
+        if len(slots) < count:
+            evicted = self._db.execute(
+                "SELECT key, slot FROM entries WHERE last_used < ? ORDER BY last_used LIMIT ?",
+                (clock, count - len(slots)),
+            ).fetchall()
+            self._db.executemany("DELETE FROM entries WHERE key = ?", [(key,) for key, _ in evicted])
+            slots.extend(slot for _, slot in evicted)
+        return slots
+
+    def _open_vectors(self, dim):
+        if self._vectors is None:
+            vectors_path = os.path.join(self.path, "embeddings.f32")
+            size = self.max_entries * dim * 4
+            # Grow the backing file once to its full (sparse) size
+            with open(vectors_path, "ab") as handle:
+                if handle.tell() < size:
+                    handle.truncate(size)
+            self._vectors = np.memmap(vectors_path, dtype=np.float32, mode="r+", shape=(self.max_entries, dim))
+        return self._vectors
+
+class _ExclusiveTransaction:
+    """Context manager holding SQLite's cross-process write lock"""
+
+    def __init__(self, db, lock):
+        self.db = db
+        self.lock = lock
+
+    def __enter__(self):
+        self.lock.acquire()
+        try:
+            self.db.execute("BEGIN EXCLUSIVE")
+        except BaseException:
+            self.lock.release()
+            raise
+        return self.db
+
+    def __exit__(self, exc_type, exc, traceback):
+        try:
+            self.db.execute("ROLLBACK" if exc_type else "COMMIT")
+        finally:
+            self.lock.release()
@@ -0,0 +1,306 @@
+import re
+from bisect import bisect_right
+from collections import namedtuple
+
+# A method, constructor, lambda or statement block. Lines are 1-based and
+# inclusive; offsets are byte offsets into the UTF-8 source, end exclusive.
+Chunk = namedtuple(
+    'Chunk',
+    ['path', 'kind', 'start_line', 'end_line', 'code', 'start_offset', 'end_offset'],
+    defaults=(None, None),
+)
+
+# A chunk without its code: where it is on disk, its row id in an embedding
+# store and the content hash of its extracted code (see
+# preprocessing.content_hash). The code is read back from the file when needed.
+ChunkRef = namedtuple(
+    'ChunkRef',
+    ['id', 'path', 'kind', 'start_line', 'end_line', 'start_offset', 'end_offset', 'hash'],
+    defaults=(None,),
+)
+
+Token = namedtuple('Token', ['kind', 'text', 'start', 'end'])
+
+# One alternation, tried left to right at every position, so the whole
+# source is tokenized in a single linear pass. Leading whitespace is folded
+# into each match rather than matched on its own, which halves the number of
+# matches. Identifiers accept any non-ASCII byte so UTF-8 names stay in one
+# token.
+_TOKEN_PATTERN = re.compile(rb'''
+    \s*(?:
+    (?P<textblock>"""(?:[^\\]|\\.)*?""")
+  | (?P<string>"(?:[^"\\\n]|\\.)*")
+  | (?P<char>'(?:[^'\\\n]|\\.)*')
+  | (?P<comment>//[^\n]*|/\*.*?\*/)
+  | (?P<name>[A-Za-z_$\x80-\xff][A-Za-z0-9_$\x80-\xff]*)
+  | (?P<number>\.?[0-9](?:[eEpP][+-]|[A-Za-z0-9_.])*)
+  | (?P<op>->|::|\.\.\.|[=!<>]=|&&|\|\||\+\+|--|[-+*/%&|^]=|<<=?|\S)
+    )''', re.VERBOSE | re.DOTALL)
+
+KEYWORDS = frozenset(b'''
+    abstract assert boolean break byte case catch char class const continue
+    default do double else enum extends final finally float for goto if
+    implements import instanceof int interface long native new package
+    private protected public return short static strictfp super switch
+    synchronized this throw throws transient try void volatile while
+    true false null var yield record sealed non-sealed permits
+'''.split())
+
+MODIFIERS = frozenset(b'''
+    public protected private static abstract final native synchronized
+    transient volatile strictfp default sealed non-sealed
+'''.split())
+
+BLOCK_KEYWORDS = frozenset(b'if else for while do try catch finally switch synchronized static'.split())
+
+def tokenize(source):
+    """Yield the code tokens of a Java source (bytes), skipping whitespace and comments"""
+    for match in _TOKEN_PATTERN.finditer(source):
+        kind = match.lastgroup
+        if kind != 'comment':
+            start, end = match.span(kind)
+            yield Token(kind, match.group(kind), start, end)
+
+def blank_comment_bytes(source):
+    """Return source with every comment byte except newlines replaced by a space.
+
+    Offsets and line numbers are unchanged, and comment markers inside
+    string literals are left alone.
+    """
+    blanked = bytearray(source)
+    for match in _TOKEN_PATTERN.finditer(source):
+        if match.lastgroup == 'comment':
+            start, end = match.span('comment')
+            blanked[start:end] = re.sub(rb'[^\n]', b' ', match.group('comment'))
+    return bytes(blanked)
+
+def chunk_java(source, path=None, min_lines=2):
+    """Split Java source into method, constructor, lambda and block chunks.
+
+    source may be str or bytes. A single pass over the tokens tracks, for
+    every open brace, what kind of construct it opened, so the cost is linear
+    in the file size. Methods and constructors are always emitted; lambda
+    bodies and statement blocks (the statements between the braces of a
+    method, constructor, lambda, initializer or compound statement) only when
+    they span at least min_lines lines. Chunk code has comments blanked out;
+    offsets and line numbers refer to the original source.
+    """
+    if isinstance(source, str):
+        source = source.encode('utf-8')
+    code = bytearray(source)  # comments are blanked out as the pass reaches them
+    line_starts = [0] + [match.end() for match in re.finditer(rb'\n', source)]
+
+    def make_chunk(kind, start, end):
+        text = bytes(code[start:end]).decode('utf-8', 'replace').strip()
+        if kind == 'block':
+            # Statement runs are compared without their indentation
+            text = '\n'.join(line.strip() for line in text.split('\n') if line.strip())
+        else:
+            text = '\n'.join(line.rstrip() for line in text.split('\n'))
+        return Chunk(path, kind, bisect_right(line_starts, start), bisect_right(line_starts, end - 1), text, start, end)
+
+    chunks = []
+    blocks = []
+    # Frame: [kind, chunk start, first body token start, saved head, saved depth]
+    stack = [['class', None, None, [], 0]]
+    head = []  # tokens of the current statement or declaration at this level
+    depth = 0  # parenthesis depth within head
+    previous_end = 0
+
+    for match in _TOKEN_PATTERN.finditer(source):
+        if match.lastgroup == 'comment':
+            start, end = match.span('comment')
+            code[start:end] = re.sub(rb'[^\n]', b' ', match.group('comment'))
+            continue
+        token = Token(match.lastgroup, match.group(match.lastgroup), *match.span(match.lastgroup))
+        text = token.text
+        frame = stack[-1]
+        if frame[2] is None:
+            frame[2] = token.start
+
+        if text == b'{':
+            kind, start = _classify_open(frame[0], head, depth)
+            stack.append([kind, start, None, head, depth])
+            head, depth = [], 0
+        elif text == b'}' and len(stack) > 1:
+            kind, start, body_start, saved_head, saved_depth = stack.pop()
+            if kind in CODE_FRAMES:
+                if kind != 'block':
+                    chunks.append(make_chunk(kind, start, token.end))
+                if body_start < previous_end:
+                    blocks.append(make_chunk('block', body_start, previous_end))
+            if kind in EXPRESSION_FRAMES:
+                # The enclosing expression or statement carries on after it
+                head, depth = saved_head + [token], saved_depth
+            else:
+                head, depth = [], 0
+        elif text == b';' and depth == 0:
+            head = []
+            if frame[0] == 'enum':
+                # The enum constant list is over; members follow
+                frame[0] = 'class'
+        else:
+            if text == b'(':
+                depth += 1
+            elif text == b')':
+                depth -= 1
+            head.append(token)
+        previous_end = token.end
+
+    chunks = [chunk for chunk in chunks if chunk.kind != 'lambda' or _line_count(chunk) >= min_lines]
+    blocks = [block for block in blocks if _line_count(block) >= min_lines]
+    return chunks + blocks
+
+# Chunk kinds that are whole callable units rather than statement runs
+DECLARATION_KINDS = frozenset(['method', 'constructor'])
+METHOD_KINDS = frozenset(['method', 'constructor', 'lambda'])
+
+CODE_FRAMES = frozenset(['method', 'constructor', 'lambda', 'block'])
+EXPRESSION_FRAMES = frozenset(['lambda', 'anonymous', 'other'])
+
+def _line_count(chunk):
+    return chunk.end_line - chunk.start_line + 1
+
+def _classify_open(parent, head, depth):
+    """Decide what an opening brace starts, given the tokens before it.
+
+    Returns (kind, chunk start offset). Kinds: 'class', 'enum' and
+    'anonymous' bodies hold declarations; 'method', 'constructor', 'lambda'
+    and 'block' bodies hold statements; 'other' covers array initializers
+    and anything else.
+    """
+    if head and head[-1].text == b'->':
+        if head[0].text in (b'case', b'default'):
+            # Body of a switch rule
+            return 'block', None
+        return 'lambda', _lambda_start(head)
+    if head and head[-1].text == b')' and _is_instance_creation(head):
+        return 'anonymous', None
+    if depth > 0:
+        return 'other', None
+
+    for index, token in enumerate(head):
+        previous = head[index - 1].text if index else None
+        if token.text in (b'class', b'interface') and previous != b'.':
+            return 'class', None
+        if token.text == b'enum' and previous != b'.':
+            return 'enum', None
+        if token.text == b'record' and index + 1 < len(head) and head[index + 1].kind == 'name':
+            return 'class', None
+
+    if parent == 'enum':
+        # Body of an enum constant
+        return 'anonymous', None
+    if parent in ('class', 'anonymous'):
+        declaration = _declaration(head)
+        if declaration is not None:
+            return declaration
+        if not head or [token.text for token in head] == [b'static']:
+            # Instance or static initializer
+            return 'block', None
+        return 'other', None
+
+    if parent in CODE_FRAMES:
+        if (not head
+                or head[0].text in BLOCK_KEYWORDS
+                or head[0].text in (b'case', b'default')
+                or (len(head) > 1 and head[1].text == b':')):
+            return 'block', None
+    return 'other', None
+
+def _declaration(head):
+    """Return ('method' or 'constructor', start offset) if head is a method
+    or constructor declaration, otherwise None"""
+    index = 0
+    start = None
+    while index < len(head):
+        text = head[index].text
+        if text == b'@' and index + 1 < len(head) and head[index + 1].text != b'interface':
+            # Annotation: @Name, @a.b.Name, optionally with arguments
+            index += 2
+            while index + 1 < len(head) and head[index].text == b'.':
+                index += 2
+            if index < len(head) and head[index].text == b'(':
+                index = _skip_group(head, index, b'(', b')')
+        elif text in MODIFIERS:
+            if start is None:
+                start = head[index].start
+            index += 1
+        else:
+            break
+
+    if index >= len(head):
+        return None
+    if start is None:
+        start = head[index].start
+    first = index
+    if head[index].text == b'<':
+        # Type parameters of a generic method or constructor
+        index = _skip_group(head, index, b'<', b'>')
+        first = index
+
+    if len(head) - first == 1 and head[first].kind == 'name':
+        # Compact canonical constructor of a record
+        return 'constructor', start
+
+    paren = index
+    while paren < len(head) and head[paren].text != b'(':
+        if head[paren].text == b'=':
+            return None
+        paren += 1
+    if paren >= len(head) or paren == first:
+        return None
+    name = head[paren - 1]
+    if name.kind != 'name' or name.text in KEYWORDS:
+        return None
+
+    # After the parameters only array brackets and a throws clause may follow
+    for token in head[_skip_group(head, paren, b'(', b')'):]:
+        if token.kind != 'name' and token.text not in (b'.', b',', b'<', b'>', b'?', b'[', b']', b'@'):
+            return None
+        if token.kind == 'name' and token.text != b'throws' and token.text in KEYWORDS:
+            return None
+
+    return ('constructor' if paren - 1 == first else 'method'), start
+
+def _skip_group(head, index, open_text, close_text):
+    """Index just past the token closing the group opened at head[index]"""
+    nesting = 0
+    while index < len(head):
+        if head[index].text == open_text:
+            nesting += 1
+        elif head[index].text == close_text:
+            nesting -= 1
+            if nesting == 0:
+                return index + 1
+        index += 1
+    return index
+
+def _matching_open(head, close_index):
+    """Index of the '(' matching the ')' at head[close_index]"""
+    nesting = 0
+    for index in range(close_index, -1, -1):
+        if head[index].text == b')':
+            nesting += 1
+        elif head[index].text == b'(':
+            nesting -= 1
+            if nesting == 0:
+                return index
+    return 0
+
+def _is_instance_creation(head):
+    """True if head ends with `new Type(...)`, i.e. the brace opens an anonymous class"""
+    index = _matching_open(head, len(head) - 1) - 1
+    while index >= 0 and (head[index].kind == 'name' or head[index].text in (b'.', b'<', b'>', b',', b'?', b'[', b']')):
+        if head[index].text == b'new':
+            return True
+        index -= 1
+    return False
+
+def _lambda_start(head):
+    """Start offset of the parameters of the lambda whose arrow ends head"""
+    if len(head) < 2:
+        return head[-1].start
+    if head[-2].text == b')':
+        return head[_matching_open(head, len(head) - 2)].start
+    return head[-2].start
@@ -0,0 +1,154 @@
+import numpy as np
+from .profiling import count, stage
+from .similarity import normalize_embeddings
+
+# Set bits per byte value, for numpy versions without bitwise_count
+_POPCOUNT = np.array([bin(value).count('1') for value in range(256)], dtype=np.uint8)
+
+class CompactCodec:
+    """PCA projection of embeddings sign-binarized into packed bit codes.
+
+    fit() learns the mean and the top `bits` principal directions of a
+    sample of L2-normalized embeddings; encode() keeps only the sign of each
+    projection, packed into bits / 64 uint64 words per chunk (32 bytes at
+    256 bits instead of 3 KB of float32). The Hamming distance between two
+    codes grows with the angle between the embeddings, so it screens out
+    dissimilar pairs at a fraction of the cost of a float dot product.
+    """
+
+    def __init__(self, bits=256, seed=0):
+        if bits % 64:
+            raise ValueError("bits must be a multiple of 64")
+        self.bits = bits
+        self.seed = seed
+        self.mean = None
+        self.components = None
+
+    def fit(self, embeddings, sample_size=20000):
+        """Fit the projection on (a random sample of) embeddings"""
+        normed = normalize_embeddings(embeddings)
+        rng = np.random.default_rng(self.seed)
+        if len(normed) > sample_size:
+            normed = normed[np.sort(rng.choice(len(normed), sample_size, replace=False))]
+        self.mean = normed.mean(axis=0) if len(normed) else np.zeros(normed.shape[1], dtype=np.float32)
+        centred = normed - self.mean
+        _, _, directions = np.linalg.svd(centred, full_matrices=False)
+        components = directions[:self.bits]
+        # A small sample (or embedding) has fewer principal directions than
+        # bits; random directions make up the rest
+        if len(components) < self.bits:
+            extra = rng.standard_normal((self.bits - len(components), normed.shape[1])).astype(np.float32)
+            components = np.vstack([components, extra])
+        self.components = np.ascontiguousarray(components.T, dtype=np.float32)
+        return self
+
+    def encode(self, embeddings, block_size=8192, normalized=False):
+        """Packed codes of embeddings, as a (n, bits / 64) uint64 matrix"""
+        if self.components is None:
+            raise ValueError("CompactCodec must be fitted before encoding")
+        codes = np.zeros((len(embeddings), self.bits // 64), dtype=np.uint64)
+        for start in range(0, len(embeddings), block_size):
+            block = np.asarray(embeddings[start:start + block_size], dtype=np.float32)
+            if not normalized:
+                block = normalize_embeddings(block)
+            signs = (block - self.mean) @ self.components > 0
+            # Little-endian bytes of 8 packed rows of bits make one uint64
+            packed = np.packbits(signs, axis=1, bitorder='little')
+            codes[start:start + len(block)] = packed.view('<u8')
+        return codes
+
+    def calibrate(self, embeddings, threshold, recall=0.99, sample_size=2000, min_pairs=100, normalized=False):
+        """Largest Hamming distance to keep so that about `recall` of the
+        pairs above threshold survive the screen.
+
+        Measured on the pairs of a random sample. If fewer than min_pairs of
+        them are above threshold, the min_pairs most similar pairs are used
+        instead, which errs towards keeping more pairs.
+        """
+        rng = np.random.default_rng(self.seed)
+        rows = np.arange(len(embeddings))
+        if len(rows) > sample_size:
+            rows = np.sort(rng.choice(len(rows), sample_size, replace=False))
+        sample = np.asarray(embeddings[rows], dtype=np.float32)
+        if not normalized:
+            sample = normalize_embeddings(sample)
+        if len(sample) < 2:
+            return self.bits // 2
+
+        upper = np.triu_indices(len(sample), k=1)
+        similarities = (sample @ sample.T)[upper]
+        distances = hamming_distances(*[self.encode(sample, normalized=True)] * 2)[upper]
+        above = similarities > threshold
+        if above.sum() < min_pairs:
+            above = np.argsort(-similarities)[:min_pairs]
+        return int(np.ceil(np.quantile(distances[above], recall)))
+
+    def save(self, path):
+        np.savez(path, bits=self.bits, seed=self.seed, mean=self.mean, components=self.components)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            codec = cls(bits=int(data['bits']), seed=int(data['seed']))
+            codec.mean = data['mean']
+            codec.components = data['components']
+        return codec
+
+def popcount(words):
+    """Number of set bits in each element of a uint64 array"""
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(words)
+    return _POPCOUNT[words.view(np.uint8)].reshape(*words.shape, 8).sum(axis=-1, dtype=np.uint8)
+
+def hamming_distances(codes_a, codes_b):
+    """Hamming distance between every row of codes_a and every row of codes_b"""
+    distances = np.zeros((len(codes_a), len(codes_b)), dtype=np.uint16)
+    # One word at a time keeps the temporaries at len(a) x len(b)
+    for word in range(codes_a.shape[1]):
+        distances += popcount(codes_a[:, word, None] ^ codes_b[None, :, word])
+    return distances
+
+def compact_edges(embeddings, threshold, codec=None, max_distance=None, recall=0.99, bits=256, block_size=1024,
+                  normalized=False):
+    """Counterpart of similarity.similarity_edges that screens pairs by the
+    Hamming distance of their CompactCodec codes first.
+
+    Only pairs within max_distance are scored with the float embeddings, so
+    a memory-mapped matrix is read just for those. codec defaults to one
+    fitted on embeddings, and max_distance to its calibrate() for threshold
+    at the given recall. Yields (i, j, similarity) for i < j above threshold.
+    """
+    normed = embeddings if normalized else normalize_embeddings(embeddings)
+    n = len(normed)
+    if codec is None:
+        codec = CompactCodec(bits=bits).fit(normed)
+    if max_distance is None:
+        max_distance = codec.calibrate(normed, threshold, recall=recall, normalized=True)
+    codes = codec.encode(normed, normalized=True)
+
+    for row_start in range(0, n, block_size):
+        row_stop = min(row_start + block_size, n)
+        for col_start in range(row_start, n, block_size):
+            col_stop = min(col_start + block_size, n)
+            with stage("similarity"):
+                distances = hamming_distances(codes[row_start:row_stop], codes[col_start:col_stop])
+                tile_rows, tile_cols = np.nonzero(distances <= max_distance)
+                if col_start == row_start:
+                    upper = tile_cols > tile_rows
+                    tile_rows, tile_cols = tile_rows[upper], tile_cols[upper]
+                count("pairs.screened", (row_stop - row_start) * (col_stop - col_start))
+                count("pairs.compared", len(tile_rows))
+                if not len(tile_rows):
+                    continue
+
+                # Exact cosine for the survivors only
+                rows = row_start + tile_rows
+                cols = col_start + tile_cols
+                needed, inverse = np.unique(np.concatenate([rows, cols]), return_inverse=True)
+                vectors = np.asarray(normed[needed], dtype=np.float32)
+                similarities = np.einsum('ij,ij->i', vectors[inverse[:len(rows)]], vectors[inverse[len(rows):]])
+                keep = similarities > threshold
+                count("edges", int(keep.sum()))
+
+            for i, j, similarity in zip(rows[keep].tolist(), cols[keep].tolist(), similarities[keep].tolist()):
+                yield i, j, similarity
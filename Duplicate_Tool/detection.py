@@ -1,7 +1,18 @@
+import argparse
+import os
+import sys
+
 import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
-from embedding import get_embedding
-from preprocessing import preprocess_code, handle_overlapping_chunks
+
+from .embedding import embed_hierarchical, embed_windows, get_embeddings
+from .chunker import METHOD_KINDS, Chunk, ChunkRef
+from .preprocessing import preprocess_code, handle_overlapping_chunks, extract_chunks
+from .similarity import normalize_embeddings, similarity_edges
+from .ann import ann_edges
+from .compact import compact_edges
+from .grouping import build_groups, group_average_similarities
+from .lexical import embedding_candidates, lexical_clone_groups, merge_clone_groups
+from .profiling import count, stage
 
 # def detect_duplicate_groups(java_code, threshold=0.95):
 #     chunks = preprocess_code(java_code)  # This includes formatting and chunk extraction
@@ -38,150 +49,72 @@ from preprocessing import preprocess_code, handle_overlapping_chunks
 def detect_duplicate_groups(java_code, threshold=0.90, use_formatting=True):
     chunks = preprocess_code(java_code, use_formatting=use_formatting)
     filtered_chunks = handle_overlapping_chunks(chunks)
-    embeddings = [get_embedding(chunk) for chunk in filtered_chunks]
-
-    # Compute similarity matrix
-    similarity_matrix = np.zeros((len(filtered_chunks), len(filtered_chunks)))
-    for i in range(len(embeddings)):
-        for j in range(len(embeddings)):
-            if i != j:
-                similarity = cosine_similarity(embeddings[i].reshape(1, -1), embeddings[j].reshape(1, -1))[0][0]
-                similarity_matrix[i, j] = similarity
-
-    # Improved grouping using connected components with stricter criteria
-    visited = set()
-    duplicate_groups = []
-
-    for i in range(len(filtered_chunks)):
-        if i not in visited:
-            group = []
-            stack = [i]
-            
-            while stack:
-                current = stack.pop()
-                if current not in visited:
-                    visited.add(current)
-                    group.append(current)
-                    
-                    # Find all similar chunks with stricter threshold
-                    for j in range(len(filtered_chunks)):
-                        if j not in visited and similarity_matrix[current, j] > threshold:
-                            # Additional check: ensure all members are similar to each other
-                            should_add = True
-                            for existing_member in group:
-                                if similarity_matrix[existing_member, j] <= threshold * 0.9:  # Stricter criteria
-                                    should_add = False
-                                    break
-                            if should_add:
-                                stack.append(j)
-            
-            if len(group) > 1:
-                similarities = []
-                for g1 in group:
-                    for g2 in group:
-                        if g1 != g2:
-                            similarities.append(similarity_matrix[g1, g2])
-                avg_similarity = np.mean(similarities)
-                duplicate_groups.append(([filtered_chunks[index] for index in group], avg_similarity))
+    embeddings = get_embeddings(filtered_chunks)
 
-    return duplicate_groups
+    groups = group_embeddings(embeddings, threshold, member_factor=0.9)
+    return [([filtered_chunks[index] for index in group], avg_similarity) for group, avg_similarity in groups]
 
 def extract_code_blocks(java_code, min_lines=2, use_formatting=True):
     """Extract code blocks (both methods and statement groups) for duplicate detection"""
+    return [chunk.code for chunk in extract_code_chunks(java_code, min_lines=min_lines, use_formatting=use_formatting)]
+
+def extract_code_chunks(java_code, min_lines=2, use_formatting=True):
+    """Like extract_code_blocks, but returns the Chunk records"""
     
     # Format the code first for better consistency
     if use_formatting:
-        from preprocessing import format_java_code
+        from .preprocessing import format_java_code
         java_code = format_java_code(java_code)
     
-    lines = java_code.split('\n')
-    blocks = []
-    
-    # First, extract complete methods
-    methods = []
-    i = 0
-    while i < len(lines):
-        line = lines[i].strip()
-        
-        # Check if line starts a method
-        if (line and 
-            ('public' in line or 'private' in line or 'protected' in line) and
-            '(' in line and ')' in line):
-            
-            method_lines = []
-            brace_count = 0
-            method_started = False
-            
-            j = i
-            while j < len(lines):
-                current_line = lines[j]
-                method_lines.append(current_line)
-                
-                open_braces = current_line.count('{')
-                close_braces = current_line.count('}')
-                
-                if open_braces > 0:
-                    method_started = True
-                
-                brace_count += open_braces - close_braces
-                
-                if method_started and brace_count == 0:
-                    method_code = '\n'.join(method_lines).strip()
-                    if method_code:
-                        methods.append((method_code, i, j))
-                    i = j + 1
-                    break
-                
-                j += 1
-            else:
-                i += 1
-        else:
-            i += 1
-    
-    # Add complete methods to blocks
-    for method_code, start, end in methods:
-        blocks.append(method_code)
-    
-    # Extract statement blocks from within methods using a simpler approach
-    for method_code, method_start, method_end in methods:
-        method_lines = method_code.split('\n')
-        
-        # Find all consecutive statement groups separated by comments or empty lines
-        current_block = []
-        
-        for line_idx, line in enumerate(method_lines):
-            stripped = line.strip()
-            
-            # Skip method signature line
-            if ('public' in stripped or 'private' in stripped or 'protected' in stripped) and '(' in stripped:
-                continue
-                
-            # Skip empty lines, comments, and lone braces
-            if not stripped or stripped.startswith('//') or stripped in ['{', '}']:
-                # Save current block if it's substantial
-                if len(current_block) >= min_lines:
-                    block_code = '\n'.join(current_block).strip()
-                    if block_code and block_code not in blocks:
-                        blocks.append(block_code)
-                current_block = []
-                continue
-            
-            # Add non-empty code lines to current block
-            if stripped:
-                current_block.append(line.strip())
-        
-        # Add final block
-        if len(current_block) >= min_lines:
-            block_code = '\n'.join(current_block).strip()
-            if block_code and block_code not in blocks:
-                blocks.append(block_code)
+    chunks = []
+    seen_blocks = set()
+    extracted = extract_chunks(java_code, min_lines=min_lines)
+    count("chunks.extracted", len(extracted))
+    for chunk in extracted:
+        # Methods are all kept; statement blocks only once each
+        if chunk.kind in METHOD_KINDS or chunk.code not in seen_blocks:
+            chunks.append(chunk)
+        seen_blocks.add(chunk.code)
     
-    return blocks
+    return chunks
+
+def detect_duplicate_groups_enhanced(java_code, threshold=0.90, detect_intra_method=True, prefer_methods=True, use_formatting=True, search="exact", neighbours=10, cache=None, grouping="clique", backend="torch", prefilter=False, windowed=False, hierarchical=False):
+    """Enhanced duplicate detection that can find both inter-method and intra-method duplicates
 
-def detect_duplicate_groups_enhanced(java_code, threshold=0.90, detect_intra_method=True, prefer_methods=True, use_formatting=True):
-    """Enhanced duplicate detection that can find both inter-method and intra-method duplicates"""
+    search="lsh" swaps the exact all-pairs comparison for an approximate
+    nearest-neighbour search over each chunk's top `neighbours` candidates.
+    cache is an optional EmbeddingCache (see embedding.open_cache) that lets
+    repeated scans skip the model for unchanged chunks. grouping="components"
+    groups by plain connected components instead of requiring every member
+    to be similar to all others. backend selects the CPU inference backend
+    (see embedding.get_embeddings). prefilter=True finds exact and renamed
+    clones lexically first and only embeds the chunks left over, plus one
+    representative per clone group. windowed=True embeds methods longer
+    than the encoder's 512 tokens in overlapping windows instead of
+    truncating them.
+
+    hierarchical=True (with detect_intra_method) runs the encoder once per
+    method and pools each statement block's embedding from the token states
+    of its method, so blocks need no forward pass of their own. Blocks are
+    then always compared, except those inside methods already grouped as
+    whole-method duplicates. It cannot be combined with prefilter or
+    windowed.
+    """
+    if hierarchical and detect_intra_method:
+        if prefilter or windowed:
+            raise ValueError("hierarchical detection cannot be combined with prefilter or windowed")
+        if use_formatting:
+            from .preprocessing import format_java_code
+            java_code = format_java_code(java_code)
+        return _hierarchical_duplicate_groups(java_code, threshold, search=search, neighbours=neighbours,
+                                              cache=cache, grouping=grouping, backend=backend)
+
+    kinds = {}
     if detect_intra_method:
-        chunks = extract_code_blocks(java_code, use_formatting=use_formatting)
+        records = extract_code_chunks(java_code, use_formatting=use_formatting)
+        for record in records:
+            kinds.setdefault(record.code, record.kind)
+        chunks = [record.code for record in records]
     else:
         chunks = preprocess_code(java_code, use_formatting=use_formatting)
     
@@ -192,74 +125,191 @@ def detect_duplicate_groups_enhanced(java_code, threshold=0.90, detect_intra_met
     
     # Separate methods from code blocks if prefer_methods is True
     if prefer_methods and detect_intra_method:
-        methods = [chunk for chunk in filtered_chunks if ("public" in chunk or "private" in chunk) and "(" in chunk]
-        code_blocks = [chunk for chunk in filtered_chunks if not (("public" in chunk or "private" in chunk) and "(" in chunk)]
+        methods = [chunk for chunk in filtered_chunks if kinds[chunk] in METHOD_KINDS]
+        code_blocks = [chunk for chunk in filtered_chunks if kinds[chunk] not in METHOD_KINDS]
         
         # First try to find duplicates among complete methods
         method_groups = []
         if len(methods) >= 2:
-            method_groups = find_duplicate_groups(methods, threshold)
+            method_groups = find_duplicate_groups(methods, threshold, search=search, neighbours=neighbours, cache=cache, grouping=grouping, backend=backend, prefilter=prefilter, windowed=windowed)
         
         # Only look for code block duplicates if we found few or no method duplicates
         block_groups = []
         if len(method_groups) <= 1 and len(code_blocks) >= 2:  # Only if we have very few method groups
             block_threshold = threshold + 0.05  # Higher threshold for code blocks
-            block_groups = find_duplicate_groups(code_blocks, block_threshold)
+            block_groups = find_duplicate_groups(code_blocks, block_threshold, search=search, neighbours=neighbours, cache=cache, grouping=grouping, backend=backend, prefilter=prefilter, windowed=windowed)
         
         return method_groups + block_groups
     else:
-        return find_duplicate_groups(filtered_chunks, threshold)
-
-def find_duplicate_groups(chunks, threshold):
-    """Helper function to find duplicate groups from a list of chunks"""
-    embeddings = [get_embedding(chunk) for chunk in chunks]
-
-    # Compute similarity matrix
-    similarity_matrix = np.zeros((len(chunks), len(chunks)))
-    for i in range(len(embeddings)):
-        for j in range(len(embeddings)):
-            if i != j:
-                similarity = cosine_similarity(embeddings[i].reshape(1, -1), embeddings[j].reshape(1, -1))[0][0]
-                similarity_matrix[i, j] = similarity
-
-    # Improved grouping using connected components with stricter criteria
-    visited = set()
-    duplicate_groups = []
+        return find_duplicate_groups(filtered_chunks, threshold, search=search, neighbours=neighbours, cache=cache, grouping=grouping, backend=backend, prefilter=prefilter, windowed=windowed)
+
+def _hierarchical_duplicate_groups(java_code, threshold, search="exact", neighbours=10, cache=None, grouping="clique",
+                                   backend="torch"):
+    """Method and block groups of one (already formatted) source, with block
+    embeddings pooled from their method's forward pass"""
+    records = extract_code_chunks(java_code, use_formatting=False)
+    kept = set(handle_overlapping_chunks([record.code for record in records]))
+    first = {}
+    for record in records:
+        if record.code in kept:
+            first.setdefault(record.code, record)
+    if len(first) < 2:
+        return []
+    methods = [record for record in first.values() if record.kind in METHOD_KINDS]
+    blocks = [record for record in first.values() if record.kind not in METHOD_KINDS]
+    method_index = {record.code: index for index, record in enumerate(methods)}
+
+    # Each block belongs to the innermost method (or lambda) around it
+    source = java_code.encode('utf-8')
+    enclosing = _innermost_enclosing(blocks, [record for record in records
+                                              if record.kind in METHOD_KINDS and record.code in method_index])
+    containers = []
+    spans = []
+    for block, method in zip(blocks, enclosing):
+        if method is None:
+            containers.append(None)
+            continue
+        containers.append(method_index[method.code])
+        spans.append((method_index[method.code], _offset_in_chunk(source, method, block.start_offset),
+                      _offset_in_chunk(source, method, block.end_offset), block.code))
+
+    method_embeddings, span_embeddings = embed_hierarchical([method.code for method in methods], spans, backend=backend)
+    loose = [index for index, container in enumerate(containers) if container is None]
+    block_embeddings = np.zeros((len(blocks), method_embeddings.shape[1]), dtype=np.float32)
+    block_embeddings[[index for index, container in enumerate(containers) if container is not None]] = span_embeddings
+    if loose:
+        block_embeddings[loose] = get_embeddings([blocks[index].code for index in loose], cache=cache, backend=backend)
 
-    for i in range(len(chunks)):
-        if i not in visited:
-            group = []
-            stack = [i]
-            
-            while stack:
-                current = stack.pop()
-                if current not in visited:
-                    visited.add(current)
-                    group.append(current)
-                    
-                    # Find all similar chunks with stricter threshold
-                    for j in range(len(chunks)):
-                        if j not in visited and similarity_matrix[current, j] > threshold:
-                            # Additional check: ensure all members are similar to each other
-                            should_add = True
-                            for existing_member in group:
-                                if similarity_matrix[existing_member, j] <= threshold * 0.95:  # Even stricter criteria
-                                    should_add = False
-                                    break
-                            if should_add:
-                                stack.append(j)
-            
-            if len(group) > 1:
-                similarities = []
-                for g1 in group:
-                    for g2 in group:
-                        if g1 != g2:
-                            similarities.append(similarity_matrix[g1, g2])
-                avg_similarity = np.mean(similarities)
-                duplicate_groups.append(([chunks[index] for index in group], avg_similarity))
+    duplicate_groups = []
+    grouped = set()
+    if len(methods) >= 2:
+        for group, similarity in group_embeddings(method_embeddings, threshold, search=search, neighbours=neighbours,
+                                                  grouping=grouping):
+            duplicate_groups.append(([methods[index].code for index in group], similarity))
+            grouped.update(group)
 
+    # Blocks of whole-method duplicates would only repeat their method's group
+    candidates = [index for index, container in enumerate(containers) if container not in grouped]
+    if len(candidates) >= 2:
+        groups = group_embeddings(block_embeddings[candidates], threshold + 0.05, search=search, neighbours=neighbours,
+                                  grouping=grouping)
+        for group, similarity in groups:
+            duplicate_groups.append(([blocks[candidates[index]].code for index in group], similarity))
+    count("blocks.skipped", len(blocks) - len(candidates))
     return duplicate_groups
 
+def _innermost_enclosing(blocks, methods):
+    """The innermost of methods whose byte span contains each block (None
+    if none does), in one sweep over both sorted by start offset.
+
+    Methods nest, so the ones open at any offset form a stack; ties on the
+    start put methods before blocks and outer methods before inner ones.
+    """
+    events = sorted([(record.start_offset, 0, -record.end_offset, index) for index, record in enumerate(methods)]
+                    + [(record.start_offset, 1, -record.end_offset, index) for index, record in enumerate(blocks)])
+    enclosing = [None] * len(blocks)
+    open_methods = []
+    for start, is_block, negative_end, index in events:
+        while open_methods and open_methods[-1].end_offset <= start:
+            open_methods.pop()
+        if not is_block:
+            open_methods.append(methods[index])
+            continue
+        for method in reversed(open_methods):
+            if method.end_offset >= -negative_end:
+                enclosing[index] = method
+                break
+    return enclosing
+
+def _offset_in_chunk(source, chunk, offset):
+    """Byte offset in chunk.code of a source byte offset inside the chunk.
+
+    Method code is its source span with every line right-stripped (see
+    chunker.chunk_java), so lines match up one to one.
+    """
+    lines = chunk.code.encode('utf-8').split(b'\n')
+    line = source.count(b'\n', chunk.start_offset, offset)
+    line_start = chunk.start_offset if line == 0 else source.rfind(b'\n', 0, offset) + 1
+    return sum(len(text) + 1 for text in lines[:line]) + min(offset - line_start, len(lines[line]))
+
+def find_duplicate_groups(chunks, threshold, block_size=1024, search="exact", neighbours=10, cache=None, grouping="clique", backend="torch", prefilter=False, windowed=False):
+    """Helper function to find duplicate groups from a list of chunks
+
+    search="exact" scores every pair of chunks. search="lsh" only scores
+    each chunk's `neighbours` nearest LSH candidates, which scales to far
+    larger inputs at some cost in recall. search="compact" only scores pairs
+    whose PCA sign codes (see compact.CompactCodec) are close in Hamming
+    distance. grouping picks the strategy from grouping.build_groups.
+
+    With prefilter=True, Type-1 and Type-2 clones are grouped by
+    lexical.lexical_clone_groups without the model (their similarity is a
+    token-shingle Jaccard estimate). Only the chunks it leaves unmatched and
+    one representative per clone group are embedded; a group whose
+    representative lands in a semantic group is merged into it (see
+    lexical.merge_clone_groups).
+    """
+    if not prefilter:
+        embeddings = get_embeddings(chunks, cache=cache, backend=backend, windowed=windowed)
+        groups = group_embeddings(embeddings, threshold, block_size=block_size, search=search, neighbours=neighbours, grouping=grouping)
+        return [([chunks[index] for index in group], avg_similarity) for group, avg_similarity in groups]
+
+    lexical_groups, remaining = lexical_clone_groups(chunks)
+    candidates = embedding_candidates(lexical_groups, remaining)
+    groups = []
+    if len(candidates) >= 2:
+        embeddings = get_embeddings([chunks[index] for index in candidates], cache=cache, backend=backend, windowed=windowed)
+        groups = group_embeddings(embeddings, threshold, block_size=block_size, search=search, neighbours=neighbours, grouping=grouping)
+    return [([chunks[index] for index in group], similarity)
+            for group, similarity in merge_clone_groups(lexical_groups, candidates, groups)]
+
+def group_embeddings(embeddings, threshold, block_size=1024, search="exact", neighbours=10, grouping="clique", member_factor=0.95, normalized=False):
+    """Group rows of an embedding matrix, returning (row indices, avg similarity) pairs
+
+    With grouping="clique", a chunk joins a group through an edge above
+    threshold and must also be above threshold * member_factor with every
+    other member. normalized=True uses rows that are already L2-normalized
+    as they are, so a memory-mapped matrix is never copied into memory.
+    """
+    if not normalized:
+        embeddings = normalize_embeddings(embeddings)
+    member_threshold = threshold * member_factor if grouping == "clique" else threshold
+
+    # Only edges above member_threshold can affect the groups, so the
+    # similarity stage emits just those, as a sparse edge list
+    if search == "exact":
+        edges = similarity_edges(embeddings, member_threshold, block_size=block_size, normalized=True)
+    elif search == "lsh":
+        edges = ann_edges(embeddings, member_threshold, k=neighbours)
+    elif search == "compact":
+        edges = compact_edges(embeddings, member_threshold, block_size=block_size, normalized=True)
+    else:
+        raise ValueError(f"Unknown search mode: {search}")
+
+    # Edges are generated lazily, so this stage includes the similarity stage
+    with stage("group"):
+        groups = build_groups(len(embeddings), edges, threshold, strategy=grouping, member_threshold=member_threshold)
+        return list(zip(groups, group_average_similarities(embeddings, groups)))
+
+def duplicated_regions(code_a, code_b, threshold=0.90, batch_size=32, backend="torch"):
+    """Find which parts of two (long) chunks are duplicates of each other.
+
+    Both chunks are embedded in overlapping windows (see
+    embedding.embed_windows) and every pair of windows is compared. Returns
+    ((start, end) in code_a, (start, end) in code_b, similarity) triples for
+    the window pairs at or above threshold, most similar first; offsets are
+    in bytes of the UTF-8 encoded code.
+    """
+    windows = embed_windows([code_a, code_b], batch_size=batch_size, backend=backend)
+    vectors = normalize_embeddings(windows.windows)
+    first = np.flatnonzero(windows.owners == 0)
+    second = np.flatnonzero(windows.owners == 1)
+    similarities = vectors[first] @ vectors[second].T
+    regions = []
+    for row, column in zip(*np.nonzero(similarities >= threshold)):
+        regions.append((tuple(windows.spans[first[row]].tolist()), tuple(windows.spans[second[column]].tolist()),
+                        float(similarities[row, column])))
+    return sorted(regions, key=lambda region: -region[2])
+
 # def print_groups(duplicate_groups):
 #     i=1
 #     for group, similarity in duplicate_groups:
@@ -276,6 +326,8 @@ def find_duplicate_groups(chunks, threshold):
 #     if not duplicate_groups:
 #         print("No duplicate groups found.")
 
+CHUNK_TYPES = {"method": "Method", "constructor": "Constructor", "lambda": "Lambda"}
+
 def print_groups(duplicate_groups):
     print(f"\nFound {len(duplicate_groups)} duplicate groups:\n")
     
@@ -285,9 +337,19 @@ def print_groups(duplicate_groups):
         print("="*60)
         
         for j, chunk in enumerate(group, 1):
-            # Determine if it's a method or code block
-            chunk_type = "Method" if ("public" in chunk or "private" in chunk) and "(" in chunk else "Code Block"
-            print(f"\n{chunk_type} {j}:")
+            if isinstance(chunk, (Chunk, ChunkRef)):
+                # Scanned chunks know their kind and where they came from
+                chunk_type = CHUNK_TYPES.get(chunk.kind, "Code Block")
+                print(f"\n{chunk_type} {j}: {chunk.path}:{chunk.start_line}-{chunk.end_line}")
+                if isinstance(chunk, ChunkRef):
+                    from .streaming import read_chunk_code
+                    chunk = read_chunk_code(chunk)
+                else:
+                    chunk = chunk.code
+            else:
+                # Determine if it's a method or code block
+                chunk_type = "Method" if ("public" in chunk or "private" in chunk) and "(" in chunk else "Code Block"
+                print(f"\n{chunk_type} {j}:")
             print("-" * 30)
             # Clean up the chunk display
             clean_chunk = '\n'.join(line for line in chunk.split('\n') if line.strip())
@@ -299,8 +361,188 @@ def print_groups(duplicate_groups):
     if not duplicate_groups:
         print("No duplicate groups found.")
         
-def main():
+def main(argv=None):
     """Main CLI entry point for the duplicate detection tool"""
+    parser = argparse.ArgumentParser(
+        prog="duplicate-tool",
+        description="Detect duplicate Java methods and code blocks across a directory tree.",
+    )
+    parser.add_argument("path", nargs="?", help="Directory to scan; runs the built-in example when omitted")
+    parser.add_argument("--threshold", type=float, default=0.90, help="Similarity threshold (default: 0.90)")
+    parser.add_argument("--no-format", action="store_true", help="Skip Google Java Format normalization")
+    parser.add_argument("--methods-only", action="store_true", help="Do not look for duplicate blocks inside methods")
+    parser.add_argument("--workers", type=int, default=None, help="Parser processes (default: CPU count)")
+    parser.add_argument("--batch-size", type=int, default=32, help="Chunks per encoder forward pass")
+    parser.add_argument("--search", choices=["exact", "lsh", "compact"], default="exact", help="Candidate search mode")
+    parser.add_argument("--grouping", choices=["clique", "components"], default="clique", help="Grouping strategy")
+    parser.add_argument("--cache", help="Directory of a persistent embedding cache")
+    parser.add_argument("--backend", choices=["torch", "quantized", "onnx"], default="torch",
+                        help="CPU inference backend for the encoder (default: torch)")
+    parser.add_argument("--prefilter", action="store_true",
+                        help="Find exact and renamed clones lexically and only embed the rest")
+    parser.add_argument("--embed-workers", type=int, default=None,
+                        help="Encoder processes for directory scans (default: run the encoder in-process)")
+    parser.add_argument("--threads", type=int, default=None,
+                        help="Threads used inside each encoder operator (per encoder process with --embed-workers)")
+    parser.add_argument("--interop-threads", type=int, default=None, help="Threads used across encoder operators")
+    parser.add_argument("--stream", action="store_true",
+                        help="Keep embeddings on disk and score similarities in tiles within --memory-budget")
+    parser.add_argument("--memory-budget", type=int, default=256,
+                        help="Working memory in MB for the similarity tiles and pending chunks of --stream (default: 256)")
+    parser.add_argument("--float16", action="store_true", help="Store --stream embeddings as float16")
+    parser.add_argument("--long-chunks", choices=["truncate", "window"], default="truncate",
+                        help="Embed chunks longer than 512 tokens truncated, or as overlapping windows (default: truncate)")
+    parser.add_argument("--profile", help="Write stage timings and counters of the run to this JSON file")
+    parser.add_argument("--trace", help="Write a Chrome trace-event file of the run (open in chrome://tracing or Perfetto)")
+    parser.add_argument("--index", help="Directory of a persisted duplicate index; only report groups that "
+                                        "changed since the index was last updated")
+    parser.add_argument("--query", help="With --index, print the indexed chunks most similar to each chunk of "
+                                        "this .java file ('-' reads a snippet from stdin)")
+    parser.add_argument("--top-k", type=int, default=5, help="Matches printed per chunk with --query (default: 5)")
+    parser.add_argument("--report", help="Write the groups to this file as they are found instead of printing "
+                                         "them ('-' for stdout, a .gz name compresses it)")
+    parser.add_argument("--report-format", choices=["jsonl", "sarif"], default=None,
+                        help="Format of --report (default: sarif for .sarif names, otherwise jsonl)")
+    args = parser.parse_args(argv)
+    if args.query and not args.index:
+        parser.error("--query needs --index")
+    if args.index and args.path is None:
+        parser.error("--index requires the repository path")
+    if args.report and (args.index or args.path is None):
+        parser.error("--report needs a directory to scan and does not apply to --index")
+
+    if args.path is None:
+        run_example()
+        return
+
+    if args.profile or args.trace:
+        from .profiling import profile
+        with profile(trace=bool(args.trace)) as profiler:
+            run(args)
+        if args.profile:
+            profiler.write(args.profile)
+        if args.trace:
+            profiler.write_chrome_trace(args.trace)
+        print(profiler.summary())
+    else:
+        run(args)
+
+def run(args):
+    """Run the scan the parsed command line asks for"""
+    from .backends import configure_threads
+    from .embedding import open_cache
+    from .scanner import scan_directory
+
+    if args.threads is not None or args.interop_threads is not None:
+        configure_threads(args.threads, args.interop_threads)
+    windowed = args.long_chunks == "window"
+
+    if args.index:
+        from .index import DuplicateIndex
+        index = DuplicateIndex(
+            args.index,
+            args.path,
+            threshold=args.threshold,
+            use_formatting=not args.no_format,
+            detect_intra_method=not args.methods_only,
+            search=args.search,
+            grouping=args.grouping,
+            backend=args.backend,
+            cache=open_cache(args.cache, backend=args.backend, windowed=windowed) if args.cache else None,
+            batch_size=args.batch_size,
+            workers=args.workers,
+            windowed=windowed,
+        )
+        update = index.refresh()
+        if args.query == "-":
+            matches = index.query(sys.stdin.read(), k=args.top_k)
+            print_query_results([(None, matches)])
+        elif args.query:
+            print_query_results(index.query_file(args.query, k=args.top_k))
+        else:
+            print_index_update(update)
+        index.close()
+        return
+
+    if args.stream:
+        from .streaming import iter_duplicate_groups, stream_duplicate_groups
+        # With a report, groups are written as each family is grouped
+        find_groups = iter_duplicate_groups if args.report else stream_duplicate_groups
+        emit_groups(args, find_groups(
+            args.path,
+            threshold=args.threshold,
+            use_formatting=not args.no_format,
+            detect_intra_method=not args.methods_only,
+            workers=args.workers,
+            batch_size=args.batch_size,
+            memory_budget=args.memory_budget * 2 ** 20,
+            dtype="float16" if args.float16 else "float32",
+            cache=open_cache(args.cache, backend=args.backend, windowed=windowed) if args.cache else None,
+            grouping=args.grouping,
+            backend=args.backend,
+            windowed=windowed,
+        ))
+        return
+
+    emit_groups(args, scan_directory(
+        args.path,
+        threshold=args.threshold,
+        use_formatting=not args.no_format,
+        detect_intra_method=not args.methods_only,
+        workers=args.workers,
+        batch_size=args.batch_size,
+        search=args.search,
+        grouping=args.grouping,
+        cache=open_cache(args.cache, backend=args.backend, windowed=windowed) if args.cache else None,
+        backend=args.backend,
+        prefilter=args.prefilter,
+        embed_workers=args.embed_workers,
+        embed_threads=args.threads,
+        windowed=windowed,
+    ))
+
+def emit_groups(args, duplicate_groups):
+    """Print the groups, or with --report stream them to the report file"""
+    if not args.report:
+        print_groups(duplicate_groups)
+        return
+    from .report import write_report
+    report_format = args.report_format or ("sarif" if ".sarif" in os.path.basename(args.report) else "jsonl")
+    written = write_report(duplicate_groups, args.report, report_format, root=args.path)
+    if args.report != "-":
+        print(f"Wrote {written} duplicate groups to {args.report}")
+
+def print_index_update(update):
+    """Print the groups an index update added, changed and removed"""
+    def print_group(label, group):
+        print(f"{label} group {group.id} ({group.family}, {len(group.chunks)} chunks)")
+        for chunk in group.chunks:
+            print(f"    {chunk.path}:{chunk.start_line}-{chunk.end_line} {CHUNK_TYPES.get(chunk.kind, 'Code Block')}")
+
+    print(f"\n{len(update.added)} added, {len(update.changed)} changed, {len(update.removed)} removed duplicate groups\n")
+    for group in update.added:
+        print_group("Added", group)
+    for old, new in update.changed:
+        print_group(f"Changed (was group {old.id} with {len(old.chunks)} chunks)", new)
+    for group in update.removed:
+        print_group("Removed", group)
+
+def print_query_results(results):
+    """Print (queried chunk, matches) pairs from DuplicateIndex.query_file;
+    a chunk of None stands for a whole snippet"""
+    for chunk, matches in results:
+        if chunk is None:
+            print("\nSnippet")
+        else:
+            print(f"\n{CHUNK_TYPES.get(chunk.kind, 'Code Block')} {chunk.path}:{chunk.start_line}-{chunk.end_line}")
+        if not matches:
+            print("    no similar indexed chunks")
+        for match, similarity in matches:
+            print(f"    {similarity:.3f} {match.path}:{match.start_line}-{match.end_line} "
+                  f"{CHUNK_TYPES.get(match.kind, 'Code Block')}")
+
+def run_example():
+    """Run detection on a built-in sample, with and without formatting"""
     # Test with poorly formatted code to show the difference
     java_code = """
     public class DuplicateExample{
@@ -1,11 +1,373 @@
-import torch
-from transformers import RobertaTokenizer, T5ForConditionalGeneration
+import hashlib
+import threading
+from collections import OrderedDict, namedtuple
 
-tokenizer = RobertaTokenizer.from_pretrained("Salesforce/codet5-base")
-model = T5ForConditionalGeneration.from_pretrained("Salesforce/codet5-base")
+import numpy as np
+from .backends import get_backend, mean_pool
+from .cache import EmbeddingCache
+from .profiling import count, stage
+
+MODEL_NAME = "Salesforce/codet5-base"
+MODEL_REVISION = "main"
+MAX_LENGTH = 512
+# Tokens between the starts of consecutive windows of a long chunk, so
+# neighbouring windows overlap by MAX_LENGTH - 2 - WINDOW_STRIDE tokens
+WINDOW_STRIDE = 384
+
+# Chunk-level embeddings plus the embedding of every window they were built
+# from. owners[w] is the chunk of window w and spans[w] its (start, end) byte
+# offsets in the chunk's UTF-8 text.
+WindowedEmbeddings = namedtuple('WindowedEmbeddings', ['embeddings', 'windows', 'owners', 'spans'])
+
+# torch, transformers and the model itself are only loaded on first use, so
+# importing the package (e.g. just to format or chunk code) stays fast
+_tokenizer = None
+_model = None
+_model_lock = threading.Lock()
+
+class TokenCache:
+    """LRU of token ids per chunk text, so identical chunks (re-runs,
+    methods repeated across calls, the same block inside several methods)
+    are tokenized once per process.
+
+    Keys are a hash of the exact text and the tokenizer options; ids are
+    kept as int32 arrays. max_entries=0 turns the cache off.
+    """
+
+    def __init__(self, max_entries=50000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def tokenize(self, tokenizer, chunks, **options):
+        """Token ids of each chunk, as lists, tokenizing only the missing
+        texts (each once) in one batched call"""
+        settings = repr(sorted(options.items()))
+        keys = [(settings, hashlib.blake2b(chunk.encode('utf-8'), digest_size=16).digest()) for chunk in chunks]
+        with self._lock:
+            ids = [self._entries.get(key) for key in keys]
+            for key, entry in zip(keys, ids):
+                if entry is not None:
+                    self._entries.move_to_end(key)
+        missing = [index for index, entry in enumerate(ids) if entry is None]
+        count("tokens.cache_hits", len(chunks) - len(missing))
+
+        if missing:
+            unique = list(dict.fromkeys(chunks[index] for index in missing))
+            encoded = dict(zip(unique, tokenizer(unique, **options)["input_ids"]))
+            with self._lock:
+                for index in missing:
+                    ids[index] = np.asarray(encoded[chunks[index]], dtype=np.int32)
+                    if self.max_entries:
+                        self._entries[keys[index]] = ids[index]
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return [entry.tolist() for entry in ids]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+# Token ids of recently embedded chunks, shared by every embedding call
+token_cache = TokenCache()
+
+def load_model():
+    """Return the shared (tokenizer, encoder), loading them on first use.
+
+    Only the CodeT5 encoder is loaded; the decoder is never used for
+    embeddings. The tokenizer is the Rust-backed fast one, which encodes a
+    whole batch of chunks in one call across several threads. Safe to call
+    from several threads at once.
+    """
+    global _tokenizer, _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                from transformers import RobertaTokenizerFast, T5EncoderModel
+                tokenizer = RobertaTokenizerFast.from_pretrained(MODEL_NAME, revision=MODEL_REVISION)
+                model = T5EncoderModel.from_pretrained(MODEL_NAME, revision=MODEL_REVISION)
+                model.eval()
+                _tokenizer = tokenizer
+                _model = model
+    return _tokenizer, _model
+
+def __getattr__(name):
+    # Keep `embedding.tokenizer` and `embedding.model` working, loading lazily
+    if name == "tokenizer":
+        return load_model()[0]
+    if name == "model":
+        return load_model()[1]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def embedding_dim():
+    """Size of one embedding, without loading the model weights if possible"""
+    if _model is not None:
+        return _model.config.d_model
+    from transformers import AutoConfig
+    return AutoConfig.from_pretrained(MODEL_NAME, revision=MODEL_REVISION).d_model
 
 def get_embedding(code):
-    inputs = tokenizer(code, return_tensors="pt", truncation=True, padding=True, max_length=512)
-    with torch.no_grad():
-        outputs = model.encoder(**inputs)
-    return outputs.last_hidden_state.mean(dim=1)
+    import torch
+    tokenizer, model = load_model()
+    inputs = tokenizer(code, return_tensors="pt", truncation=True, padding=True, max_length=MAX_LENGTH)
+    with torch.inference_mode():
+        outputs = model(**inputs)
+        return mean_pool(outputs.last_hidden_state, inputs["attention_mask"])
+
+def open_cache(path, max_entries=200000, backend="torch", windowed=False):
+    """Open (or create) a persistent embedding cache for the current model.
+
+    Backends other than fp32 torch produce slightly different vectors, so
+    they get their own cache keys, as do the windowed embeddings of long
+    chunks (see get_embeddings).
+    """
+    revision = MODEL_REVISION if backend == "torch" else f"{MODEL_REVISION}+{backend}"
+    if windowed:
+        revision += "+window"
+    return EmbeddingCache(path, MODEL_NAME, revision=revision, max_entries=max_entries)
+
+def get_embeddings(chunks, batch_size=32, cache=None, backend="torch", pool=None, windowed=False):
+    """Embed a list of chunks in padded-to-bucket batches.
+
+    Returns a contiguous float32 matrix with one row per chunk, in input order.
+    With an EmbeddingCache, only chunks missing from the cache are run through
+    the model, and their embeddings are added to it. backend picks how the
+    encoder runs on CPU (see backends.BACKENDS): "torch" (fp32), "quantized"
+    (int8 dynamic quantization) or "onnx" (onnxruntime). With a
+    workers.EmbeddingPool, the chunks to encode are spread over its worker
+    processes (the pool's own backend and batch size apply).
+
+    Chunks longer than the encoder's 512 tokens are truncated, unless
+    windowed=True: then they are split into overlapping windows that run in
+    the same length-sorted batches as everything else, and the chunk vector
+    is the mean of its token states over all windows. Use a cache opened
+    with windowed=True in that mode.
+    """
+    chunks = list(chunks)
+    if not chunks:
+        return np.zeros((0, embedding_dim()), dtype=np.float32)
+
+    cached = cache.get_many(chunks) if cache is not None else {}
+    pending = [position for position in range(len(chunks)) if position not in cached]
+    if cache is not None:
+        count("cache.hits", len(cached))
+        count("cache.misses", len(pending))
+    count("chunks.embedded", len(pending))
+
+    # A fully cached input never loads the model
+    encoded = None
+    if pending:
+        pending_chunks = [chunks[position] for position in pending]
+        if pool is not None:
+            with stage("encode"):
+                encoded = pool.embed(pending_chunks, windowed=windowed)
+        else:
+            encoded = _encode(pending_chunks, batch_size, backend, windowed=windowed).embeddings
+        if cache is not None:
+            cache.put_many(pending_chunks, encoded)
+
+    dim = encoded.shape[1] if encoded is not None else len(next(iter(cached.values())))
+    embeddings = np.zeros((len(chunks), dim), dtype=np.float32)
+    for position, vector in cached.items():
+        embeddings[position] = vector
+    if encoded is not None:
+        embeddings[pending] = encoded
+
+    return embeddings
+
+def embed_windows(chunks, batch_size=32, backend="torch", stride=WINDOW_STRIDE):
+    """Embed chunks in windowed mode, keeping every window's embedding.
+
+    Returns WindowedEmbeddings: chunk-level vectors as from
+    get_embeddings(windowed=True), plus one vector and byte span per window
+    (a chunk that fits in one window has a single window covering all of
+    it). Comparing window vectors shows which part of two long chunks is
+    duplicated (see detection.duplicated_regions).
+    """
+    chunks = list(chunks)
+    if not chunks:
+        dim = embedding_dim()
+        return WindowedEmbeddings(np.zeros((0, dim), np.float32), np.zeros((0, dim), np.float32),
+                                  np.zeros(0, np.int64), np.zeros((0, 2), np.int64))
+    return _encode(chunks, batch_size, backend, windowed=True, stride=stride, with_spans=True)
+
+def embed_hierarchical(chunks, spans, batch_size=32, backend="torch"):
+    """Embed chunks, and sub-spans of them from the same forward passes.
+
+    spans holds (chunk index, start, end, code) tuples, start and end being
+    byte offsets into the chunk's UTF-8 code. A span's embedding is the mean
+    encoder state of the chunk tokens overlapping it, so spans cost no
+    forward pass of their own. Spans cut off by the 512-token truncation are
+    embedded from their code instead, as are all spans with a backend that
+    only returns pooled vectors ("onnx") or a tokenizer that cannot map
+    tokens back to the text. Returns (chunk embeddings, span
+    embeddings) as float32 matrices.
+    """
+    chunks = list(chunks)
+    spans = list(spans)
+    tokenizer, model = load_model()
+    runner = get_backend(backend, model, MODEL_NAME, MODEL_REVISION)
+    dim = model.config.d_model
+    embeddings = np.zeros((len(chunks), dim), dtype=np.float32)
+    span_embeddings = np.zeros((len(spans), dim), dtype=np.float32)
+    offsets = None
+    if chunks and hasattr(runner, "hidden_states"):
+        with stage("tokenize"):
+            encoded, offsets = _tokenize(tokenizer, chunks, with_offsets=True, truncation=True, max_length=MAX_LENGTH)
+    if offsets is None:
+        missing = list(range(len(spans)))
+        if chunks:
+            embeddings = _encode(chunks, batch_size, backend).embeddings
+    else:
+        count("tokens", sum(map(len, encoded)))
+        by_chunk = {}
+        for position, (index, start, end, _) in enumerate(spans):
+            by_chunk.setdefault(index, []).append((position, start, end))
+
+        missing = []
+        order = sorted(range(len(encoded)), key=lambda index: len(encoded[index]))
+        for start in range(0, len(order), batch_size):
+            bucket = order[start:start + batch_size]
+            inputs = tokenizer.pad({"input_ids": [encoded[index] for index in bucket]}, return_tensors="np")
+            with stage("encode"):
+                states = runner.hidden_states(inputs["input_ids"], inputs["attention_mask"])
+            mask = inputs["attention_mask"][..., None].astype(np.float32)
+            embeddings[bucket] = (states * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1)
+
+            for row, index in enumerate(bucket):
+                if index not in by_chunk:
+                    continue
+                token_starts, token_ends = offsets[index][:, 0], offsets[index][:, 1]
+                for position, span_start, span_end in by_chunk[index]:
+                    # Special tokens span no bytes, so they never overlap
+                    tokens = np.flatnonzero((token_starts < span_end) & (token_ends > span_start))
+                    if span_end > token_ends.max(initial=0) or not len(tokens):
+                        missing.append(position)
+                        continue
+                    span_embeddings[position] = states[row, tokens].mean(axis=0)
+        count("spans.pooled", len(spans) - len(missing))
+
+    if missing:
+        span_embeddings[missing] = _encode([spans[position][3] for position in missing], batch_size, backend).embeddings
+    return embeddings, span_embeddings
+
+def _encode(chunks, batch_size, backend="torch", windowed=False, stride=WINDOW_STRIDE, with_spans=False):
+    """Run the encoder over chunks, sorted into length buckets.
+
+    Returns WindowedEmbeddings; without windowed every chunk is one
+    (possibly truncated) window. Window spans are only worked out with
+    with_spans.
+    """
+    tokenizer, model = load_model()
+    runner = get_backend(backend, model, MODEL_NAME, MODEL_REVISION)
+
+    # Tokenize everything at once, without padding
+    with stage("tokenize"):
+        if windowed:
+            content, offsets = _tokenize(tokenizer, chunks, with_offsets=with_spans, add_special_tokens=False,
+                                         verbose=False)
+        else:
+            encoded, _ = _tokenize(tokenizer, chunks, truncation=True, max_length=MAX_LENGTH)
+    if windowed:
+        encoded, owners, starts, stops, weights = _windows(tokenizer, content, MAX_LENGTH, stride)
+    else:
+        owners = np.arange(len(chunks))
+        weights = np.ones(len(chunks), dtype=np.float32)
+    count("tokens", sum(map(len, encoded)))
+
+    # Sort by token length so each batch is a bucket of similar lengths
+    # and padding stays minimal
+    windows = np.zeros((len(encoded), model.config.d_model), dtype=np.float32)
+    order = sorted(range(len(encoded)), key=lambda index: len(encoded[index]))
+
+    for start in range(0, len(order), batch_size):
+        bucket = order[start:start + batch_size]
+        inputs = tokenizer.pad({"input_ids": [encoded[index] for index in bucket]}, return_tensors="np")
+        with stage("encode"):
+            windows[bucket] = runner.embed(inputs["input_ids"], inputs["attention_mask"])
+
+    if not windowed:
+        return WindowedEmbeddings(windows, windows, owners, None)
+
+    # Weight each window by the tokens it adds to the previous one, so the
+    # chunk vector averages every token once
+    embeddings = np.zeros((len(chunks), windows.shape[1]), dtype=np.float32)
+    np.add.at(embeddings, owners, windows * weights[:, None])
+    embeddings /= np.maximum(np.bincount(owners, weights=weights, minlength=len(chunks)), 1)[:, None]
+    spans = _window_spans(content, offsets, owners, starts, stops) if with_spans else None
+    return WindowedEmbeddings(embeddings, windows, owners, spans)
+
+def _windows(tokenizer, content, max_length, stride):
+    """Cut token sequences (without special tokens) into overlapping windows.
+
+    Returns the windows with special tokens added, the chunk each belongs
+    to, its token start and stop in the chunk, and its weight: the number
+    of tokens not already covered by the window before it.
+    """
+    # The special tokens around a single sequence (<s> ... </s> for CodeT5)
+    special = tokenizer("")["input_ids"]
+    prefix, suffix = special[:1], special[1:]
+    width = max_length - len(special)
+    sequences, owners, starts, stops, weights = [], [], [], [], []
+    for owner, ids in enumerate(content):
+        covered = 0
+        start = 0
+        while True:
+            # The last window is aligned to the end of the chunk
+            start = max(0, min(start, len(ids) - width))
+            stop = min(start + width, len(ids))
+            sequences.append(prefix + ids[start:stop] + suffix)
+            owners.append(owner)
+            starts.append(start)
+            stops.append(stop)
+            weights.append(max(stop - covered, 1))
+            covered = stop
+            if stop >= len(ids):
+                break
+            start += stride
+    return sequences, np.array(owners), np.array(starts), np.array(stops), np.array(weights, dtype=np.float32)
+
+def _window_spans(content, offsets, owners, starts, stops):
+    """Byte offsets of each window in its chunk's UTF-8 text (token offsets
+    when the tokenizer cannot map tokens back to the text)"""
+    spans = np.zeros((len(owners), 2), dtype=np.int64)
+    for window, (owner, start, stop) in enumerate(zip(owners.tolist(), starts.tolist(), stops.tolist())):
+        if offsets is None:
+            spans[window] = start, stop
+        elif stop > start:
+            spans[window] = offsets[owner][start, 0], offsets[owner][stop - 1, 1]
+    return spans
+
+def _tokenize(tokenizer, chunks, with_offsets=False, **options):
+    """Token ids of chunks, and with with_offsets the (start, end) byte
+    offsets of every token in its chunk's UTF-8 code as one array per chunk
+    (special tokens span no bytes). Offsets are None if the tokenizer is
+    neither a fast tokenizer nor byte-level BPE. Without offsets the ids
+    come through token_cache.
+    """
+    if not with_offsets:
+        return token_cache.tokenize(tokenizer, chunks, **options), None
+    fast = getattr(tokenizer, "is_fast", False)
+    encoded = tokenizer(chunks, return_offsets_mapping=fast, **options)
+    ids = encoded["input_ids"]
+    if fast:
+        return ids, [_char_to_byte_offsets(chunk, mapping) for chunk, mapping in zip(chunks, encoded["offset_mapping"])]
+    if not hasattr(tokenizer, "byte_encoder"):
+        return ids, None
+    # Byte-level BPE tokens spell out their bytes one character each, so a
+    # token's length is its byte count
+    special = set(tokenizer.all_special_ids)
+    offsets = []
+    for sequence in ids:
+        tokens = tokenizer.convert_ids_to_tokens(sequence)
+        lengths = np.array([0 if id in special else len(token) for id, token in zip(sequence, tokens)], dtype=np.int64)
+        ends = np.cumsum(lengths)
+        offsets.append(np.stack([ends - lengths, ends], axis=1))
+    return ids, offsets
+
+def _char_to_byte_offsets(text, mapping):
+    mapping = np.array(mapping, dtype=np.int64).reshape(-1, 2)
+    if text.isascii():
+        return mapping
+    positions = np.concatenate([[0], np.cumsum([len(char.encode('utf-8')) for char in text])])
+    return positions[mapping]
@@ -0,0 +1,218 @@
+import atexit
+import hashlib
+import os
+import shutil
+import struct
+import subprocess
+import tempfile
+import threading
+from collections import OrderedDict
+
+from .profiling import count, stage
+
+RESOURCES_DIR = os.path.join(os.path.dirname(__file__), 'resources')
+JAR_PATH = os.path.join(RESOURCES_DIR, 'google-java-format-1.25.2-all-deps.jar')
+WORKER_SOURCE = os.path.join(RESOURCES_DIR, 'FormatterWorker.java')
+
+# google-java-format uses javac internals that are not exported by default
+JAVAC_EXPORTS = [
+    f'--add-exports=jdk.compiler/com.sun.tools.javac.{package}=ALL-UNNAMED'
+    for package in ('api', 'code', 'file', 'parser', 'tree', 'util')
+]
+
+# Keep the CLI fallback to whitespace-only changes, like the worker
+CLI_OPTIONS = ['--skip-sorting-imports', '--skip-removing-unused-imports', '--skip-reflowing-long-strings']
+
+class JavaFormatter:
+    """Formats many Java sources through a single google-java-format JVM.
+
+    The bundled FormatterWorker is started once and sources are streamed to
+    it over stdin/stdout as length-prefixed frames, so the JVM startup cost is
+    paid once per process instead of once per snippet. If the worker cannot
+    be started, batches fall back to one `java -jar ... --replace` run over
+    many temp files. Results are memoized by content, so formatting the same
+    source twice is free.
+    """
+
+    def __init__(self, jar_path=JAR_PATH, java='java', timeout=30, memo_size=256):
+        self.jar_path = jar_path
+        self.java = java
+        self.timeout = timeout
+        self.memo_size = memo_size
+        self._memo = OrderedDict()
+        self._lock = threading.Lock()
+        self._process = None
+        self._worker_failed = False
+        self.available = os.path.exists(jar_path)
+        if not self.available:
+            print(f"Warning: Google Java Format jar not found at {jar_path}")
+
+    def format(self, java_code):
+        """Format one source, returning it unchanged if formatting fails"""
+        return self.format_many([java_code])[0]
+
+    def format_many(self, sources):
+        """Format a list of sources, returning them in the same order"""
+        sources = list(sources)
+        if not self.available:
+            return sources
+
+        with self._lock, stage("format"):
+            results = [self._memo_get(source) for source in sources]
+            pending = [index for index, result in enumerate(results) if result is None]
+            count("format.sources", len(pending))
+            count("format.memo_hits", len(sources) - len(pending))
+
+            if pending and self._start_worker():
+                for index in pending:
+                    results[index] = self._format_with_worker(sources[index])
+                    if results[index] is None:
+                        break
+                pending = [index for index in pending if results[index] is None]
+
+            if pending:
+                formatted = self._format_with_cli([sources[index] for index in pending])
+                for index, result in zip(pending, formatted):
+                    results[index] = result
+
+            for source, result in zip(sources, results):
+                if result is not None:
+                    self._memo_put(source, result)
+
+        return [source if result is None else result for source, result in zip(sources, results)]
+
+    def close(self):
+        """Stop the worker JVM"""
+        with self._lock:
+            self._stop_worker()
+
+    def _start_worker(self):
+        if self._process is not None and self._process.poll() is None:
+            return True
+        if self._worker_failed:
+            return False
+        try:
+            self._process = subprocess.Popen(
+                [self.java, *JAVAC_EXPORTS, '-cp', self.jar_path, WORKER_SOURCE],
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+            )
+            return True
+        except OSError as e:
+            print(f"Error starting Google Java Format worker: {e}")
+            self._worker_failed = True
+            return False
+
+    def _stop_worker(self):
+        if self._process is not None:
+            try:
+                self._process.stdin.close()
+                self._process.wait(timeout=5)
+            except (OSError, subprocess.TimeoutExpired):
+                self._process.kill()
+            self._process = None
+
+    def _format_with_worker(self, java_code):
+        """Send one frame to the worker; returns None if the worker failed"""
+        payload = java_code.encode('utf-8')
+        # Kill a stuck worker so the blocking read below returns
+        watchdog = threading.Timer(self.timeout, self._process.kill)
+        watchdog.start()
+        try:
+            self._process.stdin.write(struct.pack('>i', len(payload)) + payload)
+            self._process.stdin.flush()
+            status = _read_exact(self._process.stdout, 1)[0]
+            length = struct.unpack('>i', _read_exact(self._process.stdout, 4))[0]
+            result = _read_exact(self._process.stdout, length).decode('utf-8')
+        except (OSError, EOFError, struct.error) as e:
+            print(f"Google Java Format worker stopped: {e}")
+            self._stop_worker()
+            # Use the CLI fallback from now on instead of restarting a
+            # worker that may fail again
+            self._worker_failed = True
+            return None
+        finally:
+            watchdog.cancel()
+
+        if status != 0:
+            print(f"Google Java Format error: {result}")
+            return java_code
+        return result
+
+    def _format_with_cli(self, sources, files_per_run=200):
+        """Format sources with one JVM launch per files_per_run temp files"""
+        results = list(sources)
+        temp_dir = tempfile.mkdtemp(prefix='duplicate-tool-')
+        try:
+            paths = []
+            for index, source in enumerate(sources):
+                path = os.path.join(temp_dir, f'Source{index}.java')
+                with open(path, 'w', encoding='utf-8') as f:
+                    f.write(source)
+                paths.append(path)
+
+            for start in range(0, len(paths), files_per_run):
+                batch = paths[start:start + files_per_run]
+                try:
+                    result = subprocess.run(
+                        [self.java, '-jar', self.jar_path, '--replace', *CLI_OPTIONS, *batch],
+                        capture_output=True, text=True, timeout=self.timeout * len(batch),
+                    )
+                except OSError as e:
+                    # No usable java executable; stop trying for this process
+                    print(f"Error formatting code: {e}")
+                    self.available = False
+                    break
+                except subprocess.TimeoutExpired as e:
+                    print(f"Error formatting code: {e}")
+                    continue
+                if result.returncode != 0:
+                    # google-java-format still rewrites the files it could
+                    # parse; the others are left as they were
+                    print(f"Google Java Format error: {result.stderr}")
+
+                for index in range(start, start + len(batch)):
+                    with open(paths[index], 'r', encoding='utf-8') as f:
+                        results[index] = f.read()
+        finally:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+        return results
+
+    def _memo_get(self, source):
+        key = hashlib.sha1(source.encode('utf-8')).digest()
+        result = self._memo.get(key)
+        if result is not None:
+            self._memo.move_to_end(key)
+        return result
+
+    def _memo_put(self, source, result):
+        key = hashlib.sha1(source.encode('utf-8')).digest()
+        self._memo[key] = result
+        self._memo.move_to_end(key)
+        while len(self._memo) > self.memo_size:
+            self._memo.popitem(last=False)
+
+def _read_exact(stream, size):
+    data = b''
+    while len(data) < size:
+        chunk = stream.read(size - len(data))
+        if not chunk:
+            raise EOFError('worker closed its output')
+        data += chunk
+    return data
+
+_formatter = None
+_formatter_pid = None
+_formatter_lock = threading.Lock()
+
+def get_formatter():
+    """Return the process-wide JavaFormatter, starting it on first use"""
+    global _formatter, _formatter_pid
+    with _formatter_lock:
+        # A forked child must not share its parent's worker pipes
+        if _formatter is None or _formatter_pid != os.getpid():
+            _formatter = JavaFormatter()
+            _formatter_pid = os.getpid()
+            atexit.register(_formatter.close)
+        return _formatter
@@ -0,0 +1,109 @@
+import numpy as np
+
+class UnionFind:
+    """Disjoint sets over 0..n-1 with path halving and union by size"""
+
+    def __init__(self, n):
+        self.parent = list(range(n))
+        self.size = [1] * n
+
+    def find(self, item):
+        parent = self.parent
+        while parent[item] != item:
+            parent[item] = parent[parent[item]]
+            item = parent[item]
+        return item
+
+    def union(self, a, b):
+        a, b = self.find(a), self.find(b)
+        if a == b:
+            return a
+        if self.size[a] < self.size[b]:
+            a, b = b, a
+        self.parent[b] = a
+        self.size[a] += self.size[b]
+        return a
+
+    def groups(self):
+        """Return every set with more than one member, ordered by smallest member"""
+        members = {}
+        for item in range(len(self.parent)):
+            members.setdefault(self.find(item), []).append(item)
+        return [group for group in members.values() if len(group) > 1]
+
+def connected_components(n, edges, threshold):
+    """Group nodes joined by any chain of edges with similarity > threshold"""
+    sets = UnionFind(n)
+    for i, j, similarity in edges:
+        if similarity > threshold:
+            sets.union(i, j)
+    return sets.groups()
+
+def complete_linkage_groups(n, edges, threshold, member_threshold):
+    """Group nodes so that every pair inside a group is more similar than
+    member_threshold.
+
+    Edges above threshold are merged greedily from the most similar down, and
+    two groups are only merged when all of their cross pairs have an edge
+    above member_threshold. Because edges are visited in a fixed order, the
+    result does not depend on node order. edges must include every pair above
+    member_threshold; pairs without an edge count as dissimilar.
+    """
+    neighbours = [set() for _ in range(n)]
+    strong = []
+    for i, j, similarity in edges:
+        if similarity > member_threshold:
+            neighbours[i].add(j)
+            neighbours[j].add(i)
+        if similarity > threshold:
+            strong.append((-similarity, min(i, j), max(i, j)))
+    strong.sort()
+
+    sets = UnionFind(n)
+    members = {node: [node] for node in range(n)}
+    for _, i, j in strong:
+        root_i, root_j = sets.find(i), sets.find(j)
+        if root_i == root_j:
+            continue
+        group_i, group_j = members[root_i], members[root_j]
+        if all(neighbours[a].issuperset(group_j) for a in group_i):
+            root = sets.union(root_i, root_j)
+            merged = group_i + group_j
+            del members[root_i], members[root_j]
+            members[root] = merged
+
+    return sorted((sorted(group) for group in members.values() if len(group) > 1), key=lambda group: group[0])
+
+def group_average_similarities(embeddings, groups):
+    """Mean pairwise cosine similarity inside each group, excluding self pairs.
+
+    Uses sum_{a != b} v_a . v_b = |sum v|^2 - sum |v|^2, so every group costs
+    one pass over its members' vectors instead of a loop over member pairs.
+    embeddings must be L2-normalized.
+    """
+    if not groups:
+        return []
+    order = np.concatenate([np.asarray(group) for group in groups])
+    sizes = np.array([len(group) for group in groups])
+    starts = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+
+    vectors = np.asarray(embeddings[order], dtype=np.float32)
+    sums = np.add.reduceat(vectors, starts, axis=0)
+    squared_norms = np.add.reduceat(np.einsum('ij,ij->i', vectors, vectors), starts)
+    pair_sums = np.einsum('ij,ij->i', sums, sums) - squared_norms
+    return (pair_sums / (sizes * (sizes - 1))).tolist()
+
+def build_groups(n, edges, threshold, strategy="clique", member_threshold=None):
+    """Group n nodes from sparse (i, j, similarity) edges.
+
+    strategy="clique" keeps every group's members pairwise similar above
+    member_threshold (complete linkage); strategy="components" returns the
+    connected components of the edges above threshold.
+    """
+    if strategy == "clique":
+        if member_threshold is None:
+            member_threshold = threshold
+        return complete_linkage_groups(n, edges, threshold, member_threshold)
+    if strategy == "components":
+        return connected_components(n, edges, threshold)
+    raise ValueError(f"Unknown grouping strategy: {strategy}")
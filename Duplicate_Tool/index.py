@@ -0,0 +1,527 @@
+import os
+import sqlite3
+import threading
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import numpy as np
+from .cache import _ExclusiveTransaction
+from .chunker import METHOD_KINDS
+from .ann import LSHIndex
+from .detection import group_embeddings
+from .embedding import MODEL_NAME, MODEL_REVISION, get_embeddings
+from .preprocessing import content_hash
+from .scanner import extract_file_chunks, iter_java_files
+from .similarity import normalize_embeddings
+
+# A chunk as stored in the index: its location, a hash of its
+# whitespace-normalized code and the id of the group it belongs to (or None)
+IndexedChunk = namedtuple(
+    'IndexedChunk',
+    ['id', 'path', 'kind', 'start_line', 'end_line', 'start_offset', 'end_offset', 'hash', 'group_id'],
+)
+
+# A duplicate group in the index; chunks are IndexedChunk records
+IndexedGroup = namedtuple('IndexedGroup', ['id', 'family', 'chunks', 'similarity'])
+
+# The indexed chunks most similar to one chunk of a queried file: matches
+# holds (IndexedChunk, similarity) pairs, most similar first
+QueryResult = namedtuple('QueryResult', ['chunk', 'matches'])
+
+# What an update did to the duplicate groups. added and removed hold
+# IndexedGroup records, changed holds (old group, new group) pairs.
+IndexUpdate = namedtuple('IndexUpdate', ['added', 'changed', 'removed'])
+
+# Settings that must match between runs for stored groups to stay valid
+SETTINGS = ('root', 'threshold', 'use_formatting', 'detect_intra_method', 'grouping', 'backend', 'model')
+
+class DuplicateIndex:
+    """Persisted chunks, embeddings and duplicate groups of one source tree.
+
+    The index lives in a directory next to (or anywhere outside) the tree:
+    an SQLite database of files, chunks and groups, and a memory-mapped
+    float32 matrix of L2-normalized embeddings with one row per chunk.
+    update() re-chunks only the changed files, embeds only chunks whose code
+    is new, and regroups only the neighbourhood of what changed, so a
+    check on a small change set costs seconds whatever the size of the tree.
+
+    query() and query_file() look up the indexed chunks most similar to new
+    code. With search="lsh" they use random-hyperplane LSH tables (see
+    ann.LSHIndex) kept in the same directory, rebuilt after each update.
+    """
+
+    def __init__(self, path, root, threshold=0.90, use_formatting=True, detect_intra_method=True,
+                 search="exact", neighbours=10, grouping="clique", backend="torch", cache=None,
+                 batch_size=32, workers=None, timeout=60.0, windowed=False):
+        self.path = path
+        self.root = os.path.abspath(root)
+        self.threshold = threshold
+        self.use_formatting = use_formatting
+        self.detect_intra_method = detect_intra_method
+        self.search = search
+        self.neighbours = neighbours
+        self.grouping = grouping
+        self.backend = backend
+        self.cache = cache
+        self.batch_size = batch_size
+        self.workers = workers
+        self.windowed = windowed
+        os.makedirs(path, exist_ok=True)
+
+        # _lock serializes updates; _db_lock guards each SQLite transaction
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._vectors = None
+        self._ann = None
+        self._db = sqlite3.connect(
+            os.path.join(path, "index.sqlite3"),
+            timeout=timeout,
+            isolation_level=None,
+            check_same_thread=False,
+        )
+        with self._transaction():
+            self._db.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)")
+            self._db.execute("CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, mtime_ns INTEGER, size INTEGER)")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS chunks (id INTEGER PRIMARY KEY, path TEXT, kind TEXT, "
+                "start_line INTEGER, end_line INTEGER, start_offset INTEGER, end_offset INTEGER, "
+                "hash TEXT, group_id INTEGER, slot INTEGER UNIQUE)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS chunks_path ON chunks (path)")
+            self._db.execute("CREATE TABLE IF NOT EXISTS groups (id INTEGER PRIMARY KEY, family TEXT, similarity REAL)")
+            self._check_settings()
+
+        self._load()
+
+    def _check_settings(self):
+        settings = {
+            'threshold': repr(self.threshold),
+            'use_formatting': repr(self.use_formatting),
+            'detect_intra_method': repr(self.detect_intra_method),
+            'grouping': self.grouping,
+            'backend': self.backend,
+            'model': f"{MODEL_NAME}@{MODEL_REVISION}" + ("+window" if self.windowed else ""),
+            'root': self.root,
+        }
+        stored = dict(self._db.execute("SELECT name, value FROM meta").fetchall())
+        if not stored:
+            self._db.executemany("INSERT INTO meta VALUES (?, ?)", settings.items())
+            return
+        for name in SETTINGS:
+            if stored.get(name) != settings[name]:
+                raise ValueError(
+                    f"Index at {self.path} was built with {name}={stored.get(name)}, not {settings[name]}; "
+                    "rebuild it into a new directory"
+                )
+
+    def _load(self):
+        """Read chunk records and slots into memory"""
+        self._chunks = {}
+        self._slots = {}
+        for row in self._db.execute(
+            "SELECT id, path, kind, start_line, end_line, start_offset, end_offset, hash, group_id, slot FROM chunks"
+        ):
+            self._chunks[row[0]] = IndexedChunk(*row[:9])
+            self._slots[row[0]] = row[9]
+        self._similarities = dict(self._db.execute("SELECT id, similarity FROM groups").fetchall())
+        dim = self._db.execute("SELECT value FROM meta WHERE name = 'dim'").fetchone()
+        if dim is not None:
+            self._open_vectors(int(dim[0]), max(self._slots.values(), default=-1) + 1)
+
+    def __len__(self):
+        return len(self._chunks)
+
+    def chunks(self):
+        """Every indexed chunk, ordered by file and position"""
+        return sorted(self._chunks.values(), key=lambda chunk: (chunk.path, chunk.start_offset or 0, chunk.id))
+
+    def groups(self):
+        """Every duplicate group, ordered by id"""
+        members = {}
+        for chunk in self.chunks():
+            if chunk.group_id is not None:
+                members.setdefault(chunk.group_id, []).append(chunk)
+        return [self._group(group_id, chunks) for group_id, chunks in sorted(members.items())]
+
+    def build(self):
+        """Index every .java file under root from scratch"""
+        deleted = sorted({chunk.path for chunk in self._chunks.values()})
+        changed = [os.path.relpath(path, self.root) for path in iter_java_files(self.root)]
+        return self.update(changed=changed, deleted=deleted)
+
+    def refresh(self):
+        """Update the index for every file added, modified or deleted under
+        root since the last update, judged by modification time and size"""
+        known = {row[0]: (row[1], row[2]) for row in self._db.execute("SELECT path, mtime_ns, size FROM files")}
+        changed = []
+        present = set()
+        for path in iter_java_files(self.root):
+            relative = os.path.relpath(path, self.root)
+            present.add(relative)
+            stat = os.stat(path)
+            if known.get(relative) != (stat.st_mtime_ns, stat.st_size):
+                changed.append(relative)
+        deleted = [path for path in known if path not in present]
+        return self.update(changed=changed, deleted=deleted)
+
+    def update(self, changed=(), deleted=()):
+        """Bring the index up to date for changed and deleted files.
+
+        Paths may be absolute or relative to root. Chunks of a changed file
+        whose code is unchanged keep their id and embedding; only new code is
+        embedded. Groups are recomputed for the new chunks, their neighbours
+        above the grouping threshold, and every group any of those (or a
+        removed chunk) belonged to. Returns an IndexUpdate describing which
+        groups were added, changed and removed.
+        """
+        with self._lock:
+            changed = sorted({self._relative(path) for path in changed})
+            deleted = sorted({self._relative(path) for path in deleted} - set(changed))
+            extracted = self._extract(changed)
+
+            by_file = {}
+            for chunk in self._chunks.values():
+                by_file.setdefault(chunk.path, []).append(chunk.id)
+
+            removed = []
+            new_chunks = []
+            moved = []
+            for path in changed + deleted:
+                # Match the file's new chunks to its old ones by kind and code
+                old = {}
+                for chunk_id in by_file.get(path, []):
+                    chunk = self._chunks[chunk_id]
+                    old.setdefault((chunk.kind, chunk.hash), []).append(chunk_id)
+                for chunk in extracted.get(path, []):
+                    key = (chunk.kind, content_hash(chunk.code))
+                    if old.get(key):
+                        moved.append((old[key].pop(0), chunk))
+                    else:
+                        new_chunks.append((path, chunk))
+                removed.extend(chunk_id for ids in old.values() for chunk_id in ids)
+
+            touched_groups = {self._chunks[chunk_id].group_id for chunk_id in removed} - {None}
+            snapshot = {group.id: group for group in self.groups() if group.id in touched_groups}
+            new_ids = self._store(new_chunks, moved, removed, changed, deleted)
+
+            # Recompute groups over the neighbourhood of what changed
+            region = set(new_ids)
+            region.update(chunk.id for chunk in self._chunks.values() if chunk.group_id in touched_groups)
+            region.update(self._neighbours(new_ids))
+            groups_in_region = {self._chunks[chunk_id].group_id for chunk_id in region} - {None}
+            touched_groups |= groups_in_region
+            region.update(chunk.id for chunk in self._chunks.values() if chunk.group_id in groups_in_region)
+
+            update = self._regroup(region, touched_groups, snapshot)
+            if self.search == "lsh" and (new_ids or removed):
+                self._ann = None
+                if self._slots:
+                    self._lsh(rebuild=True)
+                elif os.path.exists(os.path.join(self.path, "ann.npz")):
+                    # Nothing left to search; tables are built again once
+                    # chunks are added
+                    os.remove(os.path.join(self.path, "ann.npz"))
+            return update
+
+    def similar(self, embeddings, k=10, threshold=None, block_size=4096, exclude_path=None):
+        """The k indexed chunks most similar to each row of embeddings.
+
+        Returns one list per row of (IndexedChunk, similarity) pairs, most
+        similar first, leaving out pairs at or below threshold if given and
+        chunks of the file exclude_path (relative to root or absolute).
+        """
+        queries = normalize_embeddings(np.atleast_2d(embeddings))
+        with self._lock:
+            if exclude_path is not None:
+                exclude_path = self._relative(exclude_path)
+            if self.search == "lsh" and self._chunks:
+                return self._similar_lsh(queries, k, threshold, exclude_path)
+
+            ids = [chunk_id for chunk_id, chunk in self._chunks.items() if chunk.path != exclude_path]
+            best_ids = np.zeros((len(queries), 0), dtype=np.int64)
+            best_scores = np.zeros((len(queries), 0), dtype=np.float32)
+            for start in range(0, len(ids), block_size):
+                block = np.array(ids[start:start + block_size])
+                scores = queries @ self._vectors[[self._slots[chunk_id] for chunk_id in block]].T
+                # Keep a running top k over the blocks seen so far
+                best_ids = np.hstack([best_ids, np.broadcast_to(block, scores.shape)])
+                best_scores = np.hstack([best_scores, scores])
+                if best_scores.shape[1] > k:
+                    keep = np.argpartition(-best_scores, k, axis=1)[:, :k]
+                    best_ids = np.take_along_axis(best_ids, keep, axis=1)
+                    best_scores = np.take_along_axis(best_scores, keep, axis=1)
+
+            results = []
+            for row_ids, row_scores in zip(best_ids, best_scores):
+                order = np.argsort(-row_scores, kind='stable')
+                results.append([
+                    (self._chunks[int(row_ids[index])], float(row_scores[index]))
+                    for index in order
+                    if threshold is None or row_scores[index] > threshold
+                ])
+            return results
+
+    def query(self, code, k=10, threshold=None):
+        """The k indexed chunks most similar to a snippet of code, as
+        (IndexedChunk, similarity) pairs, most similar first"""
+        embeddings = get_embeddings([code], batch_size=self.batch_size, cache=self.cache, backend=self.backend,
+                                    windowed=self.windowed)
+        return self.similar(embeddings, k=k, threshold=threshold)[0]
+
+    def query_file(self, path, k=10, threshold=None):
+        """Chunk a .java file like the indexed ones and look up each chunk's k
+        most similar indexed chunks.
+
+        The file does not have to be in the tree; if it is, its own indexed
+        chunks are left out of the matches. Returns a QueryResult per chunk,
+        whose chunk is a Chunk record of the file.
+        """
+        chunks = extract_file_chunks(path, use_formatting=self.use_formatting, detect_intra_method=self.detect_intra_method)
+        if not chunks:
+            return []
+        embeddings = get_embeddings([chunk.code for chunk in chunks], batch_size=self.batch_size, cache=self.cache,
+                                    backend=self.backend, windowed=self.windowed)
+        absolute = os.path.abspath(path)
+        exclude_path = absolute if absolute.startswith(self.root + os.sep) else None
+        matches = self.similar(embeddings, k=k, threshold=threshold, exclude_path=exclude_path)
+        return [QueryResult(chunk, chunk_matches) for chunk, chunk_matches in zip(chunks, matches)]
+
+    def close(self):
+        self._db.close()
+        self._vectors = None
+        self._ann = None
+
+    def _similar_lsh(self, queries, k, threshold, exclude_path):
+        lsh, slots = self._lsh()
+        chunk_ids = {slot: chunk_id for chunk_id, slot in self._slots.items()}
+        # Ask for extra candidates to make up for the excluded chunks
+        skipped = sum(chunk.path == exclude_path for chunk in self._chunks.values()) if exclude_path else 0
+        results = []
+        for rows, scores in lsh.query(queries, k=k + skipped, threshold=threshold):
+            matches = [(self._chunks[chunk_ids[slot]], float(score)) for slot, score in zip(slots[rows].tolist(), scores)]
+            results.append([match for match in matches if match[0].path != exclude_path][:k])
+        return results
+
+    def _lsh(self, rebuild=False):
+        """The LSH tables over every indexed vector, with the slot of each of
+        their rows; loaded from ann.npz, or built and saved there when it is
+        missing or out of date (or rebuild is set)"""
+        if self._ann is not None:
+            return self._ann
+        slots = np.array(sorted(self._slots.values()), dtype=np.int64)
+        vectors = self._vectors[slots]
+        path = os.path.join(self.path, "ann.npz")
+        if os.path.exists(path) and not rebuild:
+            try:
+                lsh, extra = LSHIndex.load(path, vectors)
+                if np.array_equal(extra['slots'], slots):
+                    self._ann = lsh, slots
+                    return self._ann
+            except (OSError, ValueError, KeyError) as e:
+                print(f"Warning: rebuilding LSH tables {path}: {e}")
+        lsh = LSHIndex().fit(vectors)
+        lsh.save(path, slots=slots)
+        self._ann = lsh, slots
+        return self._ann
+
+    def _relative(self, path):
+        if os.path.isabs(path):
+            path = os.path.relpath(path, self.root)
+        return os.path.normpath(path)
+
+    def _extract(self, paths):
+        """Chunk the files that still exist, returning {relative path: [Chunk]}"""
+        existing = [path for path in paths if os.path.isfile(os.path.join(self.root, path))]
+        extract = partial(extract_file_chunks, use_formatting=self.use_formatting, detect_intra_method=self.detect_intra_method)
+        absolute = [os.path.join(self.root, path) for path in existing]
+        if self.workers == 1 or len(absolute) <= 8:
+            results = list(map(extract, absolute))
+        else:
+            with ProcessPoolExecutor(max_workers=self.workers) as pool:
+                results = list(pool.map(extract, absolute, chunksize=4))
+        return dict(zip(existing, results))
+
+    def _store(self, new_chunks, moved, removed, changed, deleted):
+        """Embed new chunks and write every chunk and file change; returns the new ids"""
+        vectors = None
+        if new_chunks:
+            embeddings = get_embeddings([chunk.code for _, chunk in new_chunks], batch_size=self.batch_size,
+                                        cache=self.cache, backend=self.backend, windowed=self.windowed)
+            vectors = normalize_embeddings(embeddings)
+
+        with self._transaction():
+            for chunk_id in removed:
+                del self._chunks[chunk_id], self._slots[chunk_id]
+            self._db.executemany("DELETE FROM chunks WHERE id = ?", [(chunk_id,) for chunk_id in removed])
+
+            for chunk_id, chunk in moved:
+                record = self._chunks[chunk_id]._replace(
+                    start_line=chunk.start_line, end_line=chunk.end_line,
+                    start_offset=chunk.start_offset, end_offset=chunk.end_offset,
+                )
+                self._chunks[chunk_id] = record
+            self._db.executemany(
+                "UPDATE chunks SET start_line = ?, end_line = ?, start_offset = ?, end_offset = ? WHERE id = ?",
+                [(chunk.start_line, chunk.end_line, chunk.start_offset, chunk.end_offset, chunk_id) for chunk_id, chunk in moved],
+            )
+
+            new_ids = []
+            if new_chunks:
+                if self._vectors is None:
+                    self._db.execute("INSERT INTO meta VALUES ('dim', ?)", (str(vectors.shape[1]),))
+                slots = self._free_slots(len(new_chunks))
+                self._open_vectors(vectors.shape[1], max(slots) + 1)
+                self._vectors[slots] = vectors
+                self._vectors.flush()
+                next_id = self._db.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM chunks").fetchone()[0]
+                rows = []
+                for offset, ((path, chunk), slot) in enumerate(zip(new_chunks, slots)):
+                    record = IndexedChunk(next_id + offset, path, chunk.kind, chunk.start_line, chunk.end_line,
+                                          chunk.start_offset, chunk.end_offset, content_hash(chunk.code), None)
+                    self._chunks[record.id] = record
+                    self._slots[record.id] = slot
+                    new_ids.append(record.id)
+                    rows.append((*record, slot))
+                self._db.executemany("INSERT INTO chunks VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+            self._db.executemany("DELETE FROM files WHERE path = ?", [(path,) for path in deleted])
+            file_rows = []
+            for path in changed:
+                absolute = os.path.join(self.root, path)
+                if os.path.isfile(absolute):
+                    stat = os.stat(absolute)
+                    file_rows.append((path, stat.st_mtime_ns, stat.st_size))
+                else:
+                    self._db.execute("DELETE FROM files WHERE path = ?", (path,))
+            self._db.executemany("INSERT OR REPLACE INTO files VALUES (?, ?, ?)", file_rows)
+        return new_ids
+
+    def _free_slots(self, count):
+        used = set(self._slots.values())
+        slots = []
+        slot = 0
+        while len(slots) < count:
+            if slot not in used:
+                slots.append(slot)
+            slot += 1
+        return slots
+
+    def _open_vectors(self, dim, rows):
+        """Map the embedding matrix, growing the file to hold at least rows rows"""
+        current = 0 if self._vectors is None else len(self._vectors)
+        if self._vectors is not None and rows <= current:
+            return
+        capacity = max(rows, 2 * current, 1024)
+        vectors_path = os.path.join(self.path, "embeddings.f32")
+        self._vectors = None
+        with open(vectors_path, "ab") as handle:
+            if handle.tell() < capacity * dim * 4:
+                handle.truncate(capacity * dim * 4)
+            else:
+                capacity = handle.tell() // (dim * 4)
+        self._vectors = np.memmap(vectors_path, dtype=np.float32, mode="r+", shape=(capacity, dim))
+
+    def _family(self, chunk):
+        return 'method' if chunk.kind in METHOD_KINDS else 'block'
+
+    def _family_threshold(self, family):
+        # Same thresholds as scanner.scan_directory
+        return self.threshold if family == 'method' else self.threshold + 0.05
+
+    def _neighbours(self, chunk_ids, block_size=4096):
+        """Ids of every chunk that could share a group with one of chunk_ids"""
+        found = set()
+        for family in ('method', 'block'):
+            queries = [chunk_id for chunk_id in chunk_ids if self._family(self._chunks[chunk_id]) == family]
+            if not queries:
+                continue
+            # Grouping keeps edges down to threshold * member_factor
+            threshold = self._family_threshold(family) * (0.95 if self.grouping == "clique" else 1.0)
+            candidates = [chunk.id for chunk in self._chunks.values() if self._family(chunk) == family]
+            query_vectors = self._vectors[[self._slots[chunk_id] for chunk_id in queries]]
+            for start in range(0, len(candidates), block_size):
+                block = candidates[start:start + block_size]
+                scores = self._vectors[[self._slots[chunk_id] for chunk_id in block]] @ query_vectors.T
+                found.update(block[row] for row in np.flatnonzero((scores > threshold).any(axis=1)).tolist())
+        return found
+
+    def _regroup(self, region, touched_groups, snapshot):
+        """Recompute the groups of the chunks in region and diff them against
+        the touched groups they replace.
+
+        snapshot holds the touched groups as they were before the update;
+        groups missing from it still have all their members.
+        """
+        old_groups = {group_id: set() for group_id in touched_groups}
+        for chunk in self._chunks.values():
+            if chunk.group_id in old_groups:
+                old_groups[chunk.group_id].add(chunk.id)
+        for group_id in touched_groups:
+            if group_id not in snapshot:
+                snapshot[group_id] = self._group(group_id, [self._chunks[chunk_id] for chunk_id in sorted(old_groups[group_id])])
+        # Removed chunks still count as members when matching groups
+        for group_id, group in snapshot.items():
+            old_groups[group_id] |= {chunk.id for chunk in group.chunks}
+
+        new_groups = []
+        for family in ('method', 'block'):
+            ids = sorted(chunk_id for chunk_id in region if self._family(self._chunks[chunk_id]) == family)
+            if len(ids) < 2:
+                continue
+            embeddings = self._vectors[[self._slots[chunk_id] for chunk_id in ids]]
+            groups = group_embeddings(embeddings, self._family_threshold(family), search=self.search,
+                                      neighbours=self.neighbours, grouping=self.grouping)
+            new_groups.extend((family, {ids[index] for index in group}, similarity) for group, similarity in groups)
+
+        added, changed = [], []
+        reused, matched = set(), set()
+        assignments = {chunk_id: None for chunk_id in region}
+        with self._transaction():
+            self._db.executemany("DELETE FROM groups WHERE id = ?", [(group_id,) for group_id in touched_groups])
+            for group_id in touched_groups:
+                self._similarities.pop(group_id, None)
+            next_id = self._db.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM groups").fetchone()[0]
+            next_id = max(next_id, max(touched_groups, default=0) + 1)
+
+            for family, members, similarity in new_groups:
+                # Closest old group, by shared members
+                old_id = max(old_groups, key=lambda group_id: len(old_groups[group_id] & members), default=None)
+                if old_id is not None and not old_groups[old_id] & members:
+                    old_id = None
+
+                if old_id is not None and old_groups[old_id] == members and old_id not in reused:
+                    group_id = old_id
+                    reused.add(old_id)
+                else:
+                    group_id = next_id
+                    next_id += 1
+                    if old_id is None:
+                        added.append(group_id)
+                    else:
+                        matched.add(old_id)
+                        changed.append((snapshot[old_id], group_id))
+
+                self._db.execute("INSERT INTO groups VALUES (?, ?, ?)", (group_id, family, similarity))
+                self._similarities[group_id] = similarity
+                for chunk_id in members:
+                    assignments[chunk_id] = group_id
+
+            for chunk_id, group_id in assignments.items():
+                self._chunks[chunk_id] = self._chunks[chunk_id]._replace(group_id=group_id)
+            self._db.executemany("UPDATE chunks SET group_id = ? WHERE id = ?",
+                                 [(group_id, chunk_id) for chunk_id, group_id in assignments.items()])
+
+        current = {group.id: group for group in self.groups()}
+        return IndexUpdate(
+            added=[current[group_id] for group_id in added],
+            changed=[(old, current[group_id]) for old, group_id in changed],
+            removed=[snapshot[group_id] for group_id in sorted(touched_groups - reused - matched)],
+        )
+
+    def _group(self, group_id, chunks):
+        family = self._family(chunks[0]) if chunks else None
+        return IndexedGroup(group_id, family, chunks, self._similarities.get(group_id))
+
+    def _transaction(self):
+        return _ExclusiveTransaction(self._db, self._db_lock)
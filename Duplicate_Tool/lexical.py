@@ -0,0 +1,216 @@
+import zlib
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from .chunker import KEYWORDS, tokenize
+from .grouping import build_groups
+from .profiling import count, stage
+
+# Placeholders that identifiers and literals are blinded to, so renamed
+# (Type-2) clones normalize to the same token stream as exact (Type-1) ones
+IDENTIFIER = b'ID'
+LITERALS = {'string': b'STR', 'char': b'STR', 'textblock': b'STR', 'number': b'NUM'}
+
+# Base of the polynomial hash over token k-grams (arithmetic wraps mod 2**64)
+_SHINGLE_BASE = np.uint64(0x100000001B3)
+
+_token_ids = {}
+
+def normalize_tokens(code):
+    """Return the code tokens of a chunk with identifiers and literals blinded.
+
+    Keywords, operators and separators are kept as they are; comments and
+    whitespace are dropped, as normalize_code drops formatting.
+    """
+    if isinstance(code, str):
+        code = code.encode('utf-8')
+    tokens = []
+    for token in tokenize(code):
+        if token.kind == 'name':
+            tokens.append(token.text if token.text in KEYWORDS else IDENTIFIER)
+        else:
+            tokens.append(LITERALS.get(token.kind, token.text))
+    return tokens
+
+def shingle_hashes(tokens, k=5):
+    """Unique 64-bit hashes of the token k-grams of a chunk.
+
+    A chunk shorter than k tokens is a single shingle.
+    """
+    ids = np.array([_token_id(token) for token in tokens] or [0], dtype=np.uint64)
+    k = min(k, len(ids))
+    powers = _SHINGLE_BASE ** np.arange(k - 1, -1, -1, dtype=np.uint64)
+    return np.unique(sliding_window_view(ids, k) @ powers)
+
+def _token_id(token):
+    token_id = _token_ids.get(token)
+    if token_id is None:
+        token_id = _token_ids[token] = zlib.crc32(token) + 1
+    return token_id
+
+def minhash_signatures(shingle_sets, num_perm=128, seed=0, perm_block=16):
+    """MinHash signature (num_perm uint32 values) of every shingle set.
+
+    Each permutation is a multiply-shift hash of the 64-bit shingle hashes.
+    Permutations are applied perm_block at a time to all shingles at once,
+    so memory stays at (total shingles x perm_block).
+    """
+    rng = np.random.default_rng(seed)
+    multipliers = rng.integers(0, 2 ** 63, num_perm, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+    offsets = rng.integers(0, 2 ** 63, num_perm, dtype=np.uint64)
+
+    sizes = np.array([len(shingles) for shingles in shingle_sets], dtype=np.int64)
+    signatures = np.empty((len(shingle_sets), num_perm), dtype=np.uint32)
+    if not len(sizes):
+        return signatures
+    shingles = np.concatenate(shingle_sets)[:, None]
+    starts = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+
+    for start in range(0, num_perm, perm_block):
+        stop = min(start + perm_block, num_perm)
+        hashed = (shingles * multipliers[start:stop] + offsets[start:stop]) >> np.uint64(32)
+        signatures[:, start:stop] = np.minimum.reduceat(hashed, starts, axis=0)
+    return signatures
+
+class MinHashLSH:
+    """LSH banding over MinHash signatures.
+
+    Signatures are cut into `bands` bands; two chunks become a candidate pair
+    when all rows of any band agree, and candidates are scored by the
+    fraction of signature values they share (an estimate of the Jaccard
+    similarity of their shingle sets).
+    """
+
+    def __init__(self, bands=32, max_bucket_size=256):
+        self.bands = bands
+        self.max_bucket_size = max_bucket_size
+        self.signatures = None
+
+    def fit(self, signatures):
+        if signatures.shape[1] % self.bands:
+            raise ValueError("the signature length must be a multiple of bands")
+        self.signatures = signatures
+        return self
+
+    def _bucket_members(self):
+        """Yield the ids of every band bucket with at least two members.
+
+        Buckets larger than max_bucket_size are split into consecutive pieces
+        of that size, like LSHIndex buckets.
+        """
+        rows = self.signatures.shape[1] // self.bands
+        powers = _SHINGLE_BASE ** np.arange(rows, dtype=np.uint64)
+        for band in range(self.bands):
+            keys = self.signatures[:, band * rows:(band + 1) * rows].astype(np.uint64) @ powers
+            order = np.argsort(keys, kind='stable')
+            sorted_keys = keys[order]
+            boundaries = np.flatnonzero(np.diff(sorted_keys)) + 1
+            starts = np.concatenate([[0], boundaries])
+            stops = np.concatenate([boundaries, [len(order)]])
+            for start, stop in zip(starts[stops - starts > 1].tolist(), stops[stops - starts > 1].tolist()):
+                for piece in range(start, stop, self.max_bucket_size):
+                    piece_stop = min(piece + self.max_bucket_size, stop)
+                    if piece_stop - piece > 1:
+                        yield order[piece:piece_stop]
+
+    def edges(self, threshold, pair_block=65536):
+        """Yield (i, j, estimated Jaccard) with i < j for candidate pairs above threshold"""
+        n = len(self.signatures)
+        found = []
+        for ids in self._bucket_members():
+            rows, cols = np.triu_indices(len(ids), k=1)
+            a, b = ids[rows], ids[cols]
+            found.append(np.minimum(a, b) * n + np.maximum(a, b))
+        if not found:
+            return
+        pair_ids = np.unique(np.concatenate(found))
+
+        for start in range(0, len(pair_ids), pair_block):
+            block = pair_ids[start:start + pair_block]
+            low, high = block // n, block % n
+            scores = (self.signatures[low] == self.signatures[high]).mean(axis=1)
+            keep = scores > threshold
+            for i, j, similarity in zip(low[keep].tolist(), high[keep].tolist(), scores[keep].tolist()):
+                yield i, j, similarity
+
+def lexical_clone_groups(chunks, clone_threshold=0.9, k=5, num_perm=128, bands=32, seed=0):
+    """Find Type-1 and Type-2 clones from the chunk text alone.
+
+    Chunks whose blinded token streams are identical form exact clone
+    classes. One representative per class is MinHashed, and classes whose
+    representatives share more than clone_threshold of their shingles (every
+    pair of them, see grouping.complete_linkage_groups) are merged. Returns
+    (groups, remaining): groups are (chunk indices, similarity) pairs whose
+    similarity is the mean estimated Jaccard similarity of their member
+    pairs, and remaining lists the indices of every chunk that is in no
+    group, for the embedding stage to look at.
+    """
+    with stage("lexical"):
+        classes = {}
+        for index, chunk in enumerate(chunks):
+            classes.setdefault(b' '.join(normalize_tokens(chunk)), []).append(index)
+        members = list(classes.values())
+
+        representatives = [normalize_tokens(chunks[group[0]]) for group in members]
+        signatures = minhash_signatures([shingle_hashes(tokens, k) for tokens in representatives], num_perm, seed)
+        edges = MinHashLSH(bands=bands).fit(signatures).edges(clone_threshold)
+        class_groups = build_groups(len(members), edges, clone_threshold)
+
+    grouped = set()
+    groups = []
+    for class_group in class_groups:
+        grouped.update(class_group)
+        groups.append(_expand(class_group, members, signatures))
+    for index, group in enumerate(members):
+        if index not in grouped and len(group) > 1:
+            groups.append((sorted(group), 1.0))
+
+    remaining = sorted(group[0] for index, group in enumerate(members) if index not in grouped and len(group) == 1)
+    count("chunks.lexical_clones", len(chunks) - len(remaining))
+    groups.sort(key=lambda item: item[0][0])
+    return groups, remaining
+
+def embedding_candidates(groups, remaining):
+    """Indices of the chunks to embed after lexical_clone_groups: every
+    unmatched chunk and the first member of each group, which stands in for
+    the rest of it so a clone group can still join a Type-3 one"""
+    return list(remaining) + [group[0] for group, _ in groups]
+
+def merge_clone_groups(groups, candidates, semantic_groups):
+    """Merge lexical groups into the groups found among the embedded candidates.
+
+    semantic_groups holds (positions in candidates, similarity) pairs. A
+    semantic group that contains a lexical group's representative takes in
+    all of that group's members and keeps its own similarity; lexical groups
+    no semantic group took in are returned as they are, first.
+    """
+    members = {group[0]: group for group, _ in groups}
+    merged = set()
+    semantic = []
+    for group, similarity in semantic_groups:
+        indices = []
+        for position in group:
+            index = candidates[position]
+            if index in members:
+                merged.add(index)
+                indices.extend(members[index])
+            else:
+                indices.append(index)
+        semantic.append((sorted(indices), similarity))
+    return [(group, similarity) for group, similarity in groups if group[0] not in merged] + semantic
+
+def _expand(class_group, members, signatures):
+    """Turn a group of clone classes into (chunk indices, mean pair similarity).
+
+    Pairs inside one class are identical after blinding (similarity 1);
+    pairs across classes take their representatives' estimated similarity.
+    """
+    sizes = np.array([len(members[index]) for index in class_group], dtype=np.float64)
+    group_signatures = signatures[class_group]
+    similarity = (group_signatures[:, None, :] == group_signatures[None, :, :]).mean(axis=2)
+    np.fill_diagonal(similarity, 1.0)
+    weights = np.outer(sizes, sizes)
+    np.fill_diagonal(weights, sizes * (sizes - 1))
+    total = sizes.sum()
+    average = float((similarity * weights).sum() / (total * (total - 1)))
+    return sorted(index for class_index in class_group for index in members[class_index]), average
@@ -0,0 +1,145 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# The profiler collecting events, if any. Module-wide rather than per thread
+# so the embedding thread of a directory scan is profiled too.
+_active = None
+
+class Profiler:
+    """Stage timers and counters for one run of the pipeline.
+
+    Stages nest, and a stage's time includes the stages inside it. Hooks
+    are called as hook(event, name, value) with event "stage" (value: the
+    seconds it took) or "count" (value: the increment). With trace=True,
+    every stage and counter update is kept for write_chrome_trace.
+    Only work done in this process is seen; files parsed in worker
+    processes show up in the stage that waits for them.
+    """
+
+    def __init__(self, trace=False):
+        self.trace = trace
+        self.stages = {}
+        self.counters = {}
+        self.hooks = []
+        self.events = []
+        self._lock = threading.Lock()
+        self._origin = time.perf_counter()
+
+    def add_hook(self, hook):
+        self.hooks.append(hook)
+        return hook
+
+    def stage(self, name):
+        return _Stage(self, name)
+
+    def count(self, name, value=1):
+        with self._lock:
+            total = self.counters[name] = self.counters.get(name, 0) + value
+            if self.trace:
+                self.events.append({'name': name, 'ph': 'C', 'ts': self._micros(time.perf_counter()),
+                                    'pid': os.getpid(), 'tid': threading.get_ident(), 'args': {name: total}})
+        for hook in self.hooks:
+            hook("count", name, value)
+
+    def _record(self, name, start, stop):
+        seconds = stop - start
+        with self._lock:
+            calls, total = self.stages.get(name, (0, 0.0))
+            self.stages[name] = (calls + 1, total + seconds)
+            if self.trace:
+                self.events.append({'name': name, 'ph': 'X', 'ts': self._micros(start), 'dur': seconds * 1e6,
+                                    'pid': os.getpid(), 'tid': threading.get_ident()})
+        for hook in self.hooks:
+            hook("stage", name, seconds)
+
+    def _micros(self, moment):
+        return (moment - self._origin) * 1e6
+
+    def report(self):
+        """The profile as a JSON-serializable dict"""
+        with self._lock:
+            return {
+                'wall_seconds': time.perf_counter() - self._origin,
+                'stages': {name: {'calls': calls, 'seconds': seconds}
+                           for name, (calls, seconds) in sorted(self.stages.items(), key=lambda item: -item[1][1])},
+                'counters': dict(sorted(self.counters.items())),
+            }
+
+    def write(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=2)
+
+    def write_chrome_trace(self, path):
+        """Write the trace events in Chrome's trace event format, for
+        chrome://tracing or Perfetto"""
+        if not self.trace:
+            raise ValueError("Profiler was created without trace=True")
+        with self._lock:
+            events = list(self.events)
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+    def summary(self):
+        """A plain-text table of stages and counters"""
+        report = self.report()
+        lines = [f"{'stage':<24}{'calls':>8}{'seconds':>12}"]
+        for name, stage in report['stages'].items():
+            lines.append(f"{name:<24}{stage['calls']:>8}{stage['seconds']:>12.3f}")
+        lines.append("")
+        for name, value in report['counters'].items():
+            lines.append(f"{name:<32}{value:>12}")
+        return '\n'.join(lines)
+
+class _Stage:
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler._record(self.name, self.start, time.perf_counter())
+
+class _NullStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+_NULL_STAGE = _NullStage()
+
+@contextmanager
+def profile(profiler=None, trace=False):
+    """Profile everything run inside the with block, yielding the Profiler.
+
+        with profile(trace=True) as profiler:
+            scan_directory("src")
+        profiler.write_chrome_trace("trace.json")
+    """
+    global _active
+    profiler = profiler if profiler is not None else Profiler(trace=trace)
+    previous = _active
+    _active = profiler
+    try:
+        yield profiler
+    finally:
+        _active = previous
+
+def stage(name):
+    """Time a block as stage name under the active profiler (free when none is active)"""
+    return _NULL_STAGE if _active is None else _active.stage(name)
+
+def count(name, value=1):
+    """Add value to counter name under the active profiler"""
+    if _active is not None:
+        _active.count(name, value)
+
+def active():
+    """The active Profiler, or None"""
+    return _active
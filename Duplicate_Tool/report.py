@@ -0,0 +1,205 @@
+import gzip
+import json
+import os
+import sys
+from pathlib import Path
+from .chunker import METHOD_KINDS, Chunk, ChunkRef
+from .preprocessing import content_hash
+
+SARIF_SCHEMA = "https://json.schemastore.org/sarif-2.1.0.json"
+TOOL_VERSION = "0.2"
+
+SARIF_RULES = [
+    {
+        "id": "duplicate-method",
+        "name": "DuplicateMethod",
+        "shortDescription": {"text": "Duplicate method"},
+        "fullDescription": {"text": "Methods, constructors or lambdas whose CodeT5 embeddings are nearly identical."},
+        "defaultConfiguration": {"level": "warning"},
+    },
+    {
+        "id": "duplicate-block",
+        "name": "DuplicateBlock",
+        "shortDescription": {"text": "Duplicate code block"},
+        "fullDescription": {"text": "Statement blocks whose CodeT5 embeddings are nearly identical."},
+        "defaultConfiguration": {"level": "note"},
+    },
+]
+
+class ReportWriter:
+    """Base of the streaming report writers.
+
+    write() formats one (chunks, avg_similarity) group and writes it out at
+    once, so only the group being written is ever held. Chunks are
+    referenced by path, line range and the content hash of their extracted,
+    whitespace-normalized code (preprocessing.content_hash, the hash the
+    DuplicateIndex stores) rather than inlined; include_code=True adds the
+    code too. Kinds come from the Chunk and ChunkRef records, and plain code
+    strings (as returned by detect_duplicate_groups) are reported without a
+    path or kind.
+
+    path '-' writes to stdout. The output is gzip-compressed when compress
+    is true or, by default, when path ends in .gz. Paths under root are
+    written relative to it.
+    """
+
+    def __init__(self, path, root=None, compress=None, include_code=False):
+        self.root = os.path.abspath(root) if root else None
+        self.include_code = include_code
+        self.groups = 0
+        if compress is None:
+            compress = path.endswith(".gz")
+        if path == "-":
+            self._file = gzip.open(sys.stdout.buffer, "wt", encoding="utf-8") if compress else sys.stdout
+        else:
+            self._file = gzip.open(path, "wt", encoding="utf-8") if compress else open(path, "w", encoding="utf-8")
+        self._begin()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def write(self, group, similarity):
+        self.groups += 1
+        self._write_group([self._chunk(chunk) for chunk in group], round(float(similarity), 4))
+
+    def write_all(self, duplicate_groups):
+        """Write every group of an iterable as it is produced; returns how many"""
+        for group, similarity in duplicate_groups:
+            self.write(group, similarity)
+        return self.groups
+
+    def close(self):
+        if self._file is None:
+            return
+        self._end()
+        if self._file is sys.stdout:
+            self._file.flush()
+        else:
+            self._file.close()
+        self._file = None
+
+    def _begin(self):
+        pass
+
+    def _end(self):
+        pass
+
+    def _write_group(self, chunks, similarity):
+        raise NotImplementedError
+
+    def _chunk(self, chunk):
+        if not isinstance(chunk, (Chunk, ChunkRef)):
+            record = {"path": None, "kind": None, "start_line": None, "end_line": None, "hash": content_hash(chunk)}
+            if self.include_code:
+                record["code"] = chunk
+            return record
+        # Both records hash the code as extracted (comments blanked and, with
+        # formatting, formatted), never the raw text on disk
+        digest = chunk.hash if isinstance(chunk, ChunkRef) else content_hash(chunk.code)
+        record = {"path": self._relative(chunk.path), "kind": chunk.kind, "start_line": chunk.start_line,
+                  "end_line": chunk.end_line, "hash": digest}
+        if self.include_code:
+            if isinstance(chunk, ChunkRef):
+                from .streaming import read_chunk_code
+                record["code"] = read_chunk_code(chunk)
+            else:
+                record["code"] = chunk.code
+        return record
+
+    def _relative(self, path):
+        if path is None:
+            return None
+        path = os.path.abspath(path)
+        if self.root and os.path.commonpath([self.root, path]) == self.root:
+            path = os.path.relpath(path, self.root)
+        return path.replace(os.sep, "/")
+
+class JsonLinesWriter(ReportWriter):
+    """One JSON object per duplicate group and line:
+
+      {"group": 1, "family": "method", "similarity": 0.953,
+       "chunks": [{"path", "kind", "start_line", "end_line", "hash"}, ...]}
+
+    family is "method" or "block", or null when the chunks are plain strings.
+    """
+
+    def _write_group(self, chunks, similarity):
+        record = {"group": self.groups, "family": _family(chunks), "similarity": similarity, "chunks": chunks}
+        self._file.write(json.dumps(record) + "\n")
+
+class SarifWriter(ReportWriter):
+    """A SARIF 2.1.0 log with one result per duplicate group.
+
+    The first chunk of a group is the result's location and the others are
+    its relatedLocations; each location's properties carry the chunk kind
+    and content hash. The log is written as it goes: the run header first,
+    each result as its group arrives, and the closing brackets on close().
+    """
+
+    def _begin(self):
+        run = {
+            "tool": {"driver": {"name": "duplicate-tool", "version": TOOL_VERSION, "rules": SARIF_RULES}},
+            "columnKind": "utf16CodeUnits",
+        }
+        if self.root:
+            run["originalUriBaseIds"] = {"SRCROOT": {"uri": Path(self.root).as_uri() + "/"}}
+        header = json.dumps({"$schema": SARIF_SCHEMA, "version": "2.1.0", "runs": [run]})
+        # Leave the run open for the results
+        self._file.write(header[:-3] + ', "results": [\n')
+
+    def _end(self):
+        self._file.write("\n]}]}\n")
+
+    def _write_group(self, chunks, similarity):
+        family = _family(chunks) or "method"
+        label = "Method" if family == "method" else "Code block"
+        located = [chunk for chunk in chunks if chunk["path"] is not None]
+        result = {
+            "ruleId": f"duplicate-{family}",
+            "ruleIndex": 0 if family == "method" else 1,
+            "message": {"text": f"{label} found in {len(chunks)} places (avg similarity {similarity:.3f})"},
+            "partialFingerprints": {"contentHash/v1": chunks[0]["hash"]},
+            "properties": {"group": self.groups, "similarity": similarity},
+        }
+        if located:
+            result["locations"] = [self._location(located[0])]
+            result["relatedLocations"] = [dict(self._location(chunk), id=index)
+                                          for index, chunk in enumerate(located[1:], 1)]
+        if len(located) < len(chunks):
+            result["properties"]["hashes"] = [chunk["hash"] for chunk in chunks]
+        self._file.write((",\n" if self.groups > 1 else "") + json.dumps(result))
+
+    def _location(self, chunk):
+        artifact = {"uri": chunk["path"]}
+        if self.root and not os.path.isabs(chunk["path"]):
+            artifact["uriBaseId"] = "SRCROOT"
+        else:
+            artifact["uri"] = Path(chunk["path"]).as_uri()
+        location = {
+            "physicalLocation": {
+                "artifactLocation": artifact,
+                "region": {"startLine": chunk["start_line"], "endLine": chunk["end_line"]},
+            },
+            "properties": {"kind": chunk["kind"], "contentHash": chunk["hash"]},
+        }
+        if self.include_code:
+            location["physicalLocation"]["region"]["snippet"] = {"text": chunk["code"]}
+        return location
+
+WRITERS = {"jsonl": JsonLinesWriter, "sarif": SarifWriter}
+
+def write_report(duplicate_groups, path, format="jsonl", **options):
+    """Stream (chunks, avg_similarity) groups to a JSON Lines or SARIF
+    report at path, returning the number of groups written. Options are
+    passed to the writer (root, compress, include_code)."""
+    with WRITERS[format](path, **options) as writer:
+        return writer.write_all(duplicate_groups)
+
+def _family(chunks):
+    kind = chunks[0]["kind"] if chunks else None
+    if kind is None:
+        return None
+    return "method" if kind in METHOD_KINDS else "block"
@@ -0,0 +1,52 @@
+import com.google.googlejavaformat.java.Formatter;
+import java.io.BufferedInputStream;
+import java.io.BufferedOutputStream;
+import java.io.DataInputStream;
+import java.io.DataOutputStream;
+import java.io.EOFException;
+import java.io.IOException;
+import java.nio.charset.StandardCharsets;
+
+/**
+ * Long-lived google-java-format worker.
+ *
+ * <p>Reads requests from stdin as a 4-byte big-endian length followed by that many bytes of UTF-8
+ * Java source, and answers each on stdout with a status byte (0 = formatted, 1 = error), a 4-byte
+ * length and the UTF-8 formatted source or error message. Exits when stdin is closed.
+ *
+ * <p>Only whitespace and comments are changed; imports are left alone so callers can map lines of
+ * the formatted source back to the original.
+ */
+public final class FormatterWorker {
+  public static void main(String[] args) throws IOException {
+    DataInputStream in = new DataInputStream(new BufferedInputStream(System.in));
+    DataOutputStream out = new DataOutputStream(new BufferedOutputStream(System.out));
+    Formatter formatter = new Formatter();
+
+    while (true) {
+      int length;
+      try {
+        length = in.readInt();
+      } catch (EOFException e) {
+        break;
+      }
+      byte[] source = new byte[length];
+      in.readFully(source);
+
+      byte status = 0;
+      byte[] result;
+      try {
+        result = formatter.formatSource(new String(source, StandardCharsets.UTF_8))
+            .getBytes(StandardCharsets.UTF_8);
+      } catch (Exception e) {
+        status = 1;
+        result = String.valueOf(e.getMessage()).getBytes(StandardCharsets.UTF_8);
+      }
+
+      out.writeByte(status);
+      out.writeInt(result.length);
+      out.write(result);
+      out.flush();
+    }
+  }
+}
@@ -0,0 +1,217 @@
+import os
+import queue
+import re
+import threading
+from bisect import bisect_right
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import numpy as np
+from .chunker import METHOD_KINDS, blank_comment_bytes
+from .detection import group_embeddings
+from .embedding import get_embeddings
+from .lexical import embedding_candidates, lexical_clone_groups, merge_clone_groups
+from .preprocessing import extract_chunks, format_java_code, normalize_whitespace
+from .profiling import count, stage
+from .workers import EmbeddingPool
+
+WHITESPACE_BYTES = np.frombuffer(b' \t\n\r\f\v', dtype=np.uint8)
+
+def iter_java_files(root):
+    """Yield the .java files under root in a stable order, skipping hidden directories"""
+    for directory, subdirs, files in os.walk(root):
+        subdirs[:] = sorted(subdir for subdir in subdirs if not subdir.startswith('.'))
+        for name in sorted(files):
+            if name.endswith('.java'):
+                yield os.path.join(directory, name)
+
+def code_positions(source):
+    """Byte offsets of the non-whitespace characters of source outside comments"""
+    blanked = np.frombuffer(blank_comment_bytes(source), dtype=np.uint8)
+    return np.flatnonzero(~np.isin(blanked, WHITESPACE_BYTES))
+
+def original_offsets(original, formatted):
+    """Map byte offsets in formatted back to offsets in original.
+
+    google-java-format only changes whitespace and comments, so outside of
+    comments both texts share the same stream of non-whitespace characters.
+    Returns a function mapping a (start, end) span of formatted that begins
+    and ends on code to the matching span of original, or None if the
+    streams differ and no mapping exists.
+    """
+    original_positions = code_positions(original)
+    formatted_positions = code_positions(formatted)
+    if (len(original_positions) != len(formatted_positions)
+            or not np.array_equal(np.frombuffer(original, np.uint8)[original_positions],
+                                  np.frombuffer(formatted, np.uint8)[formatted_positions])):
+        return None
+
+    def to_original(start, end):
+        first = np.searchsorted(formatted_positions, start)
+        last = np.searchsorted(formatted_positions, end) - 1
+        return int(original_positions[first]), int(original_positions[last]) + 1
+    return to_original
+
+def extract_file_chunks(path, use_formatting=True, detect_intra_method=True, min_length=50):
+    """Read, format and chunk one file.
+
+    Chunk code comes from the formatted source, but line numbers and byte
+    offsets always refer to the file on disk.
+    """
+    with open(path, 'r', encoding='utf-8', errors='replace') as f:
+        source = f.read()
+    formatted = format_java_code(source) if use_formatting else None
+    return chunk_file_source(path, source, formatted, detect_intra_method=detect_intra_method, min_length=min_length)
+
+def chunk_file_source(path, source, formatted=None, detect_intra_method=True, min_length=50):
+    """Chunk a file's source, given its formatted version if there is one
+    (see extract_file_chunks)"""
+    code = source
+    to_original = None
+    if formatted is not None and formatted != source:
+        to_original = original_offsets(source.encode('utf-8'), formatted.encode('utf-8'))
+        # Without an offset mapping, fall back to the unformatted source
+        if to_original is not None:
+            code = formatted
+    line_starts = [0] + [match.end() for match in re.finditer(rb'\n', source.encode('utf-8'))]
+
+    chunks = []
+    for chunk in extract_chunks(code, path=path):
+        if chunk.kind == 'block' and not detect_intra_method:
+            continue
+        # Same length cut-off as handle_overlapping_chunks
+        if len(normalize_whitespace(chunk.code)) <= min_length:
+            continue
+        if to_original is not None:
+            start, end = to_original(chunk.start_offset, chunk.end_offset)
+            chunk = chunk._replace(
+                start_line=bisect_right(line_starts, start),
+                end_line=bisect_right(line_starts, end - 1),
+                start_offset=start,
+                end_offset=end,
+            )
+        chunks.append(chunk)
+    return chunks
+
+def scan_directory(root, threshold=0.90, use_formatting=True, detect_intra_method=True,
+                   workers=None, batch_size=32, queue_size=8, search="exact", neighbours=10, cache=None,
+                   grouping="clique", backend="torch", prefilter=False, embed_workers=None, embed_threads=None,
+                   windowed=False):
+    """Find duplicate methods and statement blocks across all .java files under root.
+
+    Files are read, formatted and chunked in a pool of `workers` processes
+    (in-process when workers=1). Their chunks stream through a bounded queue
+    to an embedding thread, so the model runs while other files are still
+    being parsed. Returns (chunks, avg_similarity) pairs whose chunks are
+    Chunk records carrying the file path and line range.
+
+    With prefilter=True, exact and renamed clones are grouped lexically
+    (see lexical.lexical_clone_groups) and only the remaining chunks, plus
+    one representative per clone group, are embedded. The prefilter has to
+    see every chunk first, so embedding then starts after parsing instead of
+    overlapping with it.
+
+    With embed_workers > 1 the encoder itself runs in that many processes
+    (see workers.EmbeddingPool), each with embed_threads torch threads.
+    windowed=True embeds chunks longer than the encoder's input in
+    overlapping windows instead of truncating them (see
+    embedding.get_embeddings).
+    """
+    chunks = []
+    embedded = []
+    errors = []
+    batches = queue.Queue(maxsize=queue_size)
+    pool = None
+    stream_size = batch_size
+    if embed_workers is not None and embed_workers > 1:
+        pool = EmbeddingPool(embed_workers, threads=embed_threads, backend=backend, batch_size=batch_size)
+        # Hand the pool enough chunks at a time to keep every worker busy
+        stream_size = batch_size * embed_workers
+
+    def embed_batches():
+        while True:
+            batch = batches.get()
+            if batch is None:
+                return
+            if errors:
+                continue
+            try:
+                embedded.append(get_embeddings([chunk.code for chunk in batch], batch_size=batch_size, cache=cache,
+                                               backend=backend, pool=pool, windowed=windowed))
+            except Exception as e:
+                errors.append(e)
+
+    try:
+        embedder = None
+        if not prefilter:
+            embedder = threading.Thread(target=embed_batches, daemon=True)
+            embedder.start()
+        else:
+            batches = None
+
+        extract = partial(extract_file_chunks, use_formatting=use_formatting, detect_intra_method=detect_intra_method)
+        try:
+            with stage("parse"):
+                if workers == 1:
+                    _stream_chunks(map(extract, iter_java_files(root)), chunks, batches, stream_size)
+                else:
+                    with ProcessPoolExecutor(max_workers=workers) as parsers:
+                        results = parsers.map(extract, iter_java_files(root), chunksize=4)
+                        _stream_chunks(results, chunks, batches, stream_size)
+        finally:
+            if embedder is not None:
+                batches.put(None)
+                embedder.join()
+
+        if errors:
+            raise errors[0]
+        if not chunks:
+            return []
+        embeddings = np.vstack(embedded) if embedded else None
+
+        # Methods (with constructors and lambdas) and blocks are grouped
+        # separately, blocks with a higher threshold
+        duplicate_groups = []
+        for is_method, kind_threshold in ((True, threshold), (False, threshold + 0.05)):
+            indices = [index for index, chunk in enumerate(chunks) if (chunk.kind in METHOD_KINDS) == is_method]
+            if len(indices) < 2:
+                continue
+            family = [chunks[index] for index in indices]
+            if prefilter:
+                lexical_groups, remaining = lexical_clone_groups([chunk.code for chunk in family])
+                candidates = embedding_candidates(lexical_groups, remaining)
+                groups = []
+                if len(candidates) >= 2:
+                    family_embeddings = get_embeddings([family[index].code for index in candidates], batch_size=batch_size,
+                                                       cache=cache, backend=backend, pool=pool, windowed=windowed)
+                    groups = group_embeddings(family_embeddings, kind_threshold, search=search, neighbours=neighbours,
+                                              grouping=grouping)
+                groups = merge_clone_groups(lexical_groups, candidates, groups)
+            else:
+                groups = group_embeddings(embeddings[indices], kind_threshold, search=search, neighbours=neighbours,
+                                          grouping=grouping)
+            for group, avg_similarity in groups:
+                duplicate_groups.append(([family[index] for index in group], avg_similarity))
+
+        return duplicate_groups
+    finally:
+        if pool is not None:
+            pool.close()
+
+def _stream_chunks(results, chunks, batches, batch_size):
+    """Collect per-file chunk lists and hand them to the embedding queue in
+    batches (just collect them when batches is None)"""
+    pending = []
+    for file_chunks in results:
+        chunks.extend(file_chunks)
+        count("files")
+        count("chunks.extracted", len(file_chunks))
+        if batches is None:
+            continue
+        pending.extend(file_chunks)
+        if len(pending) >= batch_size * 4:
+            # Blocks while the embedding thread is behind
+            batches.put(pending)
+            pending = []
+    if pending:
+        batches.put(pending)
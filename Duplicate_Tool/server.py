@@ -0,0 +1,259 @@
+import argparse
+import asyncio
+import http.client
+import json
+import os
+import socket
+from .aio import EmbeddingBatcher
+from .chunker import DECLARATION_KINDS, METHOD_KINDS
+from .detection import extract_code_chunks, group_embeddings
+from .preprocessing import format_java_code, handle_overlapping_chunks
+
+DEFAULT_PORT = 8765
+
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 500: "Internal Server Error"}
+
+class DetectionServer:
+    """Long-running detection service over localhost HTTP or a Unix socket.
+
+    Keeps the encoder, the formatter JVM, the embedding cache and an
+    optional DuplicateIndex of a repository warm between requests. Every
+    endpoint takes and returns JSON:
+
+      GET  /health   status and index size
+      POST /detect   {"code", "threshold"?, "use_formatting"?, "detect_intra_method"?}
+                     duplicate groups inside one source
+      POST /query    {"code" or "path", "k"?, "threshold"?}
+                     the indexed chunks most similar to a snippet, or to
+                     each chunk of a .java file
+      POST /refresh  update the index for files changed on disk
+    """
+
+    def __init__(self, index=None, threshold=0.90, use_formatting=True, cache=None, backend="torch",
+                 batch_size=32, window=0.005, max_batch=256):
+        self.index = index
+        self.threshold = threshold
+        self.use_formatting = use_formatting
+        self.batcher = EmbeddingBatcher(window=window, max_batch=max_batch, batch_size=batch_size,
+                                        cache=cache, backend=backend)
+
+    def warm(self):
+        self.batcher.warm()
+        if self.use_formatting:
+            format_java_code("class Warm { }")
+
+    async def handle(self, method, path, body):
+        """Answer one request, returning (HTTP status, JSON-serializable body)"""
+        try:
+            payload = json.loads(body) if body else {}
+        except ValueError:
+            return 400, {"error": "request body is not valid JSON"}
+
+        try:
+            if method == "GET" and path == "/health":
+                return 200, {"status": "ok", "indexed_chunks": len(self.index) if self.index is not None else None}
+            if method == "POST" and path == "/detect":
+                if "code" not in payload:
+                    return 400, {"error": "missing 'code'"}
+                return 200, await self.detect(payload["code"], payload.get("threshold", self.threshold),
+                                              payload.get("use_formatting", self.use_formatting),
+                                              payload.get("detect_intra_method", True))
+            if method == "POST" and path == "/query":
+                if self.index is None:
+                    return 400, {"error": "the server was started without an index"}
+                if "path" in payload:
+                    return 200, await self.query_file(payload["path"], payload.get("k", 10), payload.get("threshold"))
+                if "code" not in payload:
+                    return 400, {"error": "missing 'code' or 'path'"}
+                return 200, await self.query(payload["code"], payload.get("k", 10), payload.get("threshold"))
+            if method == "POST" and path == "/refresh":
+                if self.index is None:
+                    return 400, {"error": "the server was started without an index"}
+                return 200, await self.refresh()
+        except Exception as e:
+            print(f"Error handling {method} {path}: {e}")
+            return 500, {"error": str(e)}
+        return 404, {"error": f"no endpoint {method} {path}"}
+
+    async def detect(self, code, threshold, use_formatting, detect_intra_method):
+        loop = asyncio.get_running_loop()
+        records = await loop.run_in_executor(None, lambda: extract_code_chunks(code, use_formatting=use_formatting))
+        if not detect_intra_method:
+            # Whole declarations only, as in detect_duplicate_groups_enhanced
+            records = [record for record in records if record.kind in DECLARATION_KINDS]
+        first = {}
+        for record in records:
+            first.setdefault(record.code, record)
+        chunks = handle_overlapping_chunks([record.code for record in records])
+        if len(chunks) < 2:
+            return {"groups": []}
+        embeddings = await self.batcher.embed(chunks)
+
+        groups = []
+        for is_method, kind_threshold in ((True, threshold), (False, threshold + 0.05)):
+            indices = [index for index, chunk in enumerate(chunks) if (first[chunk].kind in METHOD_KINDS) == is_method]
+            if len(indices) < 2:
+                continue
+            for group, similarity in group_embeddings(embeddings[indices], kind_threshold):
+                groups.append({
+                    "similarity": similarity,
+                    "chunks": [_chunk_json(first[chunks[indices[index]]]) for index in group],
+                })
+        return {"groups": groups}
+
+    async def query(self, code, k, threshold):
+        loop = asyncio.get_running_loop()
+        embedding = await self.batcher.embed([code])
+        matches = await loop.run_in_executor(None, lambda: self.index.similar(embedding, k=k, threshold=threshold)[0])
+        return {"matches": [dict(chunk._asdict(), similarity=similarity) for chunk, similarity in matches]}
+
+    async def query_file(self, path, k, threshold):
+        results = await asyncio.get_running_loop().run_in_executor(
+            None, lambda: self.index.query_file(path, k=k, threshold=threshold))
+        return {"chunks": [
+            dict(_chunk_json(chunk), matches=[dict(match._asdict(), similarity=similarity) for match, similarity in matches])
+            for chunk, matches in results
+        ]}
+
+    async def refresh(self):
+        update = await asyncio.get_running_loop().run_in_executor(None, self.index.refresh)
+        return {
+            "added": [_group_json(group) for group in update.added],
+            "changed": [{"old": _group_json(old), "new": _group_json(new)} for old, new in update.changed],
+            "removed": [_group_json(group) for group in update.removed],
+        }
+
+    async def serve(self, host="127.0.0.1", port=DEFAULT_PORT, unix_socket=None):
+        """Serve until cancelled"""
+        if unix_socket:
+            if os.path.exists(unix_socket):
+                os.remove(unix_socket)
+            server = await asyncio.start_unix_server(self._connection, path=unix_socket)
+            print(f"Listening on {unix_socket}")
+        else:
+            server = await asyncio.start_server(self._connection, host, port)
+            print(f"Listening on http://{host}:{port}")
+        async with server:
+            await server.serve_forever()
+
+    async def _connection(self, reader, writer):
+        """A minimal HTTP/1.1 loop: JSON bodies with Content-Length, keep-alive"""
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                method, target, version = request_line.decode("latin-1").split()
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+
+                status, response = await self.handle(method, target.split("?")[0], body)
+                data = json.dumps(response).encode("utf-8")
+                keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+                writer.write(
+                    f"HTTP/1.1 {status} {REASONS[status]}\r\n"
+                    "Content-Type: application/json\r\n"
+                    f"Content-Length: {len(data)}\r\n"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode("latin-1") + data
+                )
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+def _chunk_json(chunk):
+    return {"kind": chunk.kind, "start_line": chunk.start_line, "end_line": chunk.end_line, "code": chunk.code}
+
+def _group_json(group):
+    return {"id": group.id, "family": group.family, "similarity": group.similarity,
+            "chunks": [chunk._asdict() for chunk in group.chunks]}
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path, timeout):
+        super().__init__("localhost", timeout=timeout)
+        self.unix_socket = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.unix_socket)
+
+def request(path, payload=None, host="127.0.0.1", port=DEFAULT_PORT, unix_socket=None, timeout=60):
+    """Call a running DetectionServer, returning its decoded JSON response.
+
+    POSTs payload when given, otherwise GETs. Raises RuntimeError with the
+    server's message on an error status.
+    """
+    if unix_socket:
+        connection = _UnixHTTPConnection(unix_socket, timeout)
+    else:
+        connection = http.client.HTTPConnection(host, port, timeout=timeout)
+    try:
+        if payload is None:
+            connection.request("GET", path)
+        else:
+            connection.request("POST", path, body=json.dumps(payload), headers={"Content-Type": "application/json"})
+        response = connection.getresponse()
+        body = json.loads(response.read() or b"{}")
+    finally:
+        connection.close()
+    if response.status != 200:
+        raise RuntimeError(f"{path} failed with {response.status}: {body.get('error')}")
+    return body
+
+def main(argv=None):
+    """Entry point of duplicate-tool-server"""
+    parser = argparse.ArgumentParser(
+        prog="duplicate-tool-server",
+        description="Serve duplicate detection with a warm model over localhost HTTP or a Unix socket.",
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--unix-socket", help="Listen on this Unix socket instead of TCP")
+    parser.add_argument("--root", help="Repository to index for /query and /refresh")
+    parser.add_argument("--index", help="Directory of the persisted duplicate index of --root")
+    parser.add_argument("--threshold", type=float, default=0.90, help="Similarity threshold (default: 0.90)")
+    parser.add_argument("--no-format", action="store_true", help="Skip Google Java Format normalization")
+    parser.add_argument("--cache", help="Directory of a persistent embedding cache")
+    parser.add_argument("--backend", choices=["torch", "quantized", "onnx"], default="torch",
+                        help="CPU inference backend for the encoder (default: torch)")
+    parser.add_argument("--batch-size", type=int, default=32, help="Chunks per encoder forward pass")
+    parser.add_argument("--window-ms", type=float, default=5.0,
+                        help="How long to wait for concurrent requests to share a batch (default: 5)")
+    parser.add_argument("--max-batch", type=int, default=256, help="Most chunks embedded in one shared batch")
+    args = parser.parse_args(argv)
+    if bool(args.root) != bool(args.index):
+        parser.error("--root and --index go together")
+
+    from .embedding import open_cache
+    cache = open_cache(args.cache, backend=args.backend) if args.cache else None
+
+    index = None
+    if args.index:
+        from .index import DuplicateIndex
+        index = DuplicateIndex(args.index, args.root, threshold=args.threshold, use_formatting=not args.no_format,
+                               backend=args.backend, cache=cache, batch_size=args.batch_size)
+        update = index.refresh()
+        print(f"Indexed {len(index)} chunks ({len(update.added)} groups added, {len(update.changed)} changed, "
+              f"{len(update.removed)} removed)")
+
+    server = DetectionServer(index=index, threshold=args.threshold, use_formatting=not args.no_format, cache=cache,
+                             backend=args.backend, batch_size=args.batch_size, window=args.window_ms / 1000,
+                             max_batch=args.max_batch)
+    server.warm()
+    try:
+        asyncio.run(server.serve(args.host, args.port, args.unix_socket))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
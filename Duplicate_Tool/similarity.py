@@ -0,0 +1,43 @@
+import numpy as np
+from .profiling import count, stage
+
+def normalize_embeddings(embeddings):
+    """L2-normalize embedding rows as a contiguous float32 matrix"""
+    embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    # Leave all-zero rows as zeros instead of dividing by zero
+    norms[norms == 0] = 1.0
+    return embeddings / norms
+
+def similarity_edges(embeddings, threshold, block_size=1024, normalized=False):
+    """Yield (i, j, similarity) for every pair i < j with similarity > threshold.
+
+    Pairs are computed tile by tile over the upper triangle, so each pair is
+    scored once and peak memory is bounded by block_size x block_size floats
+    regardless of how many chunks there are. embeddings may be a float16 or
+    memory-mapped matrix; each tile is scored in float32.
+    """
+    normed = embeddings if normalized else normalize_embeddings(embeddings)
+    n = len(normed)
+
+    for row_start in range(0, n, block_size):
+        row_stop = min(row_start + block_size, n)
+        rows = np.asarray(normed[row_start:row_stop], dtype=np.float32)
+
+        for col_start in range(row_start, n, block_size):
+            col_stop = min(col_start + block_size, n)
+            with stage("similarity"):
+                tile = rows @ np.asarray(normed[col_start:col_stop], dtype=np.float32).T
+                tile_rows, tile_cols = np.nonzero(tile > threshold)
+
+                if col_start == row_start:
+                    # Diagonal tile: keep only the strict upper triangle
+                    upper = tile_cols > tile_rows
+                    tile_rows, tile_cols = tile_rows[upper], tile_cols[upper]
+                    count("pairs.compared", len(rows) * (len(rows) - 1) // 2)
+                else:
+                    count("pairs.compared", len(rows) * (col_stop - col_start))
+                count("edges", len(tile_rows))
+
+            for i, j in zip(tile_rows.tolist(), tile_cols.tolist()):
+                yield row_start + i, col_start + j, float(tile[i, j])
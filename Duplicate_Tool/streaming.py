@@ -0,0 +1,172 @@
+import math
+import os
+import tempfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import numpy as np
+from .chunker import METHOD_KINDS, ChunkRef
+from .detection import group_embeddings
+from .embedding import get_embeddings
+from .preprocessing import content_hash
+from .profiling import count
+from .scanner import extract_file_chunks, iter_java_files
+from .similarity import normalize_embeddings
+
+DEFAULT_MEMORY_BUDGET = 256 * 2 ** 20
+
+class EmbeddingStore:
+    """Append-only matrix of L2-normalized embeddings in a memory-mapped file.
+
+    Rows are stored as float32, or float16 to halve the file; either way
+    they are read back one tile at a time, so only the pages in use stay
+    resident.
+    """
+
+    def __init__(self, path, dim, dtype="float32"):
+        self.path = path
+        self.dim = dim
+        self.dtype = np.dtype(dtype)
+        self.rows = 0
+        self._matrix = None
+        open(path, "wb").close()
+
+    def __len__(self):
+        return self.rows
+
+    def append(self, embeddings):
+        """Normalize and store embeddings, returning the id of their first row"""
+        first = self.rows
+        if len(embeddings):
+            self._reserve(first + len(embeddings))
+            self._matrix[first:first + len(embeddings)] = normalize_embeddings(embeddings)
+            self.rows += len(embeddings)
+        return first
+
+    def matrix(self):
+        """The stored rows, as a read-only memory map"""
+        if self._matrix is not None:
+            self._matrix.flush()
+        if not self.rows:
+            return np.zeros((0, self.dim), dtype=self.dtype)
+        return np.memmap(self.path, dtype=self.dtype, mode="r", shape=(self.rows, self.dim))
+
+    def close(self):
+        self._matrix = None
+
+    def _reserve(self, rows):
+        capacity = 0 if self._matrix is None else len(self._matrix)
+        if rows <= capacity:
+            return
+        capacity = max(rows, 2 * capacity, 1024)
+        self._matrix = None
+        with open(self.path, "r+b") as handle:
+            handle.truncate(capacity * self.dim * self.dtype.itemsize)
+        self._matrix = np.memmap(self.path, dtype=self.dtype, mode="r+", shape=(capacity, self.dim))
+
+def tile_size(memory_budget, dim):
+    """Rows per similarity tile so that one tile's working set fits in memory_budget bytes.
+
+    A tile needs a row block and a column block of float32 vectors plus the
+    block x block float32 scores and their boolean mask.
+    """
+    # Solve 5 b^2 + 8 dim b <= budget for b
+    size = int((-8 * dim + math.sqrt(64 * dim * dim + 20 * memory_budget)) / 10)
+    return max(size, 16)
+
+def read_chunk_code(ref):
+    """Read a chunk's code back from its file"""
+    with open(ref.path, 'rb') as f:
+        f.seek(ref.start_offset)
+        return f.read(ref.end_offset - ref.start_offset).decode('utf-8', errors='replace')
+
+def stream_duplicate_groups(root, threshold=0.90, use_formatting=True, detect_intra_method=True,
+                            workers=None, batch_size=32, memory_budget=DEFAULT_MEMORY_BUDGET, dtype="float32",
+                            store_dir=None, cache=None, grouping="clique", backend="torch", windowed=False):
+    """Find duplicates under root like scanner.scan_directory, in bounded memory.
+
+    Chunk code is only held until its batch is embedded. Embeddings go to
+    an on-disk EmbeddingStore per family (float32, or float16 with
+    dtype="float16") under store_dir, a temporary directory by default, and
+    chunks are kept as ChunkRef records pointing at their file offsets.
+    Similarities are scored in tiles sized to memory_budget bytes and only
+    above-threshold edges are kept. Files are parsed a bounded window at a
+    time, so a slow model never lets parsed chunks pile up.
+
+    Returns (chunk refs, avg_similarity) pairs; read_chunk_code gives back
+    the code of a ref. iter_duplicate_groups yields the same pairs as each
+    family is grouped.
+    """
+    return list(iter_duplicate_groups(root, threshold, use_formatting, detect_intra_method, workers, batch_size,
+                                      memory_budget, dtype, store_dir, cache, grouping, backend, windowed))
+
+def iter_duplicate_groups(root, threshold=0.90, use_formatting=True, detect_intra_method=True,
+                          workers=None, batch_size=32, memory_budget=DEFAULT_MEMORY_BUDGET, dtype="float32",
+                          store_dir=None, cache=None, grouping="clique", backend="torch", windowed=False):
+    """Generator form of stream_duplicate_groups: method groups are yielded
+    once all methods are grouped, then block groups, and no group is kept
+    after it is yielded."""
+    # Strings waiting for the model: about a quarter of the budget, at an
+    # assumed 2 KB per chunk
+    flush_size = max(batch_size, memory_budget // 4 // 2048)
+
+    with tempfile.TemporaryDirectory(dir=store_dir) as directory:
+        stores = {}
+        refs = {'method': [], 'block': []}
+        pending = {'method': [], 'block': []}
+
+        def flush(family):
+            codes = pending[family]
+            if not codes:
+                return
+            embeddings = get_embeddings(codes, batch_size=batch_size, cache=cache, backend=backend,
+                                        windowed=windowed)
+            if family not in stores:
+                stores[family] = EmbeddingStore(os.path.join(directory, f"{family}.{dtype}"), embeddings.shape[1], dtype)
+            stores[family].append(embeddings)
+            pending[family] = []
+
+        extract = partial(extract_file_chunks, use_formatting=use_formatting, detect_intra_method=detect_intra_method)
+        for file_chunks in _bounded_map(extract, iter_java_files(root), workers):
+            count("files")
+            count("chunks.extracted", len(file_chunks))
+            for chunk in file_chunks:
+                family = 'method' if chunk.kind in METHOD_KINDS else 'block'
+                refs[family].append(ChunkRef(len(refs[family]), chunk.path, chunk.kind, chunk.start_line,
+                                             chunk.end_line, chunk.start_offset, chunk.end_offset,
+                                             content_hash(chunk.code)))
+                pending[family].append(chunk.code)
+                if len(pending[family]) >= flush_size:
+                    flush(family)
+
+        # Methods (with constructors and lambdas) and blocks are grouped
+        # separately, blocks with a higher threshold
+        for family, kind_threshold in (('method', threshold), ('block', threshold + 0.05)):
+            flush(family)
+            if len(refs[family]) < 2:
+                continue
+            store = stores[family]
+            embeddings = store.matrix()
+            groups = group_embeddings(embeddings, kind_threshold, block_size=tile_size(memory_budget, store.dim),
+                                      grouping=grouping, normalized=True)
+            for group, avg_similarity in groups:
+                yield [refs[family][index] for index in group], avg_similarity
+            del embeddings
+            store.close()
+
+def _bounded_map(function, items, workers, window_per_worker=4):
+    """Like ProcessPoolExecutor.map, but with at most a few tasks per worker
+    in flight, so results never queue up faster than they are consumed"""
+    if workers == 1:
+        yield from map(function, items)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        window = (workers or os.cpu_count() or 1) * window_per_worker
+        futures = deque()
+        for item in items:
+            futures.append(pool.submit(function, item))
+            if len(futures) >= window:
+                yield futures.popleft().result()
+        while futures:
+            yield futures.popleft().result()
@@ -0,0 +1,104 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, wait
+from multiprocessing import shared_memory
+
+import numpy as np
+
+class EmbeddingPool:
+    """Embeds chunks in a pool of worker processes.
+
+    Each worker loads the model on its first task and runs the encoder with
+    its own torch thread budget (`threads`, by default an even share of the
+    CPU cores). Results are written straight into a shared-memory float32
+    matrix, one row per chunk, so embeddings are never pickled back to the
+    parent; only chunk text goes out to the workers. Inputs smaller than
+    min_chunks, or a pool of one worker, are embedded in-process.
+    """
+
+    def __init__(self, workers=None, threads=None, backend="torch", batch_size=32, min_chunks=64):
+        self.workers = workers or os.cpu_count() or 1
+        self.threads = threads or max(1, (os.cpu_count() or 1) // self.workers)
+        self.backend = backend
+        self.batch_size = batch_size
+        self.min_chunks = min_chunks
+        self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def embed(self, chunks, windowed=False):
+        """Embed chunks, returning a float32 matrix with one row per chunk in input order
+
+        windowed is as for embedding.get_embeddings.
+        """
+        from .embedding import _encode, embedding_dim
+
+        chunks = list(chunks)
+        if self.workers == 1 or len(chunks) < self.min_chunks:
+            return _encode(chunks, self.batch_size, self.backend, windowed=windowed).embeddings
+
+        if self._executor is None:
+            # Spawn rather than fork: a forked child inherits torch's thread
+            # pools in whatever state the parent left them
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_initialize_worker,
+                initargs=(self.threads,),
+            )
+
+        shape = (len(chunks), embedding_dim())
+        memory = shared_memory.SharedMemory(create=True, size=shape[0] * shape[1] * 4)
+        try:
+            # Cut the length-sorted chunks into a few tasks per worker, so
+            # every task is a run of similar lengths and workers stay busy
+            order = sorted(range(len(chunks)), key=lambda index: len(chunks[index]))
+            task_size = max(self.batch_size, -(-len(order) // (self.workers * 4)))
+            futures = []
+            for start in range(0, len(order), task_size):
+                rows = order[start:start + task_size]
+                futures.append(self._executor.submit(
+                    _embed_rows, memory.name, shape, rows, [chunks[row] for row in rows],
+                    self.batch_size, self.backend, windowed,
+                ))
+            wait(futures)
+            for future in futures:
+                future.result()
+            return np.ndarray(shape, dtype=np.float32, buffer=memory.buf).copy()
+        finally:
+            memory.close()
+            memory.unlink()
+
+def _initialize_worker(threads):
+    from .backends import configure_threads
+    configure_threads(threads, 1)
+
+def _embed_rows(name, shape, rows, chunks, batch_size, backend, windowed):
+    """Worker task: embed chunks into the given rows of the shared matrix"""
+    from .embedding import _encode
+
+    embeddings = _encode(chunks, batch_size, backend, windowed=windowed).embeddings
+    memory = _attach(name)
+    try:
+        np.ndarray(shape, dtype=np.float32, buffer=memory.buf)[rows] = embeddings
+    finally:
+        memory.close()
+    return len(rows)
+
+def _attach(name):
+    """Open the parent's shared memory; the parent alone unlinks it"""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Python < 3.13 has no track argument. Workers share the parent's
+        # resource tracker, where the segment is already registered.
+        return shared_memory.SharedMemory(name=name)
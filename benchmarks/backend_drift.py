@@ -0,0 +1,129 @@
+"""Speed and accuracy drift of the CPU inference backends against fp32 torch.
+
+Embeds a fixed corpus of Java methods (a seeded set of renamed variants of a
+few templates, or the chunks of a directory passed with --path) with every
+backend, then reports each backend's time, how far its embeddings drift from
+the fp32 ones, and how many same-group pairs of the fp32 duplicate groups
+it keeps (recall) or adds (precision).
+"""
+import argparse
+import itertools
+import os
+import random
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from Duplicate_Tool.backends import BACKENDS, configure_threads
+from Duplicate_Tool.detection import group_embeddings
+from Duplicate_Tool.embedding import get_embeddings
+from Duplicate_Tool.similarity import normalize_embeddings
+
+TEMPLATES = [
+    '''public int {name}(int {a}, int {b}) {{
+    int {result} = {a} + {b};
+    System.out.println("Sum calculated: " + {result});
+    return {result};
+}}''',
+    '''public void {name}(List<String> {a}) {{
+    for (int {b} = 0; {b} < {a}.size(); {b}++) {{
+        System.out.println("Item " + {b} + ": " + {a}.get({b}));
+    }}
+}}''',
+    '''private boolean {name}(String {a}) {{
+    if ({a} == null || {a}.isEmpty()) {{
+        return false;
+    }}
+    String {result} = {a}.trim();
+    return {result}.matches("[a-z]+@[a-z]+\\\\.com");
+}}''',
+    '''protected Map<String, Integer> {name}(String[] {a}) {{
+    Map<String, Integer> {result} = new HashMap<>();
+    for (String {b} : {a}) {{
+        {result}.merge({b}, 1, Integer::sum);
+    }}
+    return {result};
+}}''',
+    '''public double {name}(double[] {a}) {{
+    double {result} = 0;
+    for (double {b} : {a}) {{
+        {result} += {b} * {b};
+    }}
+    return Math.sqrt({result});
+}}''',
+    '''void {name}(Path {a}) throws IOException {{
+    try (BufferedReader {b} = Files.newBufferedReader({a})) {{
+        String {result};
+        while (({result} = {b}.readLine()) != null) {{
+            process({result});
+        }}
+    }}
+}}''',
+]
+
+NAMES = ['alpha', 'beta', 'gamma', 'delta', 'value', 'item', 'input', 'data', 'total', 'count', 'left', 'right']
+
+def synthetic_corpus(variants, seed=0):
+    """Renamed copies of every template, in a fixed shuffled order"""
+    rng = random.Random(seed)
+    corpus = []
+    for template in TEMPLATES:
+        for index in range(variants):
+            a, b, result = rng.sample(NAMES, 3)
+            corpus.append(template.format(name=f'method{len(corpus)}', a=a, b=b, result=result))
+    rng.shuffle(corpus)
+    return corpus
+
+def directory_corpus(path):
+    from Duplicate_Tool.scanner import extract_file_chunks, iter_java_files
+    return [chunk.code for file in iter_java_files(path) for chunk in extract_file_chunks(file, use_formatting=False)]
+
+def same_group_pairs(groups):
+    return {pair for group, _ in groups for pair in itertools.combinations(sorted(group), 2)}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--path', help='Use the chunks of this directory as the corpus')
+    parser.add_argument('--variants', type=int, default=20, help='Renamed copies per template')
+    parser.add_argument('--threshold', type=float, default=0.90)
+    parser.add_argument('--backends', nargs='+', choices=BACKENDS, default=list(BACKENDS))
+    parser.add_argument('--threads', type=int, default=None)
+    parser.add_argument('--batch-size', type=int, default=32)
+    args = parser.parse_args()
+
+    if args.threads is not None:
+        configure_threads(args.threads, args.threads)
+    corpus = directory_corpus(args.path) if args.path else synthetic_corpus(args.variants)
+
+    results = {}
+    for backend in ['torch'] + [name for name in args.backends if name != 'torch']:
+        # Warm up once so model loading and export are not timed
+        get_embeddings(corpus[:1], backend=backend)
+        start = time.perf_counter()
+        embeddings = get_embeddings(corpus, batch_size=args.batch_size, backend=backend)
+        seconds = time.perf_counter() - start
+        groups = group_embeddings(embeddings, args.threshold)
+        results[backend] = (normalize_embeddings(embeddings), groups, seconds)
+
+    baseline, baseline_groups, baseline_seconds = results['torch']
+    baseline_pairs = same_group_pairs(baseline_groups)
+
+    print("=" * 84)
+    print(f"{len(corpus)} chunks, threshold {args.threshold}, "
+          f"{len(baseline_groups)} fp32 groups with {len(baseline_pairs)} same-group pairs")
+    print("=" * 84)
+    for backend, (embeddings, groups, seconds) in results.items():
+        cosine = np.einsum('ij,ij->i', embeddings, baseline)
+        pairs = same_group_pairs(groups)
+        kept = len(pairs & baseline_pairs)
+        recall = kept / len(baseline_pairs) if baseline_pairs else 1.0
+        precision = kept / len(pairs) if pairs else 1.0
+        print(f"{backend:<10} time={seconds:.2f}s speedup={baseline_seconds / seconds:.2f}x "
+              f"cos(min)={cosine.min():.4f} cos(mean)={cosine.mean():.4f} "
+              f"groups={len(groups)} pair recall={recall:.3f} precision={precision:.3f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+"""Throughput of the tokenizer-based Java chunker on large files.
+
+Chunks synthetic sources of growing size (or a real file passed with
+--file) and reports MB/s and lines/s for each size. The time per MB
+should stay flat as the input grows, since the chunker makes a single
+linear pass over the tokens.
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from Duplicate_Tool.chunker import chunk_java
+
+CLASS_TEMPLATE = '''
+/** Generated class {index}, with braces in comments: {{ }} */
+public class Generated{index} extends Base implements Runnable {{
+    private static final String TEMPLATE = "{{\\"key\\": \\"value\\"}} // not a comment";
+    private final int[] weights = {{1, 2, 3, 4}};
+
+    static {{
+        register(Generated{index}.class);
+    }}
+
+    Generated{index}(int seed) {{
+        this.seed = seed;
+        this.name = "generated-" + seed;
+    }}
+
+    @Override
+    public void run() {{
+        for (int i = 0; i < weights.length; i++) {{
+            total += weights[i] * seed; // accumulate
+            if (total > LIMIT) {{
+                total = LIMIT;
+            }}
+        }}
+    }}
+
+    int sum(List<Integer> values) {{
+        return values.stream().map(value -> {{
+            int doubled = value * 2;
+            return doubled + seed;
+        }}).reduce(0, Integer::sum);
+    }}
+
+    <T extends Comparable<T>> T max(T a, T b) throws IllegalStateException {{
+        Comparator<T> order = new Comparator<T>() {{
+            public int compare(T left, T right) {{
+                return left.compareTo(right);
+            }}
+        }};
+        switch (mode) {{
+            case FIRST -> {{
+                log("first");
+                return a;
+            }}
+            default -> {{
+                return order.compare(a, b) >= 0 ? a : b;
+            }}
+        }}
+    }}
+}}
+'''
+
+def synthetic_source(num_classes):
+    return ''.join(CLASS_TEMPLATE.format(index=index) for index in range(num_classes)).encode('utf-8')
+
+def measure(source, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        chunks = chunk_java(source)
+        best = min(best, time.perf_counter() - start)
+    return best, len(chunks)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--classes', type=int, nargs='+', default=[250, 500, 1000, 2000, 4000],
+                        help='Synthetic file sizes, in generated classes')
+    parser.add_argument('--file', help='Chunk this Java file instead of synthetic sources')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    if args.file:
+        with open(args.file, 'rb') as f:
+            sources = [(args.file, f.read())]
+    else:
+        sources = [(f'{classes} classes', synthetic_source(classes)) for classes in args.classes]
+
+    print("=" * 72)
+    print(f"{'input':<16} {'MB':>7} {'lines':>9} {'chunks':>8} {'MB/s':>8} {'lines/s':>11} {'s/MB':>7}")
+    print("=" * 72)
+    for name, source in sources:
+        seconds, num_chunks = measure(source, args.repeat)
+        megabytes = len(source) / 1e6
+        lines = source.count(b'\n') + 1
+        print(f"{name:<16} {megabytes:>7.2f} {lines:>9} {num_chunks:>8} "
+              f"{megabytes / seconds:>8.2f} {lines / seconds:>11.0f} {seconds / megabytes:>7.3f}")
+
+if __name__ == '__main__':
+    main()
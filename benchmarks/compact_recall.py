@@ -0,0 +1,63 @@
+"""Recall, speed and size of compact-code screening against exact all-pairs search.
+
+Embeddings are reduced with PCA to sign bits packed in uint64 words
+(Duplicate_Tool.compact); pairs are screened by Hamming distance and only
+survivors are scored in float32. Runs on the synthetic embeddings of
+ann_recall.py or on a saved .npy embedding matrix passed with --embeddings.
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from ann_recall import synthetic_embeddings
+
+from Duplicate_Tool.compact import CompactCodec, compact_edges
+from Duplicate_Tool.similarity import normalize_embeddings, similarity_edges
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--size', type=int, default=20000)
+    parser.add_argument('--embeddings', help='Path to a saved (n, d) .npy matrix')
+    parser.add_argument('--threshold', type=float, default=0.90)
+    parser.add_argument('--bits', type=int, nargs='+', default=[64, 128, 256])
+    parser.add_argument('--recall', type=float, default=0.99, help='Target recall used to calibrate the screen')
+    args = parser.parse_args()
+
+    if args.embeddings:
+        embeddings = np.load(args.embeddings)
+    else:
+        embeddings = synthetic_embeddings(args.size)
+    normed = normalize_embeddings(embeddings)
+
+    start = time.perf_counter()
+    exact = {(i, j) for i, j, _ in similarity_edges(normed, args.threshold, normalized=True)}
+    exact_seconds = time.perf_counter() - start
+
+    print("=" * 60)
+    print(f"{len(normed)} chunks, threshold {args.threshold}, {len(exact)} exact edges")
+    print(f"exact: {exact_seconds:.2f}s, {normed.shape[1] * 4} bytes per chunk")
+    print("=" * 60)
+
+    for bits in args.bits:
+        start = time.perf_counter()
+        codec = CompactCodec(bits=bits).fit(normed)
+        max_distance = codec.calibrate(normed, args.threshold, recall=args.recall, normalized=True)
+        fit_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        found = {(i, j) for i, j, _ in compact_edges(normed, args.threshold, codec=codec, max_distance=max_distance,
+                                                     normalized=True)}
+        seconds = time.perf_counter() - start
+
+        recall = len(found & exact) / len(exact) if exact else 1.0
+        speedup = exact_seconds / seconds if seconds else float('inf')
+        print(f"compact bits={bits:<4} bytes={bits // 8:<3} max_distance={max_distance:<4} "
+              f"recall={recall:.3f} fit={fit_seconds:.2f}s time={seconds:.2f}s speedup={speedup:.1f}x")
+
+if __name__ == '__main__':
+    main()
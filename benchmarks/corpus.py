@@ -0,0 +1,246 @@
+"""Seeded generator of synthetic Java corpora with planted clones.
+
+Writes a tree of Java classes full of randomly generated methods, some of
+which are planted clones of others, plus a ground_truth.json listing every
+clone class with its type:
+
+  Type 1  exact copy under a new name, with layout and comments changed
+  Type 2  identifiers and literals renamed as well
+  Type 3  a Type 2 copy with one statement added, removed or changed
+
+The same seed always gives the same corpus. Other benchmarks import
+generate_corpus and score_pairs from here.
+"""
+import argparse
+import json
+import os
+import random
+import re
+from collections import namedtuple
+
+# A generated corpus: {relative path: source}, the clone classes (each a
+# dict with its type and members) and the total number of methods
+Corpus = namedtuple('Corpus', ['files', 'clone_classes', 'methods'])
+
+VERBS = ['compute', 'update', 'collect', 'resolve', 'render', 'scale', 'merge', 'check', 'load', 'apply']
+NOUNS = ['Total', 'Score', 'Window', 'Budget', 'Offset', 'Weight', 'Count', 'Limit', 'Margin', 'Ratio']
+NAMES = ['value', 'item', 'input', 'data', 'total', 'count', 'left', 'right', 'index', 'acc',
+         'sum', 'delta', 'step', 'size', 'base', 'limit', 'temp', 'result', 'current', 'next']
+TYPES = ['int', 'long', 'double']
+OPERATORS = ['+', '-', '*']
+
+Method = namedtuple('Method', ['name', 'type', 'params', 'statements', 'variables'])
+
+def random_method(rng, name):
+    """A method of 3-8 random statements over its parameters and locals"""
+    value_type = rng.choice(TYPES)
+    names = rng.sample(NAMES, 6)
+    params = names[:rng.randint(2, 3)]
+    variables = list(params)
+    locals_ = [name for name in names if name not in params]
+
+    statements = []
+    for _ in range(rng.randint(3, 8)):
+        statements.append(_random_statement(rng, value_type, variables, locals_))
+    statements.append([f"return {rng.choice(variables)};"])
+    return Method(name, value_type, params, statements, names)
+
+def _random_statement(rng, value_type, variables, locals_):
+    """One statement as a list of lines, possibly declaring a new local"""
+    a, b = rng.choice(variables), rng.choice(variables)
+    op = rng.choice(OPERATORS)
+    literal = rng.randint(2, 99)
+    kind = rng.randrange(5)
+    if kind == 0 and locals_:
+        target = locals_.pop(0)
+        variables.append(target)
+        return [f"{value_type} {target} = {a} {op} {b};"]
+    if kind == 1:
+        return [f"if ({a} > {literal}) {{", f"    {a} = {a} {op} {literal};", "}"]
+    if kind == 2:
+        return [f"for (int i = 0; i < {literal}; i++) {{", f"    {a} += {b} {op} i;", "}"]
+    if kind == 3:
+        return [f'System.out.println("{a} is " + {a});']
+    return [f"{a} = {a} {op} {b} {rng.choice(OPERATORS)} {literal};"]
+
+def render_method(method, indent="    ", comment=None, blank_lines=False):
+    """Method source lines; the Type 1 variations only change layout and comments"""
+    params = ', '.join(f"{method.type} {name}" for name in method.params)
+    lines = []
+    if comment:
+        lines.append(f"{indent}// {comment}")
+    lines.append(f"{indent}public {method.type} {method.name}({params}) {{")
+    for statement in method.statements:
+        for line in statement:
+            lines.append(f"{indent * 2}{line}")
+        if blank_lines:
+            lines.append("")
+    if blank_lines:
+        lines.pop()
+    lines.append(f"{indent}}}")
+    return lines
+
+def rename(rng, method, name):
+    """Type 2 copy: new method, parameter and local names, new literals"""
+    mapping = dict(zip(method.variables, rng.sample([n for n in NAMES if n not in method.variables], len(method.variables))))
+    pattern = re.compile(r'\b(' + '|'.join(map(re.escape, mapping)) + r')\b')
+
+    def replace(line):
+        # Names inside string literals are renamed too, as a refactoring tool would
+        line = pattern.sub(lambda match: mapping[match.group(1)], line)
+        return re.sub(r'\b\d+\b', lambda match: str(rng.randint(2, 99)), line)
+
+    statements = [[replace(line) for line in statement] for statement in method.statements]
+    return Method(name, method.type, [mapping[p] for p in method.params], statements,
+                  [mapping[v] for v in method.variables])
+
+def edit(rng, method):
+    """Type 3 change: add, remove or change one statement (never the return)"""
+    statements = [list(statement) for statement in method.statements]
+    body = len(statements) - 1
+    action = rng.randrange(3) if body > 2 else 0
+    if action == 0:
+        extra = _random_statement(rng, method.type, list(method.params), [])
+        statements.insert(rng.randint(0, body), extra)
+    elif action == 1:
+        del statements[rng.randrange(body)]
+    else:
+        position = rng.randrange(body)
+        statements[position] = [_swap_operator(rng, line) for line in statements[position]]
+        if statements[position] == method.statements[position]:
+            statements[position] = _random_statement(rng, method.type, list(method.params), [])
+    return method._replace(statements=statements)
+
+def _swap_operator(rng, line):
+    return re.sub(r' ([-+*]) ', lambda match: f" {rng.choice([op for op in OPERATORS if op != match.group(1)])} ", line, count=1)
+
+def generate_corpus(files=50, methods_per_file=10, clone_fraction=0.3, max_clones=3, seed=0):
+    """Generate a corpus; about clone_fraction of the methods are planted clones.
+
+    Every clone class has an original and 1..max_clones copies of a single
+    type, spread over random files. Method names are unique across the
+    corpus, so a method name identifies a method.
+    """
+    rng = random.Random(seed)
+    total = files * methods_per_file
+    slots = [[] for _ in range(files)]
+    counter = 0
+
+    def next_name():
+        nonlocal counter
+        counter += 1
+        return f"{rng.choice(VERBS)}{rng.choice(NOUNS)}{counter}"
+
+    def place(method, **layout):
+        slots[rng.randrange(files)].append((method, layout))
+
+    clone_classes = []
+    planted = 0
+    while planted < total * clone_fraction:
+        clone_type = rng.randint(1, 3)
+        original = random_method(rng, next_name())
+        place(original)
+        members = [original.name]
+        for _ in range(rng.randint(1, max_clones)):
+            name = next_name()
+            if clone_type == 1:
+                place(original._replace(name=name), indent=rng.choice(["  ", "\t"]),
+                      comment=f"copied from {original.name}", blank_lines=rng.random() < 0.5)
+            else:
+                copy = rename(rng, original, name)
+                place(edit(rng, copy) if clone_type == 3 else copy)
+            members.append(name)
+        planted += len(members)
+        clone_classes.append({'type': clone_type, 'members': members})
+
+    while planted < total:
+        place(random_method(rng, next_name()))
+        planted += 1
+
+    # Render every file, recording where each method ends up
+    sources = {}
+    locations = {}
+    for index, methods in enumerate(slots):
+        rng.shuffle(methods)
+        path = os.path.join('gen', f'package{index % 10}', f'Generated{index}.java')
+        lines = [f"package gen.package{index % 10};", "", f"public class Generated{index} {{"]
+        for method, layout in methods:
+            lines.append("")
+            method_lines = render_method(method, **layout)
+            start = len(lines) + 1 + (1 if layout.get('comment') else 0)
+            lines.extend(method_lines)
+            locations[method.name] = {'path': path, 'method': method.name, 'start_line': start, 'end_line': len(lines)}
+        lines.append("}")
+        sources[path] = '\n'.join(lines) + '\n'
+
+    for clone_class in clone_classes:
+        clone_class['members'] = [locations[name] for name in clone_class['members']]
+    return Corpus(sources, clone_classes, total)
+
+def write_corpus(corpus, directory, seed=None):
+    """Write the sources and ground_truth.json under directory"""
+    for path, source in corpus.files.items():
+        target = os.path.join(directory, path)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with open(target, 'w', encoding='utf-8') as f:
+            f.write(source)
+    with open(os.path.join(directory, 'ground_truth.json'), 'w') as f:
+        json.dump({'seed': seed, 'methods': corpus.methods, 'clone_classes': corpus.clone_classes}, f, indent=2)
+
+def method_name(code):
+    """Name of the method a chunk of generated code declares, or None for a
+    statement block"""
+    match = re.match(r'\s*public \w+ (\w+)\(', code)
+    return match.group(1) if match else None
+
+def clone_pairs(corpus):
+    """{frozenset({name, name}): clone type} for every planted clone pair"""
+    pairs = {}
+    for clone_class in corpus.clone_classes:
+        names = [member['method'] for member in clone_class['members']]
+        for i, a in enumerate(names):
+            for b in names[i + 1:]:
+                pairs[frozenset((a, b))] = clone_class['type']
+    return pairs
+
+def score_pairs(corpus, name_groups):
+    """Pairwise precision and recall (overall and per clone type) of groups
+    of method names against the planted clones"""
+    truth = clone_pairs(corpus)
+    found = set()
+    for names in name_groups:
+        names = sorted(set(name for name in names if name))
+        for i, a in enumerate(names):
+            for b in names[i + 1:]:
+                found.add(frozenset((a, b)))
+    hits = found & set(truth)
+    scores = {
+        'pairs_found': len(found),
+        'pairs_expected': len(truth),
+        'precision': len(hits) / len(found) if found else 1.0,
+        'recall': len(hits) / len(truth) if truth else 1.0,
+    }
+    for clone_type in (1, 2, 3):
+        expected = [pair for pair, kind in truth.items() if kind == clone_type]
+        scores[f'recall_type{clone_type}'] = (
+            sum(pair in hits for pair in expected) / len(expected) if expected else None
+        )
+    return scores
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('output', help='Directory to write the corpus to')
+    parser.add_argument('--files', type=int, default=50)
+    parser.add_argument('--methods-per-file', type=int, default=10)
+    parser.add_argument('--clone-fraction', type=float, default=0.3)
+    parser.add_argument('--max-clones', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    corpus = generate_corpus(args.files, args.methods_per_file, args.clone_fraction, args.max_clones, args.seed)
+    write_corpus(corpus, args.output, seed=args.seed)
+    print(f"Wrote {len(corpus.files)} files with {corpus.methods} methods and "
+          f"{len(corpus.clone_classes)} clone classes to {args.output}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+"""Import time of the package and its modules, each in a fresh interpreter.
+
+Reports the median wall time of `import <module>` over several runs, minus
+the startup time of an empty interpreter, and whether the import pulled in
+numpy, torch or transformers. With --model it also times the first
+embedding, which is when the CodeT5 encoder is actually loaded.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+MODULES = [
+    'Duplicate_Tool',
+    'Duplicate_Tool.chunker',
+    'Duplicate_Tool.preprocessing',
+    'Duplicate_Tool.detection',
+    'Duplicate_Tool.embedding',
+]
+
+HEAVY = ('numpy', 'torch', 'transformers')
+
+def run(statement):
+    """Wall time of running statement in a new interpreter, and its stdout"""
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, '-c', statement], cwd=ROOT, capture_output=True, text=True, check=True)
+    return time.perf_counter() - start, result.stdout.strip()
+
+def median_time(statement, repeat):
+    return statistics.median(run(statement)[0] for _ in range(repeat))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--model', action='store_true', help='Also time loading the model on first use')
+    args = parser.parse_args()
+
+    baseline = median_time('pass', args.repeat)
+    print("=" * 72)
+    print(f"interpreter startup: {baseline * 1000:.0f} ms (subtracted below)")
+    print("=" * 72)
+
+    for module in MODULES:
+        seconds = median_time(f'import {module}', args.repeat)
+        _, loaded = run(f'import sys, {module}; print(" ".join(m for m in {HEAVY!r} if m in sys.modules))')
+        print(f"{module:<32} {(seconds - baseline) * 1000:>8.0f} ms   loads: {loaded or '-'}")
+
+    if args.model:
+        seconds, _ = run('from Duplicate_Tool.embedding import get_embeddings; get_embeddings(["int x = 1;"])')
+        print(f"{'first embedding':<32} {(seconds - baseline) * 1000:>8.0f} ms")
+
+if __name__ == '__main__':
+    main()
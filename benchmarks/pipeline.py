@@ -0,0 +1,186 @@
+"""Throughput, latency, memory and accuracy of every detection stage.
+
+Generates a seeded synthetic corpus (see corpus.py) and times
+format_java_code, normalize_code, extract_code_blocks,
+extract_complete_methods, get_embedding, find_duplicate_groups and
+end-to-end detect_duplicate_groups_enhanced on it. Every stage reports
+throughput (items/s, lines/s, chunks/s), latency percentiles and the peak
+RSS so far; the grouping stages also report pairwise precision and recall
+against the planted clones. The report is JSON, written to stdout or
+--output. With --baseline, stages whose throughput fell by more than
+--tolerance against an earlier report are listed and the exit status is 1.
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from corpus import generate_corpus, method_name, score_pairs
+
+from Duplicate_Tool.detection import detect_duplicate_groups_enhanced, extract_code_blocks, find_duplicate_groups
+from Duplicate_Tool.embedding import get_embedding
+from Duplicate_Tool.preprocessing import extract_complete_methods, format_java_code, normalize_code
+
+STAGES = ['format_java_code', 'normalize_code', 'extract_code_blocks', 'extract_complete_methods',
+          'get_embedding', 'find_duplicate_groups', 'detect_duplicate_groups_enhanced']
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (2 ** 20 if sys.platform == 'darwin' else 2 ** 10)
+
+def percentiles(latencies):
+    latencies = np.asarray(latencies) * 1000
+    return {f'p{q}_ms': float(np.percentile(latencies, q)) for q in (50, 90, 99)}
+
+def time_each(function, items):
+    """Call function on every item, returning (results, total seconds, per-call latencies)"""
+    results = []
+    latencies = []
+    for item in items:
+        start = time.perf_counter()
+        results.append(function(item))
+        latencies.append(time.perf_counter() - start)
+    return results, sum(latencies), latencies
+
+def stage_report(seconds, latencies=None, items=None, lines=None, chunks=None):
+    report = {'seconds': seconds}
+    for name, count in (('items', items), ('lines', lines), ('chunks', chunks)):
+        if count is not None:
+            report[name] = count
+            report[f'{name}_per_second'] = count / seconds if seconds else None
+    if latencies:
+        report.update(percentiles(latencies))
+    report['peak_rss_mb'] = peak_rss_mb()
+    return report
+
+def group_names(groups):
+    # Statement block groups have no names and so never count as clone pairs
+    return [[method_name(chunk) for chunk in group] for group, _ in groups]
+
+def compare(report, baseline, tolerance):
+    """Stages whose main throughput dropped by more than tolerance"""
+    regressions = []
+    for stage, result in report['stages'].items():
+        before = baseline.get('stages', {}).get(stage)
+        if not before:
+            continue
+        for key in ('chunks_per_second', 'lines_per_second', 'items_per_second'):
+            if result.get(key) and before.get(key):
+                if result[key] < before[key] * (1 - tolerance):
+                    regressions.append(f"{stage}: {key} {before[key]:.1f} -> {result[key]:.1f}")
+                break
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--files', type=int, default=20)
+    parser.add_argument('--methods-per-file', type=int, default=10)
+    parser.add_argument('--clone-fraction', type=float, default=0.3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--threshold', type=float, default=0.90)
+    parser.add_argument('--embed-sample', type=int, default=50, help='Chunks timed one at a time with get_embedding')
+    parser.add_argument('--no-format', action='store_true', help='Skip the formatter stage and format-dependent runs')
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=STAGES)
+    parser.add_argument('--output', help='Write the JSON report here instead of stdout')
+    parser.add_argument('--baseline', help='Earlier JSON report to check for throughput regressions')
+    parser.add_argument('--tolerance', type=float, default=0.10, help='Allowed throughput drop against --baseline')
+    args = parser.parse_args()
+
+    corpus = generate_corpus(args.files, args.methods_per_file, args.clone_fraction, seed=args.seed)
+    sources = list(corpus.files.values())
+    total_lines = sum(source.count('\n') for source in sources)
+    stages = {}
+
+    if 'format_java_code' in args.stages and not args.no_format:
+        _, seconds, latencies = time_each(format_java_code, sources)
+        stages['format_java_code'] = stage_report(seconds, latencies, items=len(sources), lines=total_lines)
+
+    if 'normalize_code' in args.stages:
+        _, seconds, latencies = time_each(normalize_code, sources)
+        stages['normalize_code'] = stage_report(seconds, latencies, items=len(sources), lines=total_lines)
+
+    if 'extract_code_blocks' in args.stages:
+        extract = lambda source: extract_code_blocks(source, use_formatting=not args.no_format)
+        blocks, seconds, latencies = time_each(extract, sources)
+        stages['extract_code_blocks'] = stage_report(seconds, latencies, items=len(sources), lines=total_lines,
+                                                     chunks=sum(map(len, blocks)))
+
+    methods, seconds, latencies = time_each(extract_complete_methods, sources)
+    methods = [method for file_methods in methods for method in file_methods]
+    if 'extract_complete_methods' in args.stages:
+        stages['extract_complete_methods'] = stage_report(seconds, latencies, items=len(sources), lines=total_lines,
+                                                          chunks=len(methods))
+
+    if 'get_embedding' in args.stages:
+        sample = methods[:args.embed_sample]
+        # Load the model outside the timed calls
+        get_embedding(sample[0])
+        _, seconds, latencies = time_each(get_embedding, sample)
+        stages['get_embedding'] = stage_report(seconds, latencies, chunks=len(sample),
+                                               lines=sum(method.count('\n') + 1 for method in sample))
+
+    if 'find_duplicate_groups' in args.stages:
+        start = time.perf_counter()
+        groups = find_duplicate_groups(methods, args.threshold)
+        seconds = time.perf_counter() - start
+        stages['find_duplicate_groups'] = stage_report(seconds, chunks=len(methods),
+                                                       lines=sum(method.count('\n') + 1 for method in methods))
+        stages['find_duplicate_groups']['groups'] = len(groups)
+        stages['find_duplicate_groups']['accuracy'] = score_pairs(corpus, group_names(groups))
+
+    if 'detect_duplicate_groups_enhanced' in args.stages:
+        # Java allows several top-level classes in one source, so the whole
+        # corpus goes through as one compilation unit
+        source = '\n'.join(source.split('\n', 1)[1] for source in sources)
+        start = time.perf_counter()
+        groups = detect_duplicate_groups_enhanced(source, threshold=args.threshold, use_formatting=not args.no_format)
+        seconds = time.perf_counter() - start
+        stages['detect_duplicate_groups_enhanced'] = stage_report(seconds, items=1, lines=total_lines,
+                                                                  chunks=len(methods))
+        stages['detect_duplicate_groups_enhanced']['groups'] = len(groups)
+        stages['detect_duplicate_groups_enhanced']['accuracy'] = score_pairs(corpus, group_names(groups))
+
+    report = {
+        'config': vars(args),
+        'environment': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'machine': platform.machine(),
+            'cpu_count': os.cpu_count(),
+        },
+        'corpus': {'files': len(sources), 'lines': total_lines, 'methods': corpus.methods,
+                   'clone_classes': len(corpus.clone_classes)},
+        'stages': stages,
+        'peak_rss_mb': peak_rss_mb(),
+    }
+    try:
+        import torch
+        report['environment']['torch'] = torch.__version__
+    except ImportError:
+        pass
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""Chunks per second of the tokenization step of the embedding stage.
+
+Compares the pure-Python RobertaTokenizer (when the installed transformers
+still has one) called once per chunk, the fast tokenizer called once per
+chunk, the fast tokenizer encoding the whole batch in one call, and the
+embedding stage's token-id cache when warm. Chunks are the methods and
+blocks of the synthetic corpus from corpus.py, so identical blocks repeat
+as they do in real code.
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from corpus import generate_corpus
+
+from Duplicate_Tool.embedding import MAX_LENGTH, MODEL_NAME, MODEL_REVISION, TokenCache
+from Duplicate_Tool.preprocessing import extract_chunks
+
+def corpus_chunks(files, methods_per_file, seed):
+    corpus = generate_corpus(files=files, methods_per_file=methods_per_file, seed=seed)
+    chunks = []
+    for source in corpus.files.values():
+        chunks.extend(chunk.code for chunk in extract_chunks(source))
+    return chunks
+
+def measure(name, tokenize, chunks, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        tokenize(chunks)
+        best = min(best, time.perf_counter() - start)
+    print(f"{name:<28}{len(chunks) / best:>14.0f} chunks/s{best * 1000:>12.1f} ms")
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--files', type=int, default=50)
+    parser.add_argument('--methods-per-file', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per mode; the fastest is reported')
+    args = parser.parse_args()
+
+    from transformers import RobertaTokenizer, RobertaTokenizerFast
+
+    chunks = corpus_chunks(args.files, args.methods_per_file, args.seed)
+    print("=" * 62)
+    print(f"{len(chunks)} chunks, {len(set(chunks))} distinct")
+    print("=" * 62)
+
+    options = {'truncation': True, 'max_length': MAX_LENGTH}
+    fast = RobertaTokenizerFast.from_pretrained(MODEL_NAME, revision=MODEL_REVISION)
+    slow = RobertaTokenizer.from_pretrained(MODEL_NAME, revision=MODEL_REVISION)
+    if not slow.is_fast:
+        measure("slow, per chunk", lambda batch: [slow(chunk, **options) for chunk in batch], chunks, args.repeat)
+    else:
+        print("slow, per chunk             (this transformers only has the fast tokenizer)")
+    baseline = measure("fast, per chunk", lambda batch: [fast(chunk, **options) for chunk in batch], chunks, args.repeat)
+    batched = measure("fast, batched", lambda batch: fast(batch, **options), chunks, args.repeat)
+
+    cache = TokenCache()
+    cold = measure("token cache, cold", lambda batch: (cache.clear(), cache.tokenize(fast, batch, **options)),
+                   chunks, args.repeat)
+    warm = measure("token cache, warm", lambda batch: cache.tokenize(fast, batch, **options), chunks, args.repeat)
+    print("-" * 62)
+    print(f"batched {baseline / batched:.1f}x, cold cache {baseline / cold:.1f}x, "
+          f"warm cache {baseline / warm:.1f}x faster than per-chunk calls")
+
+if __name__ == '__main__':
+    main()
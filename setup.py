@@ -8,19 +8,25 @@ setup(
     version="0.2",
     packages=find_packages(),
     package_data={
-        "Duplicate_Tool": ["resources/google-java-format-1.25.2-all-deps.jar"],
+        "Duplicate_Tool": [
+            "resources/google-java-format-1.25.2-all-deps.jar",
+            "resources/FormatterWorker.java",
+        ],
     },
     include_package_data=True,
     install_requires=[
         "torch",
         "transformers",
-        "scikit-learn",
         "numpy"
     ],
+    extras_require={
+        "onnx": ["onnx", "onnxruntime"],
+    },
     python_requires=">=3.8",
     entry_points={
         "console_scripts": [
             "duplicate-tool=Duplicate_Tool.detection:main",
+            "duplicate-tool-server=Duplicate_Tool.server:main",
         ],
     },
     author="Adham Mohamed",
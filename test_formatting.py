@@ -1,8 +1,8 @@
 import sys
 import os
-sys.path.append(os.path.join(os.path.dirname(__file__), 'Duplicate_Tool'))
+sys.path.append(os.path.dirname(__file__))
 
-from preprocessing import format_java_code, normalize_code
+from Duplicate_Tool.preprocessing import format_java_code, normalize_code
 
 # Test code with inconsistent formatting
 test_code = """
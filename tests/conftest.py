@@ -0,0 +1,53 @@
+import os
+import re
+import sys
+import zlib
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+DIM = 512
+
+def bag_of_tokens(chunks, **options):
+    """Deterministic stand-in for the encoder: hashed token counts, so copies
+    embed identically and unrelated code lands far apart"""
+    embeddings = np.zeros((len(chunks), DIM), dtype=np.float32)
+    for row, chunk in enumerate(chunks):
+        for token in re.findall(r'\w+|[^\w\s]', chunk):
+            embeddings[row, zlib.crc32(token.encode('utf-8')) % DIM] += 1.0
+    return embeddings
+
+@pytest.fixture
+def fake_encoder(monkeypatch):
+    """Route every get_embeddings call of the pipeline to bag_of_tokens"""
+    from Duplicate_Tool import aio, detection, index, scanner, streaming
+    for module in (aio, detection, index, scanner, streaming):
+        monkeypatch.setattr(module, 'get_embeddings', bag_of_tokens)
+    return bag_of_tokens
+
+def java_method(name, words, comment=None):
+    """A five-statement method whose identifiers are taken from words"""
+    a, b, total, helper, label = words
+    lines = [
+        f"    public int {name}(int {a}, int {b}) {{",
+        f"        int {total} = {a} * {b} + {len(name)};",
+        f"        for (int i = 0; i < {a}; i++) {{",
+        f"            {total} += {helper}(i, {b});",
+        f"            {total} -= {helper}({b}, i);",
+        "        }",
+        f"        System.out.println(\"{label}: \" + {total});",
+        f"        return {total};",
+        "    }",
+    ]
+    if comment:
+        lines.insert(1, f"        // {comment}")
+    return "\n".join(lines)
+
+def write_java(root, relative, class_name, methods):
+    path = os.path.join(root, relative)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(f"public class {class_name} {{\n" + "\n\n".join(methods) + "\n}\n")
+    return path
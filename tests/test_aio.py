@@ -0,0 +1,129 @@
+import asyncio
+import os
+import stat
+import sys
+
+import pytest
+from conftest import bag_of_tokens, java_method, write_java
+
+from Duplicate_Tool.aio import AsyncJavaFormatter, scan_directory_async
+
+# Speaks the FormatterWorker frame protocol, or formats stdin like
+# `java -jar google-java-format.jar -`. FAKE_JAVA_FRAMES makes a worker exit
+# after that many frames and FAKE_JAVA_DELAY slows every frame down.
+FAKE_JAVA = '''
+import os, struct, sys, time
+with open(os.environ["FAKE_JAVA_LOG"], "a") as log:
+    log.write(("cli" if "-jar" in sys.argv else "worker") + "\\n")
+if "-jar" in sys.argv:
+    sys.stdout.write("cli:" + sys.stdin.read())
+    sys.exit(0)
+frames = int(os.environ.get("FAKE_JAVA_FRAMES", "-1"))
+while frames != 0:
+    header = sys.stdin.buffer.read(4)
+    if len(header) < 4:
+        break
+    source = sys.stdin.buffer.read(struct.unpack(">i", header)[0])
+    time.sleep(float(os.environ.get("FAKE_JAVA_DELAY", "0")))
+    result = b"worker:" + source
+    sys.stdout.buffer.write(bytes([0]) + struct.pack(">i", len(result)) + result)
+    sys.stdout.buffer.flush()
+    frames -= 1
+'''
+
+@pytest.fixture
+def fake_java(tmp_path, monkeypatch):
+    script = tmp_path / "fake_java.py"
+    script.write_text(FAKE_JAVA)
+    java = tmp_path / "java"
+    java.write_text(f"#!/bin/sh\nexec {sys.executable} {script} \"$@\"\n")
+    java.chmod(java.stat().st_mode | stat.S_IEXEC)
+    jar = tmp_path / "google-java-format.jar"
+    jar.write_bytes(b"")
+    log = tmp_path / "starts.log"
+    monkeypatch.setenv("FAKE_JAVA_LOG", str(log))
+
+    def formatter(workers, timeout=10):
+        return AsyncJavaFormatter(jar_path=str(jar), java=str(java), timeout=timeout, workers=workers)
+
+    def starts():
+        return log.read_text().split() if log.exists() else []
+
+    return formatter, starts
+
+def format_all(formatter, sources):
+    async def run():
+        try:
+            return await asyncio.wait_for(formatter.format_many(sources), 30)
+        finally:
+            await formatter.close()
+    return asyncio.run(run())
+
+def test_concurrent_formats_share_at_most_workers_jvms(fake_java, monkeypatch):
+    formatter, starts = fake_java
+    monkeypatch.setenv("FAKE_JAVA_DELAY", "0.05")
+    sources = [f"class C{index} {{}}" for index in range(8)]
+
+    assert format_all(formatter(workers=2), sources) == [f"worker:{source}" for source in sources]
+    assert starts() == ["worker", "worker"]
+
+def test_dead_worker_is_replaced_for_waiting_callers(fake_java, monkeypatch):
+    formatter, starts = fake_java
+    monkeypatch.setenv("FAKE_JAVA_FRAMES", "1")
+    sources = [f"class C{index} {{}}" for index in range(3)]
+
+    # The source in flight when a worker dies goes through the CLI; callers
+    # waiting for the only slot get a replacement worker instead of hanging
+    results = format_all(formatter(workers=1), sources)
+    assert all(result in (f"worker:{source}", f"cli:{source}") for result, source in zip(results, sources))
+    assert sum(result.startswith("worker:") for result in results) >= 2
+    assert starts().count("worker") >= 2
+
+def test_workers_that_never_answer_fall_back_to_the_cli(fake_java, monkeypatch):
+    formatter, starts = fake_java
+    monkeypatch.setenv("FAKE_JAVA_FRAMES", "0")
+    sources = [f"class C{index} {{}}" for index in range(4)]
+
+    assert format_all(formatter(workers=2), sources) == [f"cli:{source}" for source in sources]
+    assert starts().count("worker") <= 2
+
+class SlowBlockBatcher:
+    """EmbeddingBatcher stand-in that embeds blocks slowly and counts the
+    chunks of each family it has embedded"""
+
+    def __init__(self):
+        self.embedded = {"method": 0, "block": 0}
+
+    async def embed(self, chunks):
+        methods = sum(chunk.lstrip().startswith("public") for chunk in chunks)
+        if methods < len(chunks):
+            await asyncio.sleep(0.1)
+        self.embedded["method"] += methods
+        self.embedded["block"] += len(chunks) - methods
+        return bag_of_tokens(chunks)
+
+    async def close(self):
+        pass
+
+def test_scan_yields_method_groups_before_blocks_are_embedded(tmp_path, fake_java):
+    formatter, _ = fake_java
+    for index in range(4):
+        write_java(str(tmp_path / "repo"), f"p/C{index}.java", f"C{index}",
+                   [java_method(f"add{index}", ("left", "right", "sum", "combine", "Sum")),
+                    java_method(f"area{index}", ("width", "height", "area", "scale", "Area"))])
+
+    async def run():
+        batcher = SlowBlockBatcher()
+        progress = []
+        async for group, _ in scan_directory_async(str(tmp_path / "repo"), use_formatting=False, batch_size=2,
+                                                   formatter=formatter(workers=1), batcher=batcher):
+            progress.append((group[0].kind, dict(batcher.embedded)))
+        return progress
+
+    progress = asyncio.run(asyncio.wait_for(run(), 30))
+    kinds = [kind for kind, _ in progress]
+    assert kinds[:2] == ["method", "method"] and set(kinds[2:]) == {"block"}
+    # Every method is embedded before the first method group, most blocks are not
+    first_methods = progress[0][1]
+    assert first_methods["method"] == 8
+    assert first_methods["block"] < progress[-1][1]["block"]
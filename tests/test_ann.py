@@ -0,0 +1,18 @@
+import numpy as np
+
+from Duplicate_Tool.ann import LSHIndex
+
+def test_empty_index_has_no_neighbours(tmp_path):
+    index = LSHIndex().fit(np.empty((0, 16), dtype=np.float32))
+    queries = np.random.default_rng(0).standard_normal((3, 16)).astype(np.float32)
+    assert all(len(ids) == 0 and len(scores) == 0 for ids, scores in index.query(queries, k=5))
+
+    index.save(str(tmp_path / "ann.npz"))
+    loaded, _ = LSHIndex.load(str(tmp_path / "ann.npz"), np.empty((0, 16), dtype=np.float32))
+    assert all(len(ids) == 0 for ids, _ in loaded.query(queries, k=5))
+
+def test_query_finds_the_indexed_copy():
+    embeddings = np.random.default_rng(1).standard_normal((200, 16)).astype(np.float32)
+    index = LSHIndex().fit(embeddings)
+    (ids, scores), = index.query(embeddings[7:8], k=1)
+    assert ids.tolist() == [7] and scores[0] > 0.999
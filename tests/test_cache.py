@@ -0,0 +1,24 @@
+import numpy as np
+
+from Duplicate_Tool.cache import EmbeddingCache
+
+def vectors(count, dim=8):
+    return np.arange(count * dim, dtype=np.float32).reshape(count, dim)
+
+def test_full_cache_keeps_the_hits_of_a_mixed_batch(tmp_path):
+    cache = EmbeddingCache(str(tmp_path), "model", max_entries=4)
+    old = [f"int old{index}() {{ return {index}; }}" for index in range(4)]
+    cache.put_many(old, vectors(4))
+    assert len(cache) == 4
+
+    # Two hits and three misses, one more than the capacity left over
+    batch = old[:2] + [f"int new{index}() {{ return {index}; }}" for index in range(3)]
+    cache.put_many(batch, vectors(5) + 100)
+
+    assert len(cache) == 4
+    found = cache.get_many(batch)
+    assert sorted(found) == [0, 1, 2, 3]
+    np.testing.assert_array_equal(found[0], vectors(4)[0])
+    np.testing.assert_array_equal(found[2], (vectors(5) + 100)[2])
+    assert not cache.get_many(old[2:])
+    cache.close()
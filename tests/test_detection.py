@@ -0,0 +1,49 @@
+from conftest import java_method, write_java
+
+from Duplicate_Tool.chunker import METHOD_KINDS
+from Duplicate_Tool.detection import _innermost_enclosing, extract_code_chunks, find_duplicate_groups
+from Duplicate_Tool.scanner import scan_directory
+
+SOURCE = """public class Nested {
+    public void run(java.util.List<Integer> xs) {
+        xs.forEach(x -> {
+            if (x > 0) {
+                System.out.println(x);
+                System.out.println(x + 1);
+            }
+        });
+        while (xs.size() > 0) {
+            xs.remove(0);
+            xs.remove(1);
+        }
+    }
+}
+"""
+
+def test_blocks_belong_to_their_innermost_method():
+    records = extract_code_chunks(SOURCE, use_formatting=False)
+    methods = [record for record in records if record.kind in METHOD_KINDS]
+    blocks = [record for record in records if record.kind not in METHOD_KINDS]
+    enclosing = _innermost_enclosing(blocks, methods)
+
+    expected = [min((method for method in methods
+                     if method.start_offset <= block.start_offset and block.end_offset <= method.end_offset),
+                    key=lambda method: method.end_offset - method.start_offset)
+                for block in blocks]
+    assert enclosing == expected
+    assert {method.kind for method in enclosing} == {"method", "lambda"}
+
+def test_prefiltered_clones_join_reworded_copies(tmp_path, fake_encoder):
+    words = ("left", "right", "sum", "combine", "Sum")
+    # add and plus are lexical clones, the extra branch makes the third a Type-3 one
+    reworded = java_method("total", words).replace(
+        "        return sum;", "        if (sum < 0) {\n            sum = -sum;\n        }\n        return sum;")
+    methods = [java_method("add", words), java_method("plus", words), reworded]
+
+    (group, similarity), = find_duplicate_groups(methods, 0.9, prefilter=True)
+    assert group == methods and similarity > 0.9
+
+    write_java(str(tmp_path), "C.java", "C", methods)
+    groups = scan_directory(str(tmp_path), use_formatting=False, workers=1, prefilter=True)
+    method_groups = [group for group, _ in groups if group[0].kind == "method"]
+    assert [[chunk.start_line for chunk in group] for group in method_groups] == [[2, 12, 22]]
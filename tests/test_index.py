@@ -0,0 +1,113 @@
+import os
+
+import pytest
+from conftest import java_method, write_java
+
+from Duplicate_Tool.index import DuplicateIndex
+
+WORDS = [
+    ("left", "right", "sum", "combine", "Sum"),
+    ("width", "height", "area", "scale", "Area"),
+    ("count", "step", "ticks", "advance", "Ticks"),
+    ("price", "rate", "cost", "discount", "Cost"),
+    ("rows", "cols", "cells", "visit", "Cells"),
+]
+
+def make_tree(root):
+    write_java(root, "a/One.java", "One", [java_method("add", WORDS[0]), java_method("area", WORDS[1])])
+    write_java(root, "a/b/Two.java", "Two", [java_method("plus", WORDS[0]), java_method("ticks", WORDS[2])])
+    write_java(root, "a/b/Three.java", "Three", [java_method("cost", WORDS[3]), java_method("surface", WORDS[1])])
+
+def group_sets(index):
+    return {frozenset((chunk.path, chunk.start_line, chunk.end_line) for chunk in group.chunks)
+            for group in index.groups()}
+
+def chunk_set(index):
+    return {(chunk.path, chunk.kind, chunk.start_line, chunk.end_line, chunk.hash) for chunk in index.chunks()}
+
+def open_index(path, root):
+    return DuplicateIndex(str(path), str(root), use_formatting=False, workers=1)
+
+def test_update_matches_fresh_build(tmp_path, fake_encoder):
+    root = tmp_path / "repo"
+    make_tree(str(root))
+    index = open_index(tmp_path / "index", root)
+    index.build()
+    assert group_sets(index)
+
+    # Copy a method into one file, change another and delete a third
+    write_java(str(root), "a/One.java", "One",
+               [java_method("add", WORDS[0]), java_method("area", WORDS[1]), java_method("costs", WORDS[3])])
+    write_java(str(root), "a/b/Two.java", "Two", [java_method("plus", WORDS[4]), java_method("ticks", WORDS[2])])
+    os.remove(os.path.join(str(root), "a", "b", "Three.java"))
+    index.update(changed=["a/One.java", "a/b/Two.java"], deleted=["a/b/Three.java"])
+
+    fresh = open_index(tmp_path / "fresh", root)
+    fresh.build()
+    assert chunk_set(index) == chunk_set(fresh)
+    assert group_sets(index) == group_sets(fresh)
+    index.close()
+    fresh.close()
+
+def test_refresh_picks_up_changed_files(tmp_path, fake_encoder):
+    root = tmp_path / "repo"
+    make_tree(str(root))
+    index = open_index(tmp_path / "index", root)
+    index.refresh()
+    write_java(str(root), "a/Four.java", "Four", [java_method("rates", WORDS[3])])
+    update = index.refresh()
+
+    # The new copy joins its method and its loop block to Three's
+    assert {group.family for group in update.added} == {"method", "block"}
+    for group in update.added:
+        assert sorted({chunk.path for chunk in group.chunks}) == ["a/Four.java", "a/b/Three.java"]
+    assert not index.refresh().added
+    index.close()
+
+def test_reopening_with_another_root_is_rejected(tmp_path, fake_encoder):
+    root = tmp_path / "repo"
+    make_tree(str(root))
+    open_index(tmp_path / "index", root).close()
+    other = tmp_path / "other"
+    other.mkdir()
+    with pytest.raises(ValueError, match="root"):
+        open_index(tmp_path / "index", other)
+
+@pytest.mark.parametrize("search", ["exact", "lsh"])
+def test_query_finds_indexed_copies(tmp_path, fake_encoder, search):
+    root = tmp_path / "repo"
+    make_tree(str(root))
+    index = DuplicateIndex(str(tmp_path / "index"), str(root), use_formatting=False, workers=1, search=search)
+    index.build()
+
+    (chunk, similarity), = index.query(java_method("addAll", WORDS[0]), k=1)
+    assert chunk.kind == "method" and chunk.path in ("a/One.java", "a/b/Two.java")
+    assert similarity > 0.95
+
+    # A file in the tree is matched against the other files only
+    results = index.query_file(os.path.join(str(root), "a", "One.java"), k=3, threshold=0.95)
+    add = next(result for result in results if result.chunk.kind == "method" and "add(" in result.chunk.code)
+    assert {match.path for match, _ in add.matches} == {"a/b/Two.java"}
+    assert add.matches[0][0].kind == "method"
+    index.close()
+
+def test_emptying_an_lsh_index(tmp_path, fake_encoder):
+    root = tmp_path / "repo"
+    make_tree(str(root))
+    index = DuplicateIndex(str(tmp_path / "index"), str(root), use_formatting=False, workers=1, search="lsh")
+    index.refresh()
+    assert (tmp_path / "index" / "ann.npz").exists()
+
+    for path in ("a/One.java", "a/b/Two.java", "a/b/Three.java"):
+        os.remove(os.path.join(str(root), path))
+    update = index.refresh()
+    assert update.removed and not index.groups() and len(index) == 0
+    assert not (tmp_path / "index" / "ann.npz").exists()
+    assert index.query(java_method("add", WORDS[0])) == []
+
+    # Files added again bring the tables back
+    make_tree(str(root))
+    index.refresh()
+    assert index.query(java_method("add", WORDS[0]), k=1)
+    assert (tmp_path / "index" / "ann.npz").exists()
+    index.close()
@@ -0,0 +1,56 @@
+import gzip
+import json
+
+from conftest import java_method, write_java
+
+from Duplicate_Tool.index import DuplicateIndex
+from Duplicate_Tool.report import write_report
+from Duplicate_Tool.scanner import scan_directory
+from Duplicate_Tool.streaming import iter_duplicate_groups
+
+def make_tree(root):
+    words = ("left", "right", "sum", "combine", "Sum")
+    # The comment is blanked at extraction, so hashing the raw file text
+    # would give this copy a different hash
+    write_java(root, "a/One.java", "One", [java_method("add", words, comment="keeps the running total")])
+    write_java(root, "b/Two.java", "Two", [java_method("plus", words)])
+
+def chunks_of(path):
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", encoding="utf-8") as f:
+        return {(chunk["path"], chunk["kind"], chunk["start_line"], chunk["end_line"], chunk["hash"])
+                for line in f for chunk in json.loads(line)["chunks"]}
+
+def test_scanned_streamed_and_indexed_hashes_agree(tmp_path, fake_encoder):
+    root = str(tmp_path / "repo")
+    make_tree(root)
+    options = dict(use_formatting=False, workers=1)
+    scanned = str(tmp_path / "scan.jsonl")
+    streamed = str(tmp_path / "stream.jsonl.gz")
+    assert write_report(scan_directory(root, **options), scanned, root=root)
+    assert write_report(iter_duplicate_groups(root, **options), streamed, root=root)
+
+    assert chunks_of(scanned) == chunks_of(streamed)
+
+    index = DuplicateIndex(str(tmp_path / "index"), root, **options)
+    index.build()
+    indexed = {(chunk.path, chunk.kind, chunk.start_line, chunk.end_line, chunk.hash) for chunk in index.chunks()}
+    assert chunks_of(scanned) <= indexed
+    index.close()
+
+def test_sarif_report_is_one_valid_log(tmp_path, fake_encoder):
+    root = str(tmp_path / "repo")
+    make_tree(root)
+    path = str(tmp_path / "duplicates.sarif")
+    written = write_report(iter_duplicate_groups(root, use_formatting=False, workers=1), path, "sarif", root=root)
+
+    with open(path, encoding="utf-8") as f:
+        log = json.load(f)
+    results = log["runs"][0]["results"]
+    assert len(results) == written
+    for result in results:
+        located = result["locations"] + result["relatedLocations"]
+        assert {location["physicalLocation"]["artifactLocation"]["uri"] for location in located} == \
+            {"a/One.java", "b/Two.java"}
+        assert all(location["physicalLocation"]["artifactLocation"]["uriBaseId"] == "SRCROOT"
+                   for location in located)
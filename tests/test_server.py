@@ -0,0 +1,94 @@
+import asyncio
+import json
+
+from conftest import java_method, write_java
+
+from Duplicate_Tool.index import DuplicateIndex
+from Duplicate_Tool.server import DetectionServer, request
+
+WORDS = ("left", "right", "sum", "combine", "Sum")
+
+def make_index(tmp_path):
+    root = str(tmp_path / "repo")
+    write_java(root, "a/One.java", "One", [java_method("add", WORDS)])
+    write_java(root, "b/Two.java", "Two", [java_method("plus", WORDS)])
+    index = DuplicateIndex(str(tmp_path / "index"), root, use_formatting=False, workers=1)
+    index.build()
+    return index
+
+def call(server, method, path, payload=None):
+    async def run():
+        try:
+            return await server.handle(method, path, json.dumps(payload).encode() if payload is not None else b"")
+        finally:
+            await server.batcher.close()
+    return asyncio.run(run())
+
+def test_detect_groups_duplicates_in_one_source(fake_encoder):
+    server = DetectionServer(use_formatting=False, window=0)
+    code = "public class C {\n" + java_method("add", WORDS) + "\n" + java_method("plus", WORDS) + "\n}\n"
+    status, body = call(server, "POST", "/detect", {"code": code, "detect_intra_method": False})
+
+    assert status == 200
+    (group,) = body["groups"]
+    assert [chunk["start_line"] for chunk in group["chunks"]] == [2, 11]
+
+def test_errors_are_reported_as_json(fake_encoder):
+    server = DetectionServer(use_formatting=False, window=0)
+    assert call(server, "POST", "/detect", {})[0] == 400
+    assert call(server, "POST", "/query", {"code": "int x;"})[0] == 400
+    assert call(server, "GET", "/missing")[0] == 404
+    status, body = asyncio.run(server.handle("POST", "/detect", b"{not json"))
+    assert status == 400 and "error" in body
+
+def test_query_over_a_unix_socket(tmp_path, fake_encoder):
+    index = make_index(tmp_path)
+    server = DetectionServer(index=index, use_formatting=False, window=0)
+    socket_path = str(tmp_path / "server.sock")
+
+    async def run():
+        serving = asyncio.ensure_future(server.serve(unix_socket=socket_path))
+        loop = asyncio.get_running_loop()
+        try:
+            for _ in range(100):
+                if (tmp_path / "server.sock").exists():
+                    break
+                await asyncio.sleep(0.01)
+            health = await loop.run_in_executor(None, lambda: request("/health", unix_socket=socket_path))
+            query = await loop.run_in_executor(None, lambda: request(
+                "/query", {"code": java_method("sum", WORDS), "k": 2}, unix_socket=socket_path))
+            return health, query
+        finally:
+            serving.cancel()
+            await server.batcher.close()
+
+    health, query = asyncio.run(asyncio.wait_for(run(), 30))
+    assert health == {"status": "ok", "indexed_chunks": len(index)}
+    assert {match["path"] for match in query["matches"]} == {"a/One.java", "b/Two.java"}
+    index.close()
+
+def test_methods_only_detect_matches_the_library(fake_encoder):
+    from Duplicate_Tool.detection import detect_duplicate_groups_enhanced
+    from Duplicate_Tool.preprocessing import normalize_whitespace
+
+    # Near-identical lambdas inside otherwise unrelated methods
+    lambdas = "\n".join(
+        f"    public void {name}(java.util.List<Integer> {xs}) {{\n"
+        f"        {setup}\n"
+        f"        {xs}.forEach(x -> {{\n"
+        f"            int total = x * {factor} + x;\n"
+        "            System.out.println(\"Product computed: \" + total);\n"
+        "        });\n"
+        "    }"
+        for name, xs, factor, setup in (("report", "xs", 2, "java.util.Collections.sort(xs);"),
+                                        ("audit", "ys", 3, "if (ys.isEmpty()) throw new IllegalStateException();")))
+    code = "public class C {\n" + java_method("add", WORDS) + "\n" + java_method("plus", WORDS) + "\n" + lambdas + "\n}\n"
+    server = DetectionServer(use_formatting=False, window=0)
+    status, body = call(server, "POST", "/detect", {"code": code, "detect_intra_method": False})
+
+    expected = detect_duplicate_groups_enhanced(code, detect_intra_method=False, use_formatting=False)
+    assert status == 200
+    assert [[chunk["kind"] for chunk in group["chunks"]] for group in body["groups"]] == [["method", "method"]]
+    # The library strips indentation when it does not format
+    assert [[normalize_whitespace(chunk["code"]) for chunk in group["chunks"]] for group in body["groups"]] == \
+        [[normalize_whitespace(chunk) for chunk in group] for group, _ in expected]